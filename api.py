@@ -1,29 +1,94 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from main import agent
+from fastapi.responses import StreamingResponse
+from src.chat_session import ChatSessions
+from src.character import Character
+from src.errors import UnknownCharacter
+from src.openai_helpers.async_client import get_client
+from src.openai_helpers.embedding_cache import get_embedding_cache
+from src.openai_helpers.completion_cache import get_completion_cache
+from main import runtime
+
+import os
+import json
 
 app = FastAPI()
 
 app.add_middleware(CORSMiddleware, allow_origins=["*"])
 
+sessions = ChatSessions(
+  max_concurrent_turns=int(os.getenv('CHAT_MAX_CONCURRENT_TURNS', 8)),
+  idle_timeout=float(os.getenv('CHAT_SESSION_TIMEOUT', 3600))
+)
+
+def get_character(name: str) -> Character:
+  try:
+    return runtime.get(name)
+  except UnknownCharacter as error:
+    raise HTTPException(status_code=404, detail=error.message)
+
 @app.get("/")
-def read_root():
+async def read_root():
   return {"Hello": "World"}
 
+@app.get("/characters")
+async def list_characters():
+  return {"characters": runtime.names}
+
+@app.get("/metrics")
+async def metrics():
+  completion_cache = get_completion_cache()
+
+  return {
+    "openai": get_client().stats.snapshot(),
+    "embedding_cache": get_embedding_cache().stats(),
+    "completion_cache": completion_cache.stats() if completion_cache is not None else None
+  }
+
 @app.get("/chat")
-def chat(message, speaker):
+async def chat(message, speaker, character="Monika", session_id=None):
   print(message, speaker)
-  
-  list_of_responses = agent.chat(speaker, message)
-  
+
+  agent = get_character(character)
+  session_id = session_id or speaker
+
+  async with sessions.turn(f'{character}:{session_id}') as session:
+    list_of_responses = await agent.achat(speaker, message, session)
+
   for [pose, response] in list_of_responses:
     print(f'{pose}: {response}')
 
   return {
     "character": agent.character_data.name,
+    "session_id": session_id,
     "responses": list_of_responses
   }
-  
+
+@app.get("/chat/stream")
+async def chat_stream(message, speaker, character="Monika", session_id=None):
+  print(message, speaker)
+
+  agent = get_character(character)
+  session_id = session_id or speaker
+
+  async def events():
+    async with sessions.turn(f'{character}:{session_id}') as session:
+      try:
+        async for [pose, response] in agent.astream_chat(speaker, message, session):
+          print(f'{pose}: {response}')
+          yield f'data: {json.dumps({"pose": pose, "response": response})}\n\n'
+      except Exception as error:
+        yield f'event: error\ndata: {json.dumps({"error": str(error)})}\n\n'
+        return
+
+    yield f'event: end\ndata: {json.dumps({"character": agent.character_data.name, "session_id": session_id})}\n\n'
+
+  return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.delete("/session/{session_id}")
+async def end_session(session_id, character="Monika"):
+  return {"ended": sessions.end(f'{character}:{session_id}')}
+
 if __name__ == '__main__':
   import uvicorn
-  uvicorn.run(app, host='localhost', port=8080)
\ No newline at end of file
+  uvicorn.run(app, host='localhost', port=8080)
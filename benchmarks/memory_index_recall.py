@@ -0,0 +1,108 @@
+"""
+Recall and latency of the IVF memory index against the exact scan.
+
+Run from the project root:
+  python -m benchmarks.memory_index_recall --memories 100000 --dimensions 1536
+"""
+from src.agent_memory.memory import MemoryEntry, MemoryKind
+from src.agent_memory.memory_matrix import MemoryMatrix
+from src.agent_memory.memory_index import IVFIndex
+
+import argparse
+import datetime
+import time
+import numpy as np
+
+
+def build_matrix(memories: int, dimensions: int, topics: int, noise: float, generator: np.random.Generator) -> MemoryMatrix:
+  """ Fills a matrix with clustered synthetic embeddings, random importance and random access times. """
+  centers = generator.standard_normal((topics, dimensions)).astype(np.float32)
+  topic_of = generator.integers(0, topics, memories)
+  now = datetime.datetime.now()
+
+  matrix = MemoryMatrix(initial_capacity=memories)
+
+  for start in range(0, memories, 10000):
+    entries = []
+    for i in range(start, min(start + 10000, memories)):
+      vector = centers[topic_of[i]] + generator.standard_normal(dimensions).astype(np.float32) * noise
+      entries.append(MemoryEntry(
+        f'memory {i}', float(generator.integers(1, 11)), MemoryKind.OBSERVATION, _id=str(i), embedding=vector,
+        accessed_at=now - datetime.timedelta(hours=float(generator.uniform(0, 24 * 30)))
+      ))
+    matrix.add_many(entries)
+
+  return matrix
+
+
+def top_k(scores: np.ndarray, rows: np.ndarray, k: int) -> set[int]:
+  """ Returns the k rows with the highest score. """
+  if len(scores) <= k:
+    return set(rows.tolist())
+
+  return set(rows[np.argpartition(-scores, k - 1)[:k]].tolist())
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--memories', type=int, default=100000)
+  parser.add_argument('--dimensions', type=int, default=1536)
+  parser.add_argument('--topics', type=int, default=2000)
+  parser.add_argument('--noise', type=float, default=1.5)
+  parser.add_argument('--queries', type=int, default=200)
+  parser.add_argument('--k', type=int, default=70)
+  parser.add_argument('--n-probe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+  args = parser.parse_args()
+
+  generator = np.random.default_rng(0)
+
+  started = time.perf_counter()
+  matrix = build_matrix(args.memories, args.dimensions, args.topics, args.noise, generator)
+  print(f'Built {len(matrix)} memories in {time.perf_counter() - started:.2f}s')
+
+  index = IVFIndex(matrix, train_threshold=0)
+  started = time.perf_counter()
+  index.train().result()
+  print(f'Trained the index in {time.perf_counter() - started:.2f}s')
+
+  queries = matrix.embeddings[generator.choice(len(matrix), args.queries, replace=False)]
+  queries = queries + generator.standard_normal(queries.shape).astype(np.float32) * .02
+  all_rows = np.arange(len(matrix))
+
+  exact_results = []
+  exact_relevance = []
+  started = time.perf_counter()
+  for query in queries:
+    exact_results.append(top_k(matrix.score(query), all_rows, args.k))
+  exact_latency = (time.perf_counter() - started) / args.queries * 1000
+
+  for query in queries:
+    exact_relevance.append(top_k(matrix.embeddings @ query, all_rows, args.k))
+
+  print('\nRecall of the retrieval value (recency + importance + relevance) and of relevance alone')
+  print(f'exact       recall 1.000  relevance recall 1.000  {exact_latency:8.3f} ms/query')
+
+  for n_probe in args.n_probe:
+    index.n_probe = n_probe
+    hits = 0
+    relevance_hits = 0
+    scanned = 0
+
+    started = time.perf_counter()
+    for query, expected in zip(queries, exact_results):
+      rows = index.candidates(query, args.k)
+      hits += len(top_k(matrix.score(query, rows), rows, args.k) & expected)
+      scanned += len(rows)
+    latency = (time.perf_counter() - started) / args.queries * 1000
+
+    for query, expected in zip(queries, exact_relevance):
+      rows = index.candidates(query, args.k)
+      relevance_hits += len(top_k(matrix.embeddings[rows] @ query, rows, args.k) & expected)
+
+    recall = hits / (args.k * args.queries)
+    relevance_recall = relevance_hits / (args.k * args.queries)
+    print(f'n_probe={n_probe:<4} recall {recall:.3f}  relevance recall {relevance_recall:.3f}  '
+          f'{latency:8.3f} ms/query  {scanned / args.queries:9.0f} scored')
+
+if __name__ == '__main__':
+  main()
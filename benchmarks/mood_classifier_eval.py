@@ -0,0 +1,66 @@
+"""
+Agreement with the LLM and latency of the local mood classifier, measured on a log of LLM decisions.
+
+Run from the project root, with the decision log written by MoodAnalyzer:
+  python -m benchmarks.mood_classifier_eval --log Monika_mood_decisions.jsonl
+"""
+from src.decision_making.local_mood_classifier import LocalMoodClassifier, load_decisions, split_decisions
+
+import argparse
+import time
+import numpy as np
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--log', required=True)
+  parser.add_argument('--test-fraction', type=float, default=.2)
+  parser.add_argument('--thresholds', type=float, nargs='+', default=[0., .3, .4, .5, .6, .7, .8, .9])
+  parser.add_argument('--sharpness', type=float, default=20.)
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+
+  texts, poses = load_decisions(args.log)
+  if len(texts) < 10:
+    print(f'{args.log} holds {len(texts)} decisions, not enough to evaluate the classifier')
+    return
+
+  test, train = split_decisions(len(texts), args.test_fraction, args.seed)
+
+  classifier = LocalMoodClassifier(sharpness=args.sharpness, min_examples=1)
+
+  started = time.perf_counter()
+  classifier.fit([texts[i] for i in train], [poses[i] for i in train])
+  print(f'Trained on {len(train)} decisions in {(time.perf_counter() - started) * 1000:.1f} ms, testing on {len(test)}')
+
+  test_texts = [texts[i] for i in test]
+  expected = [poses[i] for i in test]
+
+  started = time.perf_counter()
+  predictions = classifier.predict(test_texts)
+  batch_latency = (time.perf_counter() - started) / len(test) * 1000
+
+  started = time.perf_counter()
+  for text in test_texts:
+    classifier.predict([text])
+  single_latency = (time.perf_counter() - started) / len(test) * 1000
+
+  chosen = [pose for pose, _ in predictions]
+  confidences = np.array([confidence for _, confidence in predictions])
+  pose_hits = np.array([pose == truth for pose, truth in zip(chosen, expected)])
+  mood_hits = np.array([pose.split(' ')[0] == truth.split(' ')[0] for pose, truth in zip(chosen, expected)])
+  arm_hits = np.array([pose.split(' ')[1] == truth.split(' ')[1] for pose, truth in zip(chosen, expected)])
+
+  print(f'\nAgreement with the LLM: mood {mood_hits.mean():.3f}  arm {arm_hits.mean():.3f}  both {pose_hits.mean():.3f}')
+  print(f'Latency: {single_latency:.3f} ms/sentence alone, {batch_latency:.3f} ms/sentence batched')
+
+  print('\nHybrid mode: sentences kept local and their agreement with the LLM, per confidence threshold')
+  for threshold in args.thresholds:
+    local = confidences >= threshold
+    agreement = pose_hits[local].mean() if local.any() else float('nan')
+    print(f'threshold={threshold:<5} local {local.mean():.3f}  agreement {agreement:.3f}  '
+          f'overall agreement {(pose_hits | ~local).mean():.3f}')
+
+
+if __name__ == '__main__':
+  main()
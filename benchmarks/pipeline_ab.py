@@ -0,0 +1,89 @@
+"""
+Latency, requests and tokens per chat turn of the "multi-call" and "turn-analysis" pipeline modes.
+
+Every message is sent once in each mode, alternating the modes, each mode in its own chat session. The background
+memory work of a turn finishes before the next turn starts, and the maintenance tasks are disabled, so the counters
+of a turn only hold its own requests. The character keeps its memories in its own store, under --workdir.
+
+Run from the project root, with the OpenAI settings of the .env file:
+  python -m benchmarks.pipeline_ab --turns 10
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+MESSAGES = [
+  'Hi Monika!',
+  'How was the literature club today?',
+  'I wrote a poem about the ocean, do you want to read it?',
+  'Do you remember what happened with Sayori?',
+  'What are you reading lately?',
+  'I have been feeling a bit down this week.',
+  'Can you recommend me a book?',
+  'Do you ever think about the game?',
+  'What do you want to do this weekend?',
+  'Goodnight, see you tomorrow.'
+]
+
+MODES = ['multi-call', 'turn-analysis']
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--turns', type=int, default=len(MESSAGES))
+  parser.add_argument('--character', default='Monika')
+  parser.add_argument('--workdir', default='pipeline_ab')
+  args = parser.parse_args()
+
+  for setting in ('BIO_REFRESH_MEMORIES', 'STATUS_REFRESH_MEMORIES', 'STATUS_REFRESH_TOKENS', 'STATUS_REFRESH_INTERVAL',
+                  'REFLECTION_MEMORIES', 'REFLECTION_TOKENS'):
+    os.environ[setting] = '0'
+
+  sys.path.insert(0, os.getcwd())
+  os.makedirs(args.workdir, exist_ok=True)
+  os.chdir(args.workdir)
+
+  from data import characters
+  from src.character import Character
+  from src.chat_session import ChatSession
+  from src.openai_helpers.async_client import get_client
+
+  agent = Character(args.character, **characters[args.character])
+  agent.join_background_work()
+  sessions = {mode: ChatSession(mode) for mode in MODES}
+  results = {mode: {'latency': [], 'requests': [], 'tokens': []} for mode in MODES}
+
+  for turn in range(args.turns):
+    message = MESSAGES[turn % len(MESSAGES)]
+    modes = MODES if turn % 2 == 0 else MODES[::-1]
+
+    for mode in modes:
+      agent.pipeline_mode = mode
+      before = get_client().stats.snapshot()
+
+      started = time.perf_counter()
+      agent.chat('Player', message, sessions[mode])
+      latency = time.perf_counter() - started
+
+      agent.join_background_work()
+
+      after = get_client().stats.snapshot()
+
+      results[mode]['latency'].append(latency)
+      results[mode]['requests'].append(after['requests'] - before['requests'])
+      results[mode]['tokens'].append(after['tokens'] - before['tokens'])
+
+      print(f'turn {turn + 1:<3} {mode:<14} {latency:6.2f} s  {results[mode]["requests"][-1]:3} requests  '
+            f'{results[mode]["tokens"][-1]:6} tokens')
+
+  print(f'\n{"mode":<14} {"p50 s":>7} {"p95 s":>7} {"mean s":>7} {"requests":>9} {"tokens":>8}   (per turn)')
+  for mode in MODES:
+    latency = np.array(results[mode]['latency'])
+    print(f'{mode:<14} {np.percentile(latency, 50):7.2f} {np.percentile(latency, 95):7.2f} {latency.mean():7.2f} '
+          f'{np.mean(results[mode]["requests"]):9.1f} {np.mean(results[mode]["tokens"]):8.0f}')
+
+
+if __name__ == '__main__':
+  main()
@@ -45,5 +45,14 @@ monika = {
   She is committed, always giving her best taking care of her well-being and that of others.
   She uses her charm and attractiveness to capture the player's attention, also to flirt/tease him.
   She is patient and understanding, knows how to listen and help others.
-  """)
+  """),
+
+  "initial_status": "Monika have afraid and doesn't know what is happening, she is trying to figure out what is happening.",
+
+  "initial_location": "Club Room"
+}
+
+# The characters served by the API, by name. To add a character, define it like Monika above and register it here.
+characters = {
+  'Monika': monika
 }
\ No newline at end of file
@@ -1,6 +1,6 @@
-from src.character import Character
+from src.character_runtime import CharacterRuntime
 from dotenv import load_dotenv
-from data import monika
+from data import characters
 
 import os
 import openai
@@ -9,9 +9,13 @@ load_dotenv()
 
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
-agent = Character('Monika', monika['bio'], monika['abilities'], monika['memories'], monika['traits'], initial_location="Club Room")
+runtime = CharacterRuntime(characters, 'log')
+
+runtime.load_all()
+
+agent = runtime.get('Monika')
 
 if __name__ == '__main__':
   while True:
     user_input = input('> ')
-    print(agent.chat('Ikaros', user_input))
\ No newline at end of file
+    print(agent.chat('Ikaros', user_input))
@@ -1,18 +1,30 @@
+from .. import prompts
 from ..character_data import CharacterDetails
-from .memory import MemoryEntry, MemoryKind
+from .memory import MemoryEntry, MemoryKind, backfill_embeddings
+from .memory_matrix import MemoryMatrix
+from .memory_index import create_memory_index
 from ..custom_logger import CustomLogger
 from ..agent_memory_manager import AgentMemoryManager
 from ..openai_helpers.chat_completion import chat_completion
-from openai.embeddings_utils import get_embedding, cosine_similarity
-from ..decision_making.thread_decorator import threaded
+from ..openai_helpers.embedding import embed, aembed
+from ..decision_making.thread_decorator import threaded, fan_out, gather
 
-import textwrap
+from typing import Literal as literal
+
+import re
+import asyncio
+import threading
+
+RETRIEVAL_LIMIT = 70
+DEFAULT_IMPORTANCE = 5.
+RATING_BATCH_SIZE = 20
 
 
 class AgentMemory:
   """ Manages the agent's memory stream. """
 
-  def __init__(self, initial_memories: list[str], character_data: CharacterDetails, logger: CustomLogger, memory_db: AgentMemoryManager) -> None:
+  def __init__(self, initial_memories: list[str], character_data: CharacterDetails, logger: CustomLogger, memory_db: AgentMemoryManager,
+               index_mode: literal["exact", "ivf"] = "ivf", n_probe: int = 8) -> None:
     """
     Initialize the AgentMemory with initial memories, character data, logger, and memory database manager.
 
@@ -29,41 +41,123 @@ class AgentMemory:
 
     memory_db : AgentMemoryManager
         Database manager for storing and retrieving memories.
+
+    index_mode : literal["exact", "ivf"], optional
+        The index used to select the memories scored on retrieval, by default "ivf".
+
+    n_probe : int, optional
+        The number of clusters scored per query by the "ivf" index, by default 8. Higher values trade latency for recall.
     """
     self._character_data = character_data
     self._logger = logger
     self._memory_db = memory_db
 
     self._all_memories: list[MemoryEntry] = []
+    self._memories_lock = threading.Lock()
+    self._version = 0
     self._is_initial_run: bool = True
 
+    self._matrix = MemoryMatrix()
+    self._index = create_memory_index(index_mode, self._matrix, path=memory_db.index_file, n_probe=n_probe, logger=logger)
+    self._pending_memories: list[MemoryEntry] = []
+    self._pending_lock = threading.Lock()
+
     self._logger.agent_info("Initializing memories")
 
-    _ = [self._load_initial_memories(initial_memories[i: i + 5]) for i in range(0, len(initial_memories), 5)]
+    new_memories = [
+      memory
+      for chunk in gather([self._find_new_memories(initial_memories[i: i + 5]) for i in range(0, len(initial_memories), 5)])
+      for memory in chunk
+    ]
+
+    self._is_initial_run = len(new_memories) > 0
+
+    if new_memories:
+      self.record_memories(new_memories)
 
-    for stored_memory in self._memory_db.retrieve_all_memories():
-      self._all_memories.append(MemoryEntry(**stored_memory))
+    # Only the "mongodb" mode reads the embeddings apart from the rest of the memories, the other modes read the
+    # whole store at once, so the embeddings are taken from the same rows.
+    streams_embeddings = self._memory_db.storage_mode == "mongodb"
+
+    known_ids = {memory.id for memory in self._all_memories}
+    stored_memories = [
+      MemoryEntry(**stored_memory)
+      for stored_memory in self._memory_db.retrieve_all_memories(include_embeddings=not streams_embeddings)
+    ]
+    stored_memories = [memory for memory in stored_memories if memory.id not in known_ids]
+
+    with self._memories_lock:
+      self._all_memories.extend(stored_memories)
+      self._version += len(stored_memories)
+
+    if streams_embeddings:
+      self._load_stored_embeddings(stored_memories)
+    else:
+      self._index_memories(stored_memories)
+
+    self._index.load()
+    self._index.add()
+
+  def _load_stored_embeddings(self, memories: list[MemoryEntry]) -> None:
+    """
+    Streams the stored embeddings of the given memories into the embedding matrix in batches.
+
+    Parameters
+    ----------
+    memories : list of MemoryEntry
+        The memories loaded without their embeddings.
+    """
+    memories_by_id = {memory.id: memory for memory in memories}
+
+    for batch in self._memory_db.iter_embeddings():
+      loaded = []
+
+      for memory_id, embedding in batch:
+        memory = memories_by_id.get(memory_id)
+
+        if memory is not None:
+          memory.embedding = embedding
+          loaded.append(memory)
+
+      self._matrix.add_many(loaded)
+
+    self._index_memories(memories)
 
   @threaded
-  def _load_initial_memories(self, memories) -> None:
+  def _find_new_memories(self, memories: list[str]) -> list[str]:
     """
-    Loads initial memories into the agent's memory stream.
+    Finds the initial memories that are not stored yet.
 
     Parameters
     ----------
     memories : list
-        A sublist of initial memories to load.
+        A sublist of initial memories to check.
+
+    Returns
+    -------
+    list[str]
+        The memories to record.
     """
+    new_memories = []
+
     for memory in memories:
       if self._memory_db.retrieve_memory(memory) is None:
-        self._is_initial_run = True
-        self.record_memory(memory)
+        new_memories.append(memory)
         self._logger.memory_info(f"Stored memory: {memory}")
         continue
 
-      self._is_initial_run = False
       self._logger.memory_info(f"Memory: {memory} already exists in the database")
 
+    return new_memories
+
+  def _store_memories(self, memories: list[MemoryEntry]) -> None:
+    """ Stores memories with a single write. A single memory, like an observation, goes through the insert buffer. """
+    if len(memories) == 1:
+      self._memory_db.store_memory(memories[0].as_dict())
+      return
+
+    self._memory_db.store_memories([memory.as_dict() for memory in memories])
+
   @property
   def memories(self) -> list[MemoryEntry]:
     """
@@ -72,11 +166,111 @@ class AgentMemory:
     Returns
     -------
     list of MemoryEntry
-        A sorted list of memory entries.
+        A sorted copy of the memory entries, memories may be recorded from other threads meanwhile.
+    """
+    with self._memories_lock:
+      return sorted(self._all_memories, key=lambda memory: memory.created_at.timestamp(), reverse=True)
+
+  @property
+  def version(self) -> int:
+    """ The version of the memory stream, it grows by one with every memory added and never decreases. """
+    with self._memories_lock:
+      return self._version
+
+  def _parse_rating(self, rating: str) -> float | None:
+    """ Parses a rating like 'Rating: 7', 'Rating: [7]' or '7', None if there is no number from 1 to 10. """
+    match = re.search(r'(\d+(?:\.\d+)?)', rating.split(':', 1)[-1])
+
+    if match is None or not 1 <= float(match.group(1)) <= 10:
+      return None
+
+    return float(match.group(1))
+
+  def _rate_memory(self, description: str) -> float:
+    """
+    Rates the significance of a memory from 1 to 10.
+
+    Parameters
+    ----------
+    description : str
+        Description of the memory.
+
+    Returns
+    -------
+    float
+        The importance of the memory, DEFAULT_IMPORTANCE if the response has no valid rating.
+    """
+    prompt = prompts.MEMORY_RATING.format(memory=description.strip())
+
+    importance, _ = chat_completion(prompt, self._character_data.bio, priority='background',
+                                    cache_if=lambda response: self._parse_rating(response) is not None)
+    rating = self._parse_rating(importance)
+
+    if rating is None:
+      self._logger.memory_warning(f"Memory > '{description}' > has no valid rating in > {importance!r}")
+      return DEFAULT_IMPORTANCE
+
+    return rating
+
+  def _rate_batch(self, descriptions: list[str]) -> list[float | None]:
+    """
+    Rates the significance of at most RATING_BATCH_SIZE memories from 1 to 10 with a single request.
+
+    Parameters
+    ----------
+    descriptions : list[str]
+        Descriptions of the memories.
+
+    Returns
+    -------
+    list[float or None]
+        The importance of every memory, in the same order as the descriptions, None if the response has no valid
+        rating for it.
+    """
+    prompt = prompts.MEMORY_RATINGS.format(
+      memories='\n'.join([f'#{i + 1}. {description.strip()}' for i, description in enumerate(descriptions)]))
+
+    response, _ = chat_completion(prompt, self._character_data.bio, priority='background')
+
+    ratings: list[float | None] = [None] * len(descriptions)
+    for line in response.strip().split('\n'):
+      match = re.match(r'^\s*#?(\d+)\s*[:.)-]\s*(.+)$', line)
+
+      if match is not None and 0 < int(match.group(1)) <= len(descriptions):
+        ratings[int(match.group(1)) - 1] = self._parse_rating(match.group(2))
+
+    return ratings
+
+  def _rate_memories(self, descriptions: list[str]) -> list[float]:
     """
-    self._all_memories.sort(key=lambda memory: memory.created_at.timestamp(), reverse=True)
+    Rates the significance of many memories from 1 to 10 with one request per RATING_BATCH_SIZE memories.
+    The memories without a valid rating in the responses are rated one by one.
 
-    return self._all_memories
+    Parameters
+    ----------
+    descriptions : list[str]
+        Descriptions of the memories.
+
+    Returns
+    -------
+    list[float]
+        The importance of every memory, in the same order as the descriptions.
+    """
+    if len(descriptions) == 1:
+      return [self._rate_memory(descriptions[0])]
+
+    chunks = [descriptions[i: i + RATING_BATCH_SIZE] for i in range(0, len(descriptions), RATING_BATCH_SIZE)]
+    batches = [self._rate_batch(chunks[0])] if len(chunks) == 1 else gather(fan_out(self._rate_batch, chunks))
+    ratings = [rating for batch in batches for rating in batch]
+
+    missing = [i for i, rating in enumerate(ratings) if rating is None]
+    if missing:
+      self._logger.memory_warning(f"{len(missing)} of {len(descriptions)} memories have no valid rating, rating them one by one")
+
+      for i, rating in zip(missing, gather(fan_out(self._rate_memory, [descriptions[i] for i in missing]))):
+        ratings[i] = rating
+
+    return ratings
 
   def record_memory(self, description: str, memory_kind: MemoryKind = MemoryKind.OBSERVATION, associated_memories: list[str] = None) -> None:
     """
@@ -93,61 +287,127 @@ class AgentMemory:
     associated_memories : list[str], optional
         List of associated memories.
     """
+    self.record_memories([description], memory_kind, [associated_memories or []])
+
+  def record_memories(self, descriptions: list[str], memory_kind: MemoryKind = MemoryKind.OBSERVATION,
+                      associated_memories: list[list[str]] | None = None) -> list[MemoryEntry]:
+    """
+    Records many memories in the agent's memory stream, rating them with a single request,
+    embedding them with a single request and storing them with a single write.
+
+    Parameters
+    ----------
+    descriptions : list[str]
+        Descriptions of the memories.
+
+    memory_kind : MemoryKind, optional
+        The kind of the memories, default is MemoryKind.OBSERVATION.
+
+    associated_memories : list[list[str]] or None, optional
+        The associated memories of every memory, by default none.
+
+    Returns
+    -------
+    list[MemoryEntry]
+        The recorded memories.
+    """
+    if not descriptions:
+      return []
+
     if associated_memories is None:
-      associated_memories = []
+      associated_memories = [[] for _ in descriptions]
+
+    importances = self._rate_memories(descriptions)
+
+    new_memories = []
+    for description, importance, references in zip(descriptions, importances, associated_memories):
+      self._logger.agent_info(f"Memory > '{description}' > was given a weight of > {importance:g}")
+      new_memories.append(MemoryEntry(description, importance, memory_kind, associated_memories=references))
+
+    backfill_embeddings(new_memories)
+
+    self._store_memories(new_memories)
+
+    with self._memories_lock:
+      self._all_memories.extend(new_memories)
+      self._version += len(new_memories)
+
+    self._matrix.add_many(new_memories)
+    self._index.add()
+
+    return new_memories
 
-    prompt = textwrap.dedent("""
-    On a scale from 1 to 10, where 1 is purely mundane (e.g. brushing teeth, making bed, walking the usual route)
-    and 10 is impactful (e.g., a breakup, college acceptance), rate the potential significance of the following memory. Only use integers.
+  def _index_memories(self, memories: list[MemoryEntry]) -> None:
+    """
+    Adds memories to the embedding matrix, memories without an embedding wait until the next retrieval.
 
-    Memory:
-    {}
+    Parameters
+    ----------
+    memories : list of MemoryEntry
+        The memories to index.
+    """
+    self._matrix.add_many([memory for memory in memories if memory.has_embedding])
 
-    Format:
-    Rating: [<FILL IN>]
-    """).format(description.strip())
+    with self._pending_lock:
+      self._pending_memories.extend([memory for memory in memories if not memory.has_embedding])
 
-    importance, _ = chat_completion(prompt, self._character_data.bio)
-    importance = importance.split(':')[1].strip()
+  def _backfill_embeddings(self, memories: list[MemoryEntry]) -> None:
+    """
+    Computes the missing embeddings of the given memories in batches and stores them.
 
-    self._logger.agent_info(f"Memory > '{description}' > was given a weight of > {importance}")
+    Parameters
+    ----------
+    memories : list of MemoryEntry
+        The memories whose embeddings are about to be used.
+    """
+    backfilled = backfill_embeddings(memories)
+
+    if not backfilled:
+      return
+
+    self._logger.memory_info(f"Backfilled the embeddings of {len(backfilled)} memories")
+    self._memory_db.update_embeddings({memory.id: memory.embedding for memory in backfilled})
 
-    importance = float(importance)
+  def _index_pending_memories(self) -> None:
+    """ Backfills the embeddings of the memories waiting for one and adds them to the embedding matrix. """
+    with self._pending_lock:
+      pending_memories, self._pending_memories = self._pending_memories, []
 
-    new_memory = MemoryEntry(description, importance, memory_kind, associated_memories=associated_memories)
+    if pending_memories:
+      self._backfill_embeddings(pending_memories)
+      self._matrix.add_many(pending_memories)
+      self._index.add()
 
-    self._memory_db.store_memory(new_memory.as_dict())
+  def _retrieve_by_embedding(self, query_embedding: list[float], limit: int) -> list[MemoryEntry]:
+    """ Retrieves the memories with the highest retrieval value for an embedded query. """
+    candidates = self._index.candidates(query_embedding, limit)
 
-    self._all_memories.append(new_memory)
+    return self._matrix.top_k(query_embedding, limit, candidates)
 
-  def retrieve(self, query_question: str) -> list[MemoryEntry]:
+  def retrieve(self, query_question: str, limit: int = RETRIEVAL_LIMIT) -> list[MemoryEntry]:
     """
-    Retrieves memories relevant to a given query.
+    Retrieves memories relevant to a given query from the whole memory stream.
 
     Parameters
     ----------
     query_question : str
         The query question to retrieve memories for.
 
+    limit : int, optional
+        The maximum number of memories to retrieve, by default RETRIEVAL_LIMIT.
+
     Returns
     -------
     list of MemoryEntry
         A sorted list of relevant memory entries.
     """
-    recent_memories = self._all_memories[:70]
-    query_embedding = get_embedding(query_question, engine='text-embedding-ada-002')
-
-    for memory in recent_memories:
-      recency = memory.calculate_recency()
-      importance = memory.importance
-      relevance = cosine_similarity(query_embedding, memory.embedding)
-
-      recency_normalized = recency / 1
-      importance_normalized = (importance - 1) / 9
-      relevance_normalized = relevance / 1
+    self._index_pending_memories()
 
-      memory.retrieval_value = (recency_normalized + importance_normalized + relevance_normalized)
+    return self._retrieve_by_embedding(embed(query_question), limit)
 
-    recent_memories.sort(key=lambda memory: memory.retrieval_value, reverse=True)
+  async def aretrieve(self, query_question: str, limit: int = RETRIEVAL_LIMIT) -> list[MemoryEntry]:
+    """ Asynchronous version of `retrieve`. """
+    if self._pending_memories:
+      await asyncio.to_thread(self._index_pending_memories)
 
-    return recent_memories
+    return self._retrieve_by_embedding(await aembed(query_question), limit)
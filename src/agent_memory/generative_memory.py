@@ -1,11 +1,11 @@
+from .. import prompts
 from ..openai_helpers.chat_completion import chat_completion
-from ..decision_making.thread_decorator import threaded
+from ..decision_making.thread_decorator import threaded, gather
 from ..agent_memory.agent_memory import AgentMemory
 from ..character_data import CharacterDetails
 from ..custom_logger import CustomLogger
 from ..agent_memory.memory import MemoryKind
 
-import textwrap
 import re
 
 
@@ -44,21 +44,11 @@ class GenerativeAgentMemory:
     memories = self._agent_memory.memories[:70]
     formatted_memories = '\n'.join([f'{i + 1}. {memory.access()}' for i, memory in enumerate(memories)])
 
-    prompt = textwrap.dedent("""
-    Information (Records):
-    {}
-
-    Taking into account only the information above,
-    What are the top 3 high-level questions we can answer about the topics mentioned? (ONLY WRITE THE QUESTIONS, NOT THE ANSWERS)
-
-    Format:
-    Question 1: <FILL IN>
-    Question 2: <FILL IN>
-    Question 3: <FILL IN>
-    """).format(formatted_memories)
+    prompt = prompts.REFLECTION_QUESTIONS.format(memories=formatted_memories)
 
     query_questions, _ = chat_completion(
-      prompt, 'You are good at deducing things from statements, you always answer in a concrete, brief and easy to understand way.')
+      prompt, 'You are good at deducing things from statements, you always answer in a concrete, brief and easy to understand way.',
+      priority='background')
     formatted_questions = [question.split(':')[1].strip() for question in query_questions.strip().split('\n')]
 
     self._logger.agent_info('Finished creating query questions')
@@ -87,23 +77,9 @@ class GenerativeAgentMemory:
     memories = self._agent_memory.retrieve(normalized_query)
     formatted_memories = '\n'.join([f'{i + 1}. {memory.access()}' for i, memory in enumerate(memories)])
 
-    prompt = textwrap.dedent("""
-    Statements about {}
-    {}
-
-    Using only the information provided above,
-    What 5 high-level ideas can you deduce from the statements above?
-    Use a maximum of 20 words per idea (references do not count toward the maximum word count).
-
-    It is MANDATORY to follow the following format, there must always be references to the memories that generated the reflection, and these must always be enclosed in brackets, even if it's just a single reference:
-
-    Format:
-    1. <Insight>. /*/ References: [<FILL IN>]
-    2. <Insight>. /*/ References: [<FILL IN>]
-    3. <Insight>. /*/ References: [<FILL IN>]
-    """).format(self._character_data.name, formatted_memories)
+    prompt = prompts.REFLECTION_INSIGHTS.format(name=self._character_data.name, memories=formatted_memories)
 
-    insights, _ = chat_completion(prompt)
+    insights, _ = chat_completion(prompt, priority='background')
 
     new_reflections = []
     for insight in insights.strip().split('\n'):
@@ -119,21 +95,6 @@ class GenerativeAgentMemory:
 
     return new_reflections
 
-  @threaded
-  def _save_memory(self, memory: dict) -> None:
-    """
-    Saves a generated memory (reflection) into the agent's memory.
-
-    Parameters
-    ----------
-    memory : dict
-        A dictionary containing the description and references of a memory.
-    """
-    try:
-      self._agent_memory.record_memory(memory['description'], MemoryKind.REFLECTION, memory['references'])
-    except Exception as e:
-      self._logger.agent_error(f'Error saving memory: {e}')
-
   def generate_reflections(self) -> None:
     """
     Generates and saves reflections based on the agent's memories.
@@ -141,9 +102,19 @@ class GenerativeAgentMemory:
     self._logger.agent_info('Generating reflections...')
     memory_queries = self._create_query_questions()
 
-    threads = [self._generate_reflection(memory_query) for memory_query in memory_queries]
-    reflections = [thread for thread in threads]
+    reflections = gather([self._generate_reflection(memory_query) for memory_query in memory_queries])
+
+    memories = [memory for reflection in reflections for memory in reflection]
+
+    try:
+      self._agent_memory.record_memories([memory['description'] for memory in memories], MemoryKind.REFLECTION,
+                                         [memory['references'] for memory in memories])
+      return
+    except Exception as e:
+      self._logger.agent_error(f'Error saving reflections in a batch, saving them one by one: {e}')
 
-    for reflection in reflections:
-      for memory in reflection:
-        self._save_memory(memory)
+    for memory in memories:
+      try:
+        self._agent_memory.record_memory(memory['description'], MemoryKind.REFLECTION, memory['references'])
+      except Exception as e:
+        self._logger.agent_error(f'Error saving reflection: {e}')
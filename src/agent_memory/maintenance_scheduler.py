@@ -0,0 +1,244 @@
+from ..agent_memory_manager import AgentMemoryManager
+from ..custom_logger import CustomLogger
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import os
+import time
+import threading
+
+MAINTENANCE_WORKERS = int(os.getenv('MAINTENANCE_WORKERS', 4))
+
+# The tasks fan out their requests to the shared executor and wait for them, so they run on workers of their own.
+_executor = ThreadPoolExecutor(max_workers=MAINTENANCE_WORKERS, thread_name_prefix='maintenance')
+
+# One timer thread checks the triggers of every scheduler, their state is guarded by one condition.
+_condition = threading.Condition()
+_schedulers: list['MaintenanceScheduler'] = []
+_thread: threading.Thread | None = None
+
+
+class MaintenanceTask:
+  """ A kind of maintenance work of an agent, like refreshing its bio, and the triggers that make it due. """
+
+  def __init__(self, kind: str, run: Callable[[], None], memory_delta: int | None = None, token_budget: int | None = None,
+               interval: float | None = None) -> None:
+    """
+    Initializes the MaintenanceTask.
+
+    Parameters
+    ----------
+    kind : str
+        The name of the task.
+
+    run : Callable[[], None]
+        The function that does the work.
+
+    memory_delta : int or None, optional
+        Run once this many memories were added since the last run, by default never.
+
+    token_budget : int or None, optional
+        Run once the conversations used this many tokens since the last run, by default never.
+
+    interval : float or None, optional
+        Run once this many seconds passed since the last run, by default never.
+    """
+    self.kind = kind
+    self.run = run
+    self.memory_delta = memory_delta
+    self.token_budget = token_budget
+    self.interval = interval
+
+    self.last_version = 0
+    self.last_run = 0.
+    self.tokens = 0
+    self.forced = False
+    self.triggered_at: float | None = None
+    self.in_flight = False
+
+
+class MaintenanceScheduler:
+  """
+  Runs the maintenance tasks of an agent when their triggers fire. A fired trigger waits for a debounce delay, so the
+  triggers that fire meanwhile are coalesced into the same run, and a task never runs twice at the same time. The
+  triggers of every agent are checked by one timer thread and the tasks run on a small executor shared by every
+  agent, so agents do not need threads of their own. The memory version and the time of the last run of every task
+  are kept in the storage backend, so the triggers carry over restarts.
+  """
+
+  def __init__(self, memory_db: AgentMemoryManager, memory_version: Callable[[], int], tasks: list[MaintenanceTask],
+               logger: CustomLogger, debounce: float = 5., storage_key: str = 'maintenance') -> None:
+    """
+    Initializes the MaintenanceScheduler and registers it with the timer thread, started by the first scheduler.
+
+    Parameters
+    ----------
+    memory_db : AgentMemoryManager
+        The storage backend of the agent, where the state of the tasks is kept.
+
+    memory_version : Callable[[], int]
+        Returns the version of the memory stream of the agent, see `AgentMemory.version`.
+
+    tasks : list[MaintenanceTask]
+        The maintenance tasks.
+
+    logger : CustomLogger
+        An instance of CustomLogger for logging information.
+
+    debounce : float, optional
+        The number of seconds a task waits after a trigger fires, by default 5.
+
+    storage_key : str, optional
+        The key of the state of the tasks in the storage backend, by default 'maintenance'.
+    """
+    global _thread
+
+    self._memory_db = memory_db
+    self._memory_version = memory_version
+    self._tasks = {task.kind: task for task in tasks}
+    self._logger = logger
+    self._debounce = debounce
+    self._storage_key = storage_key
+
+    self._condition = _condition
+    self._state_lock = threading.Lock()
+    self._state_version = 0
+    self._stored_version = 0
+
+    state = self._memory_db.get_agent_value(self._storage_key) or {}
+    version, now = self._memory_version(), time.time()
+
+    for task in self._tasks.values():
+      task.last_version = state.get(task.kind, {}).get('version', version)
+      task.last_run = state.get(task.kind, {}).get('time', now)
+
+    with self._condition:
+      _schedulers.append(self)
+
+      if _thread is None:
+        _thread = threading.Thread(target=_run_schedulers, daemon=True, name='Maintenance')
+        _thread.start()
+
+      self._condition.notify_all()
+
+  def trigger(self, kind: str) -> None:
+    """ Makes a task due regardless of its triggers. """
+    with self._condition:
+      self._tasks[kind].forced = True
+      self._condition.notify_all()
+
+  def add_tokens(self, tokens: int) -> None:
+    """ Counts the tokens used by a conversation towards the token budget of every task. """
+    with self._condition:
+      for task in self._tasks.values():
+        task.tokens += tokens
+
+      self._condition.notify_all()
+
+  def notify(self) -> None:
+    """ Wakes the scheduler up to check the triggers, after memories were added. """
+    with self._condition:
+      self._condition.notify_all()
+
+  def join(self, timeout: float | None = None) -> bool:
+    """ Waits until no task is running or waiting for its debounce delay, returns False if the timeout expires first. """
+    with self._condition:
+      return self._condition.wait_for(
+        lambda: not any(task.in_flight or task.forced or task.triggered_at is not None for task in self._tasks.values()), timeout)
+
+  def _is_due(self, task: MaintenanceTask, version: int, now: float) -> bool:
+    """ Whether a trigger of the task fired. Must be called holding the condition. """
+    return (
+      task.forced
+      or (task.memory_delta is not None and version - task.last_version >= task.memory_delta)
+      or (task.token_budget is not None and task.tokens >= task.token_budget)
+      or (task.interval is not None and now - task.last_run >= task.interval)
+    )
+
+  def _check(self, now: float) -> list[float]:
+    """
+    Starts the tasks that are due and past their debounce delay. Must be called holding the condition.
+
+    Returns
+    -------
+    list[float]
+        The times at which a task could become due or pass its debounce delay.
+    """
+    version = self._memory_version()
+    wake_ups = []
+
+    for task in self._tasks.values():
+      if task.in_flight:
+        continue
+
+      if task.triggered_at is None and self._is_due(task, version, now):
+        task.triggered_at = now
+
+      if task.triggered_at is not None:
+        if now - task.triggered_at >= self._debounce:
+          self._start(task, version, now)
+          continue
+
+        wake_ups.append(task.triggered_at + self._debounce)
+
+      elif task.interval is not None:
+        wake_ups.append(task.last_run + task.interval)
+
+    return wake_ups
+
+  def _start(self, task: MaintenanceTask, version: int, now: float) -> None:
+    """ Submits a task to the maintenance executor. Must be called holding the condition. """
+    task.in_flight = True
+    task.forced = False
+    task.triggered_at = None
+    task.tokens = 0
+
+    self._logger.agent_info(f'Running maintenance task {task.kind}, {version - task.last_version} new memories')
+
+    _executor.submit(self._execute, task, version, now)
+
+  def _execute(self, task: MaintenanceTask, version: int, started_at: float) -> None:
+    """ Runs a task and records the memory version and the time it started from. """
+    try:
+      task.run()
+    except Exception as error:
+      self._logger.agent_error(f'Maintenance task {task.kind} failed: {error!r}')
+
+    with self._condition:
+      task.last_version = version
+      task.last_run = started_at
+
+      self._state_version += 1
+      state_version = self._state_version
+      state = {kind: {'version': other.last_version, 'time': other.last_run} for kind, other in self._tasks.items()}
+
+    self._store_state(state_version, state)
+
+    with self._condition:
+      task.in_flight = False
+      self._condition.notify_all()
+
+  def _store_state(self, state_version: int, state: dict) -> None:
+    """
+    Stores the state of the tasks, unless a newer one was already stored. It is called without holding the condition,
+    so the storage write does not block the chats that count their tokens meanwhile.
+    """
+    with self._state_lock:
+      if state_version <= self._stored_version:
+        return
+
+      try:
+        self._memory_db.set_agent_value(self._storage_key, state)
+        self._stored_version = state_version
+      except Exception as error:
+        self._logger.agent_error(f'Storing the state of the maintenance tasks failed: {error!r}')
+
+
+def _run_schedulers() -> None:
+  """ Checks the triggers of every scheduler, and sleeps until the next task could become due. """
+  with _condition:
+    while True:
+      now = time.time()
+      wake_ups = [wake_up for scheduler in _schedulers for wake_up in scheduler._check(now)]
+
+      _condition.wait(max(min(wake_ups) - now, 0.) if wake_ups else None)
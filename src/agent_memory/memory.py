@@ -1,5 +1,5 @@
 from enum import Enum
-from openai.embeddings_utils import get_embedding
+from ..openai_helpers.embedding import embed, embed_many
 
 import datetime
 import math
@@ -39,17 +39,18 @@ class MemoryEntry:
         The kind of memory (observation or reflection).
     **attributes:
         Additional attributes like 'embedding', 'associated_memories' and others.
+        The embedding is computed the first time it is needed when it is not given.
     """
     self._description = description
     self._importance = importance
-    self.kind = kind
+    self.kind = kind if isinstance(kind, MemoryKind) else MemoryKind[kind]
 
     defaults = {
-      'id': str(uuid.uuid4()),
+      'id': attributes.get('_id', str(uuid.uuid4())),
       'created_at': datetime.datetime.now(),
       'accessed_at': datetime.datetime.now(),
       'retrieval_value': 0,
-      'embedding': attributes.get('embedding', get_embedding(description, engine='text-embedding-ada-002')),
+      'embedding': None,
       'associated_memories': []
     }
 
@@ -86,8 +87,19 @@ class MemoryEntry:
 
   @property
   def embedding(self) -> list[float]:
+    if self._embedding is None:
+      self._embedding = embed(self._description)
+
     return self._embedding
 
+  @embedding.setter
+  def embedding(self, value: list[float]) -> None:
+    self._embedding = value
+
+  @property
+  def has_embedding(self) -> bool:
+    return self._embedding is not None
+
   @property
   def associated_memories(self) -> list[str]:
     return self._associated_memories
@@ -137,5 +149,32 @@ class MemoryEntry:
       'associated_memories': self._associated_memories,
       'created_at': self._created_at,
       'accessed_at': self._accessed_at,
-      'embedding': self._embedding
+      'embedding': self.embedding
     }
+
+
+def backfill_embeddings(memories: list[MemoryEntry]) -> list[MemoryEntry]:
+  """
+  Computes the missing embeddings of the given memories in batched requests.
+
+  Parameters
+  ----------
+  memories : list of MemoryEntry
+      The memories to check, memories that already have an embedding are skipped.
+
+  Returns
+  -------
+  list of MemoryEntry
+      The memories whose embedding was computed.
+  """
+  missing = [memory for memory in memories if not memory.has_embedding]
+
+  if not missing:
+    return []
+
+  embeddings = embed_many([memory.description for memory in missing])
+
+  for memory, embedding in zip(missing, embeddings):
+    memory.embedding = embedding
+
+  return missing
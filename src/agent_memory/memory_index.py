@@ -0,0 +1,416 @@
+from .memory_matrix import MemoryMatrix
+from ..custom_logger import CustomLogger
+from ..decision_making.thread_decorator import threaded
+from ..errors import InvalidIndexMode
+from concurrent.futures import Future
+from typing import Literal as literal
+
+import os
+import math
+import threading
+import numpy as np
+
+IndexModes = ['exact', 'ivf']
+
+
+class MemoryIndex:
+  """ Selects the candidate memories that are re-scored on retrieval. """
+
+  def __init__(self, matrix: MemoryMatrix) -> None:
+    """
+    Initializes the MemoryIndex over a memory matrix.
+
+    Parameters
+    ----------
+    matrix : MemoryMatrix
+        The matrix holding the normalized embeddings to index.
+    """
+    self._matrix = matrix
+
+  def train(self) -> Future | None:
+    """
+    Trains the index in the background, if the index needs training.
+
+    Returns
+    -------
+    Future or None
+        The future of the training, or None if there is nothing to train.
+    """
+    return None
+
+  def add(self) -> None:
+    """ Indexes the rows appended to the matrix since the last call. """
+
+  def candidates(self, query_embedding: list[float], limit: int) -> np.ndarray | None:
+    """
+    Selects the rows that may contain the memories relevant to a query.
+
+    Parameters
+    ----------
+    query_embedding : list[float]
+        The embedding of the query.
+
+    limit : int
+        The number of memories that will be retrieved.
+
+    Returns
+    -------
+    np.ndarray or None
+        The candidate rows, or None to score every row.
+    """
+    return None
+
+  def save(self) -> None:
+    """ Persists the index, if the index supports it. """
+
+  def load(self) -> None:
+    """ Loads a persisted index, if the index supports it. """
+
+
+class ExactIndex(MemoryIndex):
+  """ Scores every memory of the stream on retrieval. """
+
+
+class IVFIndex(MemoryIndex):
+  """
+  Inverted file index, memories are clustered around centroids and only the clusters closest to a query are scored.
+  The index is trained in the background once enough memories are stored, until then every memory is scored.
+  """
+
+  def __init__(self, matrix: MemoryMatrix, path: str | None = None, n_probe: int = 8, prior_factor: int = 8,
+               train_threshold: int = 4096, retrain_factor: float = 4, sample_size: int = 32768, save_interval: int = 256,
+               logger: CustomLogger | None = None) -> None:
+    """
+    Initializes the IVFIndex over a memory matrix.
+
+    Parameters
+    ----------
+    matrix : MemoryMatrix
+        The matrix holding the normalized embeddings to index.
+
+    path : str or None, optional
+        The file where the index is persisted, by default None (not persisted).
+
+    n_probe : int, optional
+        The number of clusters scored per query, by default 8. Higher values trade latency for recall.
+
+    prior_factor : int, optional
+        The memories with the highest recency + importance are always scored, this many times the retrieval limit,
+        by default 8. They keep important or recent memories retrievable when their cluster is not probed.
+
+    train_threshold : int, optional
+        The number of memories needed to train the index, by default 4096.
+
+    retrain_factor : float, optional
+        The index is trained again when the memory stream grows by this factor, by default 4.
+
+    sample_size : int, optional
+        The maximum number of memories used to train the centroids, by default 32768.
+
+    save_interval : int, optional
+        The number of indexed memories between saves, by default 256.
+
+    logger : CustomLogger or None, optional
+        The logger of the training errors, by default None (not logged).
+    """
+    super().__init__(matrix)
+
+    self.n_probe = n_probe
+    self.prior_factor = prior_factor
+    self._path = path
+    self._train_threshold = train_threshold
+    self._retrain_factor = retrain_factor
+    self._sample_size = sample_size
+    self._save_interval = save_interval
+    self._logger = logger
+
+    self._lock = threading.Lock()
+    self._centroids: np.ndarray | None = None
+    self._lists: list[list[int]] = []
+    self._indexed = 0
+    self._trained_size = 0
+    self._unsaved = 0
+    self._is_training = False
+
+  @property
+  def is_trained(self) -> bool:
+    return self._centroids is not None
+
+  def _assign(self, vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 16384) -> np.ndarray:
+    """
+    Assigns every vector to its closest centroid.
+
+    Parameters
+    ----------
+    vectors : np.ndarray
+        The normalized vectors to assign.
+
+    centroids : np.ndarray
+        The normalized centroids.
+
+    chunk_size : int, optional
+        The number of vectors compared at once, by default 16384.
+
+    Returns
+    -------
+    np.ndarray
+        The centroid of every vector.
+    """
+    assignments = np.empty(len(vectors), dtype=np.int32)
+
+    for start in range(0, len(vectors), chunk_size):
+      assignments[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+
+    return assignments
+
+  def _kmeans(self, vectors: np.ndarray, n_lists: int, iterations: int = 10) -> np.ndarray:
+    """
+    Clusters the vectors with spherical k-means.
+
+    Parameters
+    ----------
+    vectors : np.ndarray
+        The normalized vectors to cluster.
+
+    n_lists : int
+        The number of clusters.
+
+    iterations : int, optional
+        The number of k-means iterations, by default 10.
+
+    Returns
+    -------
+    np.ndarray
+        The normalized centroids.
+    """
+    generator = np.random.default_rng(0)
+    centroids = vectors[generator.choice(len(vectors), n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+      assignments = self._assign(vectors, centroids)
+      order = np.argsort(assignments, kind='stable')
+      clusters, starts = np.unique(assignments[order], return_index=True)
+
+      sums = np.add.reduceat(vectors[order], starts, axis=0)
+      centroids[clusters] = sums
+
+      empty = np.setdiff1d(np.arange(n_lists), clusters)
+      centroids[empty] = vectors[generator.choice(len(vectors), len(empty), replace=False)]
+
+      norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+      centroids /= np.where(norms == 0, 1, norms)
+
+    return centroids
+
+  def _set_centroids(self, centroids: np.ndarray, assignments: np.ndarray) -> None:
+    """
+    Replaces the clusters of the index, must be called with the lock held.
+
+    Parameters
+    ----------
+    centroids : np.ndarray
+        The new centroids.
+
+    assignments : np.ndarray
+        The centroid of every row, starting from row 0.
+    """
+    lists = [[] for _ in range(len(centroids))]
+
+    for row, centroid in enumerate(assignments.tolist()):
+      lists[centroid].append(row)
+
+    self._centroids = centroids
+    self._lists = lists
+    self._indexed = len(assignments)
+
+  @threaded
+  def _train(self) -> None:
+    """ Trains the centroids on a sample of the memory stream and re-assigns every memory. """
+    try:
+      size = len(self._matrix)
+      vectors = self._matrix.embeddings[:size]
+
+      n_lists = max(16, int(math.sqrt(size)))
+      generator = np.random.default_rng(size)
+      sample = vectors if size <= self._sample_size else vectors[generator.choice(size, self._sample_size, replace=False)]
+
+      centroids = self._kmeans(sample, n_lists)
+      assignments = self._assign(vectors, centroids)
+
+      with self._lock:
+        tail = self._matrix.embeddings[size:]
+        self._set_centroids(centroids, np.concatenate([assignments, self._assign(tail, centroids)]))
+        self._trained_size = self._indexed
+
+      self.save()
+    finally:
+      self._is_training = False
+
+  def train(self) -> Future | None:
+    """
+    Trains the index in the background, unless it is already being trained.
+
+    Returns
+    -------
+    Future or None
+        The future of the training, or None if the index is already being trained.
+    """
+    with self._lock:
+      if self._is_training:
+        return None
+
+      self._is_training = True
+
+    future = self._train()
+    future.add_done_callback(self._log_training_error)
+    return future
+
+  def _log_training_error(self, future: Future) -> None:
+    """ Logs the error of a failed training, the index keeps its previous clusters. """
+    error = future.exception()
+
+    if error is not None and self._logger is not None:
+      self._logger.memory_error(f'Training of the memory index failed: {error!r}')
+
+  def add(self) -> None:
+    """ Indexes the rows appended to the matrix since the last call, training the index when needed. """
+    size = len(self._matrix)
+
+    if self._centroids is None or size >= self._trained_size * self._retrain_factor:
+      if size >= self._train_threshold:
+        self.train()
+
+    if self._centroids is None:
+      return
+
+    with self._lock:
+      if self._indexed >= size:
+        return
+
+      for offset, centroid in enumerate(self._assign(self._matrix.embeddings[self._indexed:size], self._centroids).tolist()):
+        self._lists[centroid].append(self._indexed + offset)
+
+      self._unsaved += size - self._indexed
+      self._indexed = size
+
+    if self._unsaved >= self._save_interval:
+      self.save()
+
+  def candidates(self, query_embedding: list[float], limit: int) -> np.ndarray | None:
+    """
+    Selects the rows of the clusters closest to a query, the rows with the highest recency + importance
+    and every row not indexed yet.
+
+    Parameters
+    ----------
+    query_embedding : list[float]
+        The embedding of the query.
+
+    limit : int
+        The number of memories that will be retrieved, at least as many candidates are selected.
+
+    Returns
+    -------
+    np.ndarray or None
+        The candidate rows, or None to score every row while the index is not trained.
+    """
+    if self._centroids is None:
+      return None
+
+    query = np.array(query_embedding, dtype=np.float32)
+    query /= np.linalg.norm(query) or 1
+
+    with self._lock:
+      closeness = self._centroids @ query
+      order = np.argsort(-closeness)
+
+      probed = []
+      count = 0
+
+      for probe, centroid in enumerate(order):
+        if probe >= self.n_probe and count >= limit:
+          break
+
+        probed.append(np.asarray(self._lists[centroid], dtype=np.int64))
+        count += len(self._lists[centroid])
+
+      probed.append(np.arange(self._indexed, len(self._matrix), dtype=np.int64))
+
+    prior = self._matrix.prior()
+    prior_candidates = self.prior_factor * limit
+    if len(prior) > prior_candidates:
+      probed.append(np.argpartition(-prior, prior_candidates - 1)[:prior_candidates])
+    else:
+      probed.append(np.arange(len(prior)))
+
+    return np.unique(np.concatenate(probed))
+
+  def save(self) -> None:
+    """ Persists the centroids and the cluster of every memory id. """
+    if self._path is None or self._centroids is None:
+      return
+
+    with self._lock:
+      assignments = np.empty(self._indexed, dtype=np.int32)
+
+      for centroid, rows in enumerate(self._lists):
+        assignments[rows] = centroid
+
+      ids = np.array([self._matrix.memory_at(row).id for row in range(self._indexed)], dtype=str)
+      centroids = self._centroids
+      trained_size = self._trained_size
+      self._unsaved = 0
+
+    temporary_path = f'{self._path}.tmp.npz'
+    np.savez(temporary_path, centroids=centroids, ids=ids, assignments=assignments, trained_size=trained_size)
+    os.replace(temporary_path, self._path)
+
+  def load(self) -> None:
+    """ Loads the persisted centroids, memories unknown to the persisted index are assigned again. """
+    if self._path is None or not os.path.exists(self._path):
+      return
+
+    with np.load(self._path) as data:
+      centroids = data['centroids']
+      stored = dict(zip(data['ids'].tolist(), data['assignments'].tolist()))
+      trained_size = int(data['trained_size'])
+
+    with self._lock:
+      size = len(self._matrix)
+      assignments = np.array([stored.get(self._matrix.memory_at(row).id, -1) for row in range(size)], dtype=np.int32)
+
+      missing = np.flatnonzero(assignments == -1)
+      if len(missing):
+        assignments[missing] = self._assign(self._matrix.embeddings[missing], centroids)
+
+      self._set_centroids(centroids, assignments)
+      self._trained_size = trained_size
+
+
+def create_memory_index(index_mode: literal["exact", "ivf"], matrix: MemoryMatrix, **options) -> MemoryIndex:
+  """
+  Creates the memory index for the given mode.
+
+  Parameters
+  ----------
+  index_mode : literal["exact", "ivf"]
+      The kind of index to create.
+
+  matrix : MemoryMatrix
+      The matrix holding the normalized embeddings to index.
+
+  **options:
+      Options of the index, like 'path', 'n_probe' and 'logger' for the IVF index. The exact index ignores them.
+
+  Returns
+  -------
+  MemoryIndex
+      The created index.
+  """
+  if index_mode not in IndexModes:
+    raise InvalidIndexMode(index_mode)
+
+  if index_mode == 'ivf':
+    return IVFIndex(matrix, **options)
+
+  return ExactIndex(matrix)
@@ -0,0 +1,144 @@
+from ..agent_memory_manager import AgentMemoryManager
+from ..custom_logger import CustomLogger
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import os
+import collections
+import threading
+
+DRAIN_WORKERS = int(os.getenv('MEMORY_JOB_WORKERS', 4))
+
+# The jobs fan out their requests to the shared executor and wait for them, so they are drained on their own workers.
+_drain_executor = ThreadPoolExecutor(max_workers=DRAIN_WORKERS, thread_name_prefix='memory-jobs')
+
+
+class MemoryJobQueue:
+  """
+  Background queue of the memory work of an agent, like recording observations. The jobs are drained in order by one
+  task at a time on a small executor shared by the queues of every agent, so agents do not need a thread each. The
+  unfinished jobs are kept in the storage backend so they run again after a restart.
+  """
+
+  def __init__(self, memory_db: AgentMemoryManager, handlers: dict[str, Callable[[dict], None]], logger: CustomLogger,
+               storage_key: str = 'memory_jobs') -> None:
+    """
+    Initializes the MemoryJobQueue and resumes the jobs left by a previous run.
+
+    Parameters
+    ----------
+    memory_db : AgentMemoryManager
+        The storage backend of the agent, where the unfinished jobs are kept.
+
+    handlers : dict[str, Callable[[dict], None]]
+        The function that runs every kind of job, it receives the JSON serializable payload of the job.
+
+    logger : CustomLogger
+        An instance of CustomLogger for logging information.
+
+    storage_key : str, optional
+        The key of the unfinished jobs in the storage backend, by default 'memory_jobs'.
+    """
+    self._memory_db = memory_db
+    self._handlers = handlers
+    self._logger = logger
+    self._storage_key = storage_key
+
+    self._condition = threading.Condition()
+    self._jobs: collections.deque[dict] = collections.deque()
+    self._running: dict | None = None
+    self._draining = False
+    self._unsaved = False
+
+    for job in self._memory_db.get_agent_value(self._storage_key) or []:
+      if job.get('kind') in self._handlers:
+        self._jobs.append(job)
+
+    if self._jobs:
+      self._logger.memory_info(f'Resuming {len(self._jobs)} memory jobs of the previous run')
+
+      with self._condition:
+        self._start_draining()
+
+  @property
+  def depth(self) -> int:
+    """ The number of jobs waiting or running. """
+    with self._condition:
+      return len(self._jobs) + (self._running is not None)
+
+  def _unfinished_jobs(self) -> list[dict]:
+    """ Returns the unfinished jobs, the running one first. Must be called holding the condition. """
+    self._unsaved = False
+    return ([self._running] if self._running is not None else []) + list(self._jobs)
+
+  def _persist(self, jobs: list[dict]) -> None:
+    """ Stores the unfinished jobs, only the drain task calls it so the writes are not reordered. """
+    try:
+      self._memory_db.set_agent_value(self._storage_key, jobs)
+    except Exception as error:
+      self._logger.memory_error(f'Storing the unfinished memory jobs failed: {error!r}')
+
+  def submit(self, kind: str, **payload) -> None:
+    """
+    Adds a job at the end of the queue.
+
+    Parameters
+    ----------
+    kind : str
+        The kind of job, one of the handlers.
+
+    **payload:
+        The JSON serializable arguments of the job.
+    """
+    if kind not in self._handlers:
+      raise ValueError(f'{kind} is not a kind of memory job. Kinds of memory jobs are: {list(self._handlers)}')
+
+    with self._condition:
+      self._jobs.append({'kind': kind, 'payload': payload})
+      self._unsaved = True
+      self._start_draining()
+
+      self._logger.memory_info(f'Queued {kind} job, {len(self._jobs) + (self._running is not None)} memory jobs pending')
+
+  def join(self, timeout: float | None = None) -> bool:
+    """ Waits until every job has run, returns False if the timeout expires first. """
+    with self._condition:
+      return self._condition.wait_for(lambda: not self._jobs and self._running is None, timeout)
+
+  def _start_draining(self) -> None:
+    """ Submits the drain task unless one is running. Must be called holding the condition. """
+    if not self._draining:
+      self._draining = True
+      _drain_executor.submit(self._drain)
+
+  def _drain(self) -> None:
+    """
+    Runs the jobs one after another until the queue is empty. The unfinished jobs are stored here rather than on
+    `submit`, so submitting a job from a chat turn does not wait for the storage backend.
+    """
+    while True:
+      with self._condition:
+        if not self._jobs:
+          self._draining = False
+          return
+
+        self._running = self._jobs.popleft()
+        job = self._running
+        jobs = self._unfinished_jobs() if self._unsaved else None
+
+      if jobs is not None:
+        self._persist(jobs)
+
+      try:
+        self._handlers[job['kind']](job['payload'])
+      except Exception as error:
+        self._logger.memory_error(f"Memory job {job['kind']} failed: {error!r}")
+
+      with self._condition:
+        self._running = None
+        jobs = self._unfinished_jobs()
+
+      self._persist(jobs)
+
+      with self._condition:
+        self._condition.notify_all()
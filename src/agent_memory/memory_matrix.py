@@ -0,0 +1,239 @@
+from .memory import MemoryEntry
+
+import datetime
+import threading
+import numpy as np
+
+RECENCY_DECAY = .99
+
+
+class MemoryMatrix:
+  """ Keeps the embeddings, importance and access times of a memory stream in contiguous arrays. """
+
+  def __init__(self, initial_capacity: int = 1024) -> None:
+    """
+    Initializes an empty MemoryMatrix.
+
+    Parameters
+    ----------
+    initial_capacity : int, optional
+        The number of rows allocated up front, by default 1024. The arrays double in size when full.
+    """
+    self._lock = threading.Lock()
+    self._capacity = initial_capacity
+    self._size = 0
+
+    self._memories: list[MemoryEntry] = []
+    self._rows: dict[str, int] = {}
+
+    self._embeddings: np.ndarray | None = None
+    self._importance = np.empty(initial_capacity, dtype=np.float32)
+    self._accessed_at = np.empty(initial_capacity, dtype=np.float64)
+
+  def __len__(self) -> int:
+    return self._size
+
+  def __contains__(self, memory_id: str) -> bool:
+    return memory_id in self._rows
+
+  @property
+  def embeddings(self) -> np.ndarray:
+    """ The normalized embeddings of every memory, one row per memory. """
+    if self._embeddings is None:
+      return np.empty((0, 0), dtype=np.float32)
+
+    return self._embeddings[:self._size]
+
+  def memory_at(self, row: int) -> MemoryEntry:
+    """ Returns the memory stored in the given row. """
+    return self._memories[row]
+
+  def row_of(self, memory_id: str) -> int | None:
+    """ Returns the row of the memory with the given id, or None if it is not stored. """
+    return self._rows.get(memory_id)
+
+  def _grow(self, required: int, dimensions: int) -> None:
+    """
+    Makes room for at least the given number of rows.
+
+    Parameters
+    ----------
+    required : int
+        The number of rows that must fit in the arrays.
+
+    dimensions : int
+        The number of dimensions of the embeddings.
+    """
+    if self._embeddings is None:
+      self._capacity = max(self._capacity, required)
+      self._embeddings = np.empty((self._capacity, dimensions), dtype=np.float32)
+      self._importance = np.resize(self._importance, self._capacity)
+      self._accessed_at = np.resize(self._accessed_at, self._capacity)
+      return
+
+    if required <= self._capacity:
+      return
+
+    while self._capacity < required:
+      self._capacity *= 2
+
+    embeddings = np.empty((self._capacity, self._embeddings.shape[1]), dtype=np.float32)
+    embeddings[:self._size] = self._embeddings[:self._size]
+    self._embeddings = embeddings
+
+    self._importance = np.resize(self._importance, self._capacity)
+    self._accessed_at = np.resize(self._accessed_at, self._capacity)
+
+  def add_many(self, memories: list[MemoryEntry]) -> list[int]:
+    """
+    Appends memories to the matrix, memories already stored are skipped.
+
+    Parameters
+    ----------
+    memories : list of MemoryEntry
+        The memories to append, they must have an embedding.
+
+    Returns
+    -------
+    list[int]
+        The rows of the appended memories.
+    """
+    with self._lock:
+      memories = [memory for memory in memories if memory.id not in self._rows]
+
+      if not memories:
+        return []
+
+      vectors = np.asarray([memory.embedding for memory in memories], dtype=np.float32)
+      norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+      vectors /= np.where(norms == 0, 1, norms)
+
+      start = self._size
+      end = start + len(memories)
+      self._grow(end, vectors.shape[1])
+
+      self._embeddings[start:end] = vectors
+      self._importance[start:end] = [memory.importance for memory in memories]
+      self._accessed_at[start:end] = [memory.accessed_at.timestamp() for memory in memories]
+
+      for row, memory in enumerate(memories, start):
+        self._rows[memory.id] = row
+        self._memories.append(memory)
+
+      self._size = end
+
+      return list(range(start, end))
+
+  def add(self, memory: MemoryEntry) -> int | None:
+    """
+    Appends a memory to the matrix.
+
+    Parameters
+    ----------
+    memory : MemoryEntry
+        The memory to append, it must have an embedding.
+
+    Returns
+    -------
+    int or None
+        The row of the memory, or None if it was already stored.
+    """
+    rows = self.add_many([memory])
+    return rows[0] if rows else None
+
+  def _prior(self, rows: np.ndarray | slice, now: float) -> np.ndarray:
+    """ Computes recency + importance of the given rows, must be called with the lock held. """
+    hours = (now - self._accessed_at[rows]) / 3600
+    return np.power(RECENCY_DECAY, hours) + (self._importance[rows] - 1) / 9
+
+  def prior(self) -> np.ndarray:
+    """
+    Scores every memory as recency + importance, the part of the retrieval value that does not depend on the query.
+
+    Returns
+    -------
+    np.ndarray
+        The recency + importance of every row.
+    """
+    now = datetime.datetime.now().timestamp()
+
+    with self._lock:
+      return self._prior(slice(0, self._size), now)
+
+  def score(self, query_embedding: list[float], rows: np.ndarray | None = None) -> np.ndarray:
+    """
+    Scores memories against a query as recency + importance + relevance, every term in [0, 1].
+
+    Parameters
+    ----------
+    query_embedding : list[float]
+        The embedding of the query.
+
+    rows : np.ndarray or None, optional
+        The rows to score, by default every row.
+
+    Returns
+    -------
+    np.ndarray
+        The retrieval value of every scored row.
+    """
+    query = np.array(query_embedding, dtype=np.float32)
+    query /= np.linalg.norm(query) or 1
+
+    now = datetime.datetime.now().timestamp()
+
+    with self._lock:
+      if rows is None:
+        rows = slice(0, self._size)
+
+      prior = self._prior(rows, now)
+      relevance = self._embeddings[rows] @ query if self._embeddings is not None else np.empty(0, dtype=np.float32)
+
+    return prior + relevance
+
+  def top_k(self, query_embedding: list[float], k: int, rows: np.ndarray | None = None) -> list[MemoryEntry]:
+    """
+    Retrieves the k memories with the highest retrieval value and marks them as accessed.
+
+    Parameters
+    ----------
+    query_embedding : list[float]
+        The embedding of the query.
+
+    k : int
+        The maximum number of memories to retrieve.
+
+    rows : np.ndarray or None, optional
+        The candidate rows, by default every row.
+
+    Returns
+    -------
+    list of MemoryEntry
+        The retrieved memories, sorted by retrieval value.
+    """
+    if self._size == 0:
+      return []
+
+    scores = self.score(query_embedding, rows)
+    candidates = np.arange(len(scores)) if rows is None else np.asarray(rows)
+
+    if len(scores) > k:
+      best = np.argpartition(-scores, k - 1)[:k]
+    else:
+      best = np.arange(len(scores))
+
+    best = best[np.argsort(-scores[best])]
+
+    retrieved = []
+    now = datetime.datetime.now().timestamp()
+
+    with self._lock:
+      for position in best:
+        row = int(candidates[position])
+        memory = self._memories[row]
+        memory.retrieval_value = float(scores[position])
+        memory.access()
+        self._accessed_at[row] = now
+        retrieved.append(memory)
+
+    return retrieved
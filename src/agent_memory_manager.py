@@ -1,9 +1,13 @@
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from typing import Literal as literal
+from .custom_logger import CustomLogger
+from .memory_storage.mongo_store import MemoryMongoStore
+from .memory_storage.log_store import MemoryLogStore
+from .memory_storage.sqlite_store import MemorySQLiteStore
+from typing import Iterator, Literal as literal
 
 import os
 import json
+import threading
 import datetime
 import dateutil.parser
 
@@ -11,7 +15,8 @@ import dateutil.parser
 class AgentMemoryManager:
   """ A class to manage an agent's memory, enabling storage and retrieval of memories and status. """
 
-  def __init__(self, agent_name: str, storage_mode: literal["mongodb", "json"] = "mongodb"):
+  def __init__(self, agent_name: str, storage_mode: literal["mongodb", "json", "log", "sqlite"] = "mongodb",
+               logger: CustomLogger | None = None, **mongo_options):
     """
     Initialize the AgentMemoryManager with the given agent name and storage mode.
 
@@ -20,18 +25,26 @@ class AgentMemoryManager:
     agent_name : str
         The name of the agent.
 
-    storage_mode : literal["mongodb", "json"], optional
-        The storage mode to use, by default "mongodb".
+    storage_mode : literal["mongodb", "json", "log", "sqlite"], optional
+        The storage mode to use, by default "mongodb". The "log" mode appends to a local log instead of rewriting
+        a JSON file, an existing JSON data file of the agent is imported the first time it is used.
+        The "sqlite" mode stores the memories in a local SQLite database with indexed lookups.
+
+    logger : CustomLogger or None, optional
+        The logger of the background errors of the storage, by default None (not logged).
+
+    **mongo_options:
+        Options of the "mongodb" mode, like 'flush_interval', 'max_batch_size', an existing 'client',
+        or connection-pool settings such as 'maxPoolSize'.
     """
     self.agent_name = agent_name
     self.storage_mode = storage_mode
+    self._lock = threading.Lock()
+    self.index_file = f"{agent_name}_memory_index.npz"
 
     if storage_mode == "mongodb":
       load_dotenv()
-      self._client = MongoClient(os.getenv('MONGO_URI'))
-      self._database = self._client[agent_name]
-      self._memory_col = self._database[f'{agent_name}_memories']
-      self._config_col = self._database[f'{agent_name}_config']
+      self._mongo_store = MemoryMongoStore(agent_name, os.getenv('MONGO_URI'), logger=logger, **mongo_options)
 
     elif storage_mode == "json":
       self.data_file = f"{agent_name}_data.json"
@@ -46,6 +59,13 @@ class AgentMemoryManager:
           json.dump(default_structure, file,
                     default=self._datetime_serializer)
 
+    elif storage_mode == "log":
+      self._log_store = MemoryLogStore(f"{agent_name}_store")
+      self._log_store.migrate_from_json(f"{agent_name}_data.json", self._datetime_deserializer)
+
+    elif storage_mode == "sqlite":
+      self._sqlite_store = MemorySQLiteStore(f"{agent_name}_memories.db")
+
   def _datetime_serializer(self, obj):
     """
     Serializes datetime objects to ISO format.
@@ -95,6 +115,7 @@ class AgentMemoryManager:
   def store_memory(self, memory: dict):
     """
     Stores a memory in the database or JSON file, depending on the storage mode.
+    In the "mongodb" mode the memory waits in the insert buffer until the next flush.
 
     Parameters
     ----------
@@ -102,15 +123,86 @@ class AgentMemoryManager:
       The memory to store.
     """
     if self.storage_mode == "mongodb":
-      self._memory_col.insert_one(memory)
+      self._mongo_store.store_memories([memory])
+    elif self.storage_mode == "log":
+      self._log_store.store_memories([memory])
+    elif self.storage_mode == "sqlite":
+      self._sqlite_store.store_memories([memory])
     elif self.storage_mode == "json":
-      with open(self.data_file, 'r') as file:
-        data = json.load(file, object_hook=self._datetime_deserializer)
+      with self._lock:
+        with open(self.data_file, 'r') as file:
+          data = json.load(file, object_hook=self._datetime_deserializer)
 
-      data['memories'].append(memory)
+        data['memories'].append(memory)
 
-      with open(self.data_file, 'w') as file:
-        json.dump(data, file, default=self._datetime_serializer)
+        with open(self.data_file, 'w') as file:
+          json.dump(data, file, default=self._datetime_serializer)
+
+  def compact(self):
+    """
+    Compacts the storage, dropping superseded records. Only the "log" storage mode needs compaction,
+    it is also compacted automatically once superseded records outnumber live ones.
+    """
+    if self.storage_mode == "log":
+      self._log_store.compact()
+
+  def update_embeddings(self, embeddings: dict[str, list[float]]):
+    """
+    Stores the embeddings of already stored memories.
+
+    Parameters
+    ----------
+    embeddings : dict[str, list[float]]
+      The embeddings to store, keyed by memory id.
+    """
+    if not embeddings:
+      return
+
+    if self.storage_mode == "mongodb":
+      self._mongo_store.update_embeddings(embeddings)
+    elif self.storage_mode == "log":
+      self._log_store.update_embeddings(embeddings)
+    elif self.storage_mode == "sqlite":
+      self._sqlite_store.update_embeddings(embeddings)
+    elif self.storage_mode == "json":
+      with self._lock:
+        with open(self.data_file, 'r') as file:
+          data = json.load(file, object_hook=self._datetime_deserializer)
+
+        for memory in data['memories']:
+          if memory['_id'] in embeddings:
+            memory['embedding'] = embeddings[memory['_id']]
+
+        with open(self.data_file, 'w') as file:
+          json.dump(data, file, default=self._datetime_serializer)
+
+  def store_memories(self, memories: list[dict]):
+    """
+    Stores many memories with a single write, depending on the storage mode.
+
+    Parameters
+    ----------
+    memories : list of dict
+      The memories to store.
+    """
+    if not memories:
+      return
+
+    if self.storage_mode == "mongodb":
+      self._mongo_store.store_memories(memories, buffered=False)
+    elif self.storage_mode == "log":
+      self._log_store.store_memories(memories)
+    elif self.storage_mode == "sqlite":
+      self._sqlite_store.store_memories(memories)
+    elif self.storage_mode == "json":
+      with self._lock:
+        with open(self.data_file, 'r') as file:
+          data = json.load(file, object_hook=self._datetime_deserializer)
+
+        data['memories'].extend(memories)
+
+        with open(self.data_file, 'w') as file:
+          json.dump(data, file, default=self._datetime_serializer)
 
   def retrieve_memory(self, description: str) -> dict | None:
     """
@@ -127,9 +219,13 @@ class AgentMemoryManager:
       The memory if found, otherwise None.
     """
     if self.storage_mode == "mongodb":
-      return self._memory_col.find_one({'description': description})
+      return self._mongo_store.retrieve_memory(description)
+    elif self.storage_mode == "log":
+      return self._log_store.retrieve_memory(description)
+    elif self.storage_mode == "sqlite":
+      return self._sqlite_store.retrieve_memory(description)
     elif self.storage_mode == "json":
-      with open(self.data_file, 'r') as file:
+      with self._lock, open(self.data_file, 'r') as file:
         data = json.load(file, object_hook=self._datetime_deserializer)
 
       for memory in data['memories']:
@@ -138,41 +234,125 @@ class AgentMemoryManager:
 
       return None
 
-  def retrieve_all_memories(self) -> list[dict]:
+  def retrieve_all_memories(self, include_embeddings: bool = True) -> list[dict]:
     """
     Retrieves all stored memories.
 
+    Parameters
+    ----------
+    include_embeddings : bool, optional
+      Whether to include the embeddings, by default True. Without them,
+      the "mongodb" mode only transfers the metadata of every memory.
+
     Returns
     -------
     list of dict
       A list of all memories.
     """
     if self.storage_mode == "mongodb":
-      return list(self._memory_col.find())
+      return self._mongo_store.retrieve_all_memories(include_embeddings)
+    elif self.storage_mode == "log":
+      memories = self._log_store.retrieve_all_memories()
+    elif self.storage_mode == "sqlite":
+      memories = self._sqlite_store.retrieve_all_memories()
     elif self.storage_mode == "json":
-      with open(self.data_file, 'r') as file:
+      with self._lock, open(self.data_file, 'r') as file:
         data = json.load(file, object_hook=self._datetime_deserializer)
 
-      return data['memories']
+      memories = data['memories']
 
-  def get_agent_status(self) -> str | None:
+    if not include_embeddings:
+      for memory in memories:
+        memory.pop('embedding', None)
+
+    return memories
+
+  def iter_embeddings(self, batch_size: int = 1000) -> Iterator[list[tuple[str, list[float]]]]:
     """
-    Retrieves the current status of the agent.
+    Streams the stored embeddings in batches.
+
+    Parameters
+    ----------
+    batch_size : int, optional
+      The number of embeddings per batch, by default 1000.
+
+    Yields
+    ------
+    list of tuple(str, list[float])
+      A batch of (memory id, embedding) pairs.
+    """
+    if self.storage_mode == "mongodb":
+      yield from self._mongo_store.iter_embeddings(batch_size)
+      return
+
+    pairs = [(memory['_id'], memory['embedding']) for memory in self.retrieve_all_memories() if memory.get('embedding') is not None]
+
+    for i in range(0, len(pairs), batch_size):
+      yield pairs[i: i + batch_size]
+
+  def get_agent_value(self, key: str) -> object | None:
+    """
+    Retrieves a value stored for the agent, like its status.
+
+    Parameters
+    ----------
+    key : str
+      The key of the value.
 
     Returns
     -------
-    str or None
-      The current status of the agent, or None if not set.
+    object or None
+      The stored value, or None if not set.
     """
     if self.storage_mode == "mongodb":
-      agent_data = self._config_col.find_one(
-          {'agent_name': self.agent_name})
-      return agent_data['status'] if agent_data else None
+      return self._mongo_store.get_value(key)
+    elif self.storage_mode == "log":
+      return self._log_store.get_value(key)
+    elif self.storage_mode == "sqlite":
+      return self._sqlite_store.get_value(key)
     elif self.storage_mode == "json":
-      with open(self.data_file, 'r') as file:
+      with self._lock, open(self.data_file, 'r') as file:
         data = json.load(file, object_hook=self._datetime_deserializer)
 
-      return data['status']
+      return data.get(key)
+
+  def set_agent_value(self, key: str, value: object):
+    """
+    Stores a value for the agent, it must be JSON serializable.
+
+    Parameters
+    ----------
+    key : str
+      The key of the value.
+
+    value : object
+      The value to store.
+    """
+    if self.storage_mode == "mongodb":
+      self._mongo_store.set_value(key, value)
+    elif self.storage_mode == "log":
+      self._log_store.set_value(key, value)
+    elif self.storage_mode == "sqlite":
+      self._sqlite_store.set_value(key, value)
+    elif self.storage_mode == "json":
+      with self._lock:
+        with open(self.data_file, 'r') as file:
+          data = json.load(file, object_hook=self._datetime_deserializer)
+        data[key] = value
+
+        with open(self.data_file, 'w') as file:
+          json.dump(data, file, default=self._datetime_serializer)
+
+  def get_agent_status(self) -> str | None:
+    """
+    Retrieves the current status of the agent.
+
+    Returns
+    -------
+    str or None
+      The current status of the agent, or None if not set.
+    """
+    return self.get_agent_value('status')
 
   def set_agent_status(self, status: str):
     """
@@ -183,12 +363,4 @@ class AgentMemoryManager:
     status : str
       The new status to set for the agent.
     """
-    if self.storage_mode == "mongodb":
-      self._config_col.update_one({'agent_name': self.agent_name}, {'$set': {'status': status}}, upsert=True)
-    elif self.storage_mode == "json":
-      with open(self.data_file, 'r') as file:
-        data = json.load(file, object_hook=self._datetime_deserializer)
-      data['status'] = status
-
-      with open(self.data_file, 'w') as file:
-        json.dump(data, file, default=self._datetime_serializer)
+    self.set_agent_value('status', status)
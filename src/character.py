@@ -1,30 +1,58 @@
 from src.custom_logger import CustomLogger
+from . import prompts
 from .character_data import CharacterDetails
 from .agent_memory_manager import AgentMemoryManager
 from .agent_memory.agent_memory import AgentMemory
 from .agent_memory.generative_memory import GenerativeAgentMemory
+from .agent_memory.memory_jobs import MemoryJobQueue
+from .agent_memory.maintenance_scheduler import MaintenanceScheduler, MaintenanceTask
+from .chat_session import ChatSession
 from .agent_memory.memory import MemoryEntry
 from .decision_making.mood_analyzer import MoodAnalyzer
 from .decision_making.decision_processor import DecisionProcessor
-from .decision_making.thread_decorator import threaded
-from .openai_helpers.chat_completion import chat_completion
+from .decision_making.thread_decorator import fan_out, gather, get_executor
+from .openai_helpers.chat_completion import chat_completion, achat_completion, astream_chat_completion, fitting_version
+from .openai_helpers.async_client import run_sync
+from .openai_helpers.retry import retry_budget
+from .openai_helpers.rate_limiter import estimate_tokens
+from .errors import InvalidPipelineMode
 from dotenv import load_dotenv
+from typing import AsyncIterator, Callable, Literal as literal
 
 import time
-import threading
+import asyncio
+import hashlib
+import collections
 import datetime
-import textwrap
 import os
 import openai
 load_dotenv()
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+RESPONSE_PREFIX_LENGTH = len('Response:') + 8
+PipelineModes = ['multi-call', 'turn-analysis']
+
 
 class Character:
   """ A character with personal data, memories, and decision-making capabilities. """
 
-  def __init__(self, name: str, bio: str, abilities: str, memories: str, traits: str, initial_location: str = 'club room') -> None:
+  TURN_DEADLINE = float(os.getenv('CHAT_TURN_DEADLINE', 120))
+  TURN_MAX_ATTEMPTS = int(os.getenv('CHAT_TURN_MAX_ATTEMPTS', 60))
+
+  BIO_REFRESH_MEMORIES = int(os.getenv('BIO_REFRESH_MEMORIES', 40))
+  BIO_REFRESH_INTERVAL = float(os.getenv('BIO_REFRESH_INTERVAL', 0))
+  STATUS_REFRESH_MEMORIES = int(os.getenv('STATUS_REFRESH_MEMORIES', 20))
+  STATUS_REFRESH_TOKENS = int(os.getenv('STATUS_REFRESH_TOKENS', 1500))
+  STATUS_REFRESH_INTERVAL = float(os.getenv('STATUS_REFRESH_INTERVAL', 3600))
+  REFLECTION_MEMORIES = int(os.getenv('REFLECTION_MEMORIES', 100))
+  REFLECTION_TOKENS = int(os.getenv('REFLECTION_TOKENS', 3500))
+  MAINTENANCE_DEBOUNCE = float(os.getenv('MAINTENANCE_DEBOUNCE', 5))
+  PIPELINE_MODE = os.getenv('CHAT_PIPELINE_MODE', 'multi-call')
+
+  def __init__(self, name: str, bio: str, abilities: str, memories: str, traits: str, initial_location: str = 'club room',
+               initial_status: str | None = None, storage_mode: literal["mongodb", "json", "log", "sqlite"] = 'log',
+               pipeline_mode: literal["multi-call", "turn-analysis"] | None = None, **storage_options) -> None:
     """
     Initialize the Character instance with personal data and memories.
 
@@ -47,13 +75,30 @@ class Character:
 
     initial_location : str, optional
       The initial location of the character, by default 'club room'.
+
+    initial_status : str or None, optional
+      The status of the character until one is generated, by default a generic status.
+
+    storage_mode : literal["mongodb", "json", "log", "sqlite"], optional
+      The storage mode of the memories, by default 'log'.
+
+    pipeline_mode : literal["multi-call", "turn-analysis"] or None, optional
+      How a turn is analyzed before the response, by default PIPELINE_MODE. "multi-call" asks for the action of the
+      speaker, the observation and the intended reaction separately, "turn-analysis" asks for them with a single
+      structured request and falls back to "multi-call" when its response is not valid.
+
+    **storage_options:
+      Options of the storage mode, see `AgentMemoryManager`. Characters can share a MongoDB connection pool
+      by passing the same 'client'.
     """
-    self._memory_db = AgentMemoryManager(name, 'json')
+    self.pipeline_mode = pipeline_mode or self.PIPELINE_MODE
 
     self._character_data = CharacterDetails(name, bio, traits, abilities, initial_location)
 
     self._logger = CustomLogger(self._character_data)
 
+    self._memory_db = AgentMemoryManager(name, storage_mode, logger=self._logger, **storage_options)
+
     memories = [memory.strip() for memory in memories.split(';')]
 
     self._agent_memory = AgentMemory(memories, self._character_data, self._logger, self._memory_db)
@@ -61,11 +106,11 @@ class Character:
     self.character_data.status = self._memory_db.get_agent_status()
 
     if self.character_data.status is None:
-      self.character_data.status = "Monika have afraid and doesn't know what is happening, she is trying to figure out what is happening."
+      self.character_data.status = initial_status or f"{name} doesn't know what is happening, and is trying to figure it out."
 
     self._mood_analyzer = MoodAnalyzer(self._character_data, self._logger)
 
-    self._conversation_history = ''
+    self._default_session = ChatSession('default')
 
     initial_time = time.time()
 
@@ -73,17 +118,45 @@ class Character:
 
     self._generative_memory = GenerativeAgentMemory(self._character_data, self._agent_memory, self._logger)
 
-    self._character_data.bio = self._generate_bio()
+    self._memory_jobs = MemoryJobQueue(self._memory_db, {'record_memory': self._record_observation}, self._logger)
+
+    self._maintenance = MaintenanceScheduler(self._memory_db, lambda: self._agent_memory.version, [
+      MaintenanceTask('bio', self._refresh_bio, memory_delta=self.BIO_REFRESH_MEMORIES or None,
+                      interval=self.BIO_REFRESH_INTERVAL or None),
+      MaintenanceTask('status', self._refresh_status, memory_delta=self.STATUS_REFRESH_MEMORIES or None,
+                      token_budget=self.STATUS_REFRESH_TOKENS or None, interval=self.STATUS_REFRESH_INTERVAL or None),
+      MaintenanceTask('reflect', self._generative_memory.generate_reflections, memory_delta=self.REFLECTION_MEMORIES or None,
+                      token_budget=self.REFLECTION_TOKENS or None)
+    ], self._logger, debounce=self.MAINTENANCE_DEBOUNCE)
+
+    snapshot = self._memory_db.get_agent_value('bio_snapshot')
 
-    self._generate_bio_thread = threading.Thread(target=self._generate_bio, daemon=True, name='Generate Bio Thread')
+    if snapshot is None or snapshot.get('definition') != self._bio_definition():
+      self._refresh_bio()
+    else:
+      self._character_data.bio = snapshot['bio']
+      self._logger.agent_info(f"Loaded bio snapshot of memory version {snapshot['version']}")
 
-    self._status_thread = threading.Thread(target=self._generate_status, daemon=True, name='Generate Status Thread')
+      if snapshot['version'] != self._agent_memory.version:
+        self._maintenance.trigger('bio')
 
     if self._agent_memory._is_initial_run:
-      self._generative_memory.generate_reflections()
+      self._maintenance.trigger('reflect')
 
     self._logger.agent_info(f'Finished initializing character in {time.time() - initial_time} seconds')
 
+  @property
+  def pipeline_mode(self) -> str:
+    """ How a turn is analyzed before the response, see `__init__`. """
+    return self._pipeline_mode
+
+  @pipeline_mode.setter
+  def pipeline_mode(self, pipeline_mode: literal["multi-call", "turn-analysis"]) -> None:
+    if pipeline_mode not in PipelineModes:
+      raise InvalidPipelineMode(pipeline_mode)
+
+    self._pipeline_mode = pipeline_mode
+
   @property
   def character_data(self) -> CharacterDetails:
     return self._character_data
@@ -109,63 +182,58 @@ class Character:
       f'How is {self._character_data.name} feeling about their recent progress in life.'
     )
 
-    prompts = (
-      textwrap.dedent("""
-      How would one describe the key features of {} given the following statements?
-      Use a maximum of 120 words. Include only the summary, do not add a title or the like.
-
-      Only use the information provided below:
-      {}
-      """),
-      textwrap.dedent("""
-      How would one describe the daily occupation of {} given the following statements?
-      Use a maximum of 120 words. Include only the summary, do not add a title or the like.
-
-      Only use the information provided below:
-      {}
-      """),
-      textwrap.dedent("""
-      How would one describe the recent progress in {}'s life given the following statements?
-      Use a maximum of 120 words. Include only the summary, do not add a title or the like.
-
-      Only use the information provided below:
-      {}
-      """)
-    )
+    templates = (prompts.BIO_KEY_FEATURES, prompts.BIO_OCCUPATION, prompts.BIO_PROGRESS)
 
-    @threaded
     def generate_summary(args) -> str:
-      (prompt, question) = args
+      (template, question) = args
       memories = self._agent_memory.retrieve(question)
 
       list_of_memories = '\n'.join([f'- {memory.access()}.' for memory in memories])
 
-      summary, _ = chat_completion(prompt.format(self._character_data.name, list_of_memories))
+      summary, _ = chat_completion(template.format(name=self._character_data.name, memories=list_of_memories), priority='background')
 
       self._logger.agent_info(f'Generated summary for > {question}\nSummary: {summary}')
 
       return summary
 
-    threads = [generate_summary((prompt, question)) for prompt, question in zip(prompts, questions)]
-
-    summaries = [result for result in threads]
+    summaries = gather(fan_out(generate_summary, zip(templates, questions)))
 
-    new_description = textwrap.dedent("""
-    You are a person named {}.
-    Your bio is the following:
-    {}
-    
-    Your abilities are the following:
-    {}
-    
-    Your traits are the following:
-    {}    
-    """).format(self._character_data.name, '\n\n'.join(summaries), self._character_data.abilities, self._character_data.traits)
+    new_description = prompts.CHARACTER_DESCRIPTION.format(
+      name=self._character_data.name,
+      abilities=self._character_data.abilities,
+      traits=self._character_data.traits,
+      summaries='\n\n'.join(summaries)
+    )
 
     self._logger.agent_info(f'Generated bio: {new_description}')
 
     return new_description
 
+  def _bio_definition(self) -> str:
+    """ Hash of the data the generated bio depends on besides the memories, a snapshot of another definition is stale. """
+    definition = '\0'.join([self._character_data.name, self._character_data.abilities, self._character_data.traits])
+
+    return hashlib.sha256(definition.encode('utf-8')).hexdigest()
+
+  def _refresh_bio(self) -> None:
+    """ Generates the bio of the character and stores it as a snapshot with the memory version it was derived from. """
+    version = self._agent_memory.version
+
+    bio = self._generate_bio()
+
+    self._character_data.update(bio=bio)
+
+    self._memory_db.set_agent_value('bio_snapshot', {
+      'bio': bio,
+      'version': version,
+      'definition': self._bio_definition(),
+      'created_at': datetime.datetime.now().isoformat()
+    })
+
+  def _refresh_status(self) -> None:
+    """ Generates the status of the character and swaps it in. """
+    self._character_data.update(status=self._generate_status())
+
   def _generate_status(self) -> str:
     """
     Generate the current status of the character based on recent memories.
@@ -181,20 +249,9 @@ class Character:
 
     list_of_memories = '\n'.join([f'{i + 1}. {memory.access()}' for i, memory in enumerate(recent_memories)])
 
-    prompt = textwrap.dedent("""
-    Information (Records):
-    {}
-
-    What would be the current emotional state of {} based on the statements above?
-    Use a maximum of 10 words and follow the format below.
+    prompt = prompts.STATUS.format(memories=list_of_memories, name=self._character_data.name)
 
-    The result should be in the third person, specifying who the person being referred to is.
-
-    Format:
-    Status: <FILL IN>
-    """).format(list_of_memories, self._character_data.name)
-
-    new_status, _ = chat_completion(prompt)
+    new_status, _ = chat_completion(prompt, priority='background')
 
     new_status = new_status.split(':')[1].strip()
 
@@ -204,9 +261,15 @@ class Character:
 
     return new_status
 
-  def chat(self, speaker: str, message: str) -> list[list[str]]:
+  def chat(self, speaker: str, message: str, session: ChatSession | None = None) -> list[list[str]]:
+    """ Synchronous version of `achat`. """
+    return run_sync(self.achat(speaker, message, session))
+
+  async def achat(self, speaker: str, message: str, session: ChatSession | None = None) -> list[list[str]]:
     """
     Engage in a conversation with the character, processing the speaker's message.
+    Every LLM request of the turn shares a retry budget of TURN_DEADLINE seconds and TURN_MAX_ATTEMPTS attempts.
+    The observation is recorded by a background memory job, the response returns as soon as its poses are ready.
 
     Parameters
     ----------
@@ -216,99 +279,292 @@ class Character:
     message : str
       The message or statement made by the speaker.
 
+    session : ChatSession or None, optional
+      The session holding the conversation history, by default the session of the character. The caller must not
+      run two turns of the same session at the same time, see `ChatSessions.turn`.
+
     Returns
     -------
     tuple(str, str)
       The response and pose of the character.
     """
+    with retry_budget(self.TURN_DEADLINE, self.TURN_MAX_ATTEMPTS):
+      return await self._respond(speaker, message, session or self._default_session)
+
+  async def _respond(self, speaker: str, message: str, session: ChatSession) -> list[list[str]]:
+    """ Runs the decision pipeline of a chat turn, see `achat`. """
     initial_time = time.time()
 
-    if len(self._agent_memory.memories) % 40 == 0:
-      self._generate_bio_thread.start()
+    prompt, observation = await self._aprepare_response(speaker, message, session)
+
+    bio = self._character_data.bio
+
+    response, tokens = await achat_completion(prompt, bio, fitting_version(prompt, bio))
+    response = response[response.find(':') + 1:].strip()
+    response = response.replace("\"", "")
+
+    self._logger.agent_info(f'Generated response: {response} \nTokens: {tokens}')
+
+    response_chunks, _ = self._split_response(response, True)
+
+    poses = await self._mood_analyzer.adetermine_poses(response_chunks)
+
+    full_response = [[pose, chunk] for pose, chunk in zip(poses, response_chunks)]
+
+    self._finish_turn(message, response, observation, session)
+
+    self._logger.agent_info(f'Finished generating response in {time.time() - initial_time} seconds')
+
+    return full_response
+
+  async def _aprepare_response(self, speaker: str, message: str, session: ChatSession) -> tuple[str, str]:
+    """
+    Runs the decision pipeline up to the prompt of the response.
+
+    Parameters
+    ----------
+    speaker : str
+      The name of the speaker engaging with the character.
 
-    self._conversation_history += f'{speaker}: {message.strip()}\n'
+    message : str
+      The message or statement made by the speaker.
 
-    @threaded
-    def generate_speaker_action(speaker: str, speaker_message: str) -> str:
-      return self._decision_processor.determine_speaker_action(speaker, speaker_message)
+    session : ChatSession
+      The session holding the conversation history.
 
-    @threaded
-    def generate_observation(speaker: str, conversation_history: str) -> str:
-      return self._decision_processor.generate_observation(speaker, conversation_history)
+    Returns
+    -------
+    tuple(str, str)
+      The prompt of the response and the observation of the turn.
+    """
+    session.conversation.add(speaker, message)
+
+    conversation = session.conversation.render()
+
+    relationship_question = f'What is the relationship between {self._character_data.name} and {speaker}?'
+    relationship_summaries = None
+    analysis = None
 
-    speaker_action = generate_speaker_action(speaker, message)
-    observation = generate_observation(speaker, self._conversation_history)
+    if self._pipeline_mode == 'turn-analysis':
+      analysis, relationship_summaries = await asyncio.gather(
+        self._decision_processor.aanalyze_turn(speaker, conversation),
+        self._decision_processor.agenerate_memory_summaries([relationship_question])
+      )
 
-    questions = [f'What is the relationship between {self._character_data.name} and {speaker}?', speaker_action]
+      if analysis is None:
+        self._logger.agent_warning('Falling back to the multi-call pipeline for this turn')
 
-    memory_summaries = self._decision_processor.generate_memory_summaries(questions)
+    if analysis is not None:
+      speaker_action, observation, posible_action = analysis['action'], analysis['observation'], analysis['reaction']
 
-    posible_action = self._decision_processor.determine_possible_action(observation, memory_summaries)
+      memory_summaries = relationship_summaries + await self._decision_processor.agenerate_memory_summaries([speaker_action])
+    else:
+      speaker_action, observation = await asyncio.gather(
+        self._decision_processor.adetermine_speaker_action(speaker, message),
+        self._decision_processor.agenerate_observation(speaker, conversation)
+      )
+
+      if relationship_summaries is None:
+        memory_summaries = await self._decision_processor.agenerate_memory_summaries([relationship_question, speaker_action])
+      else:
+        memory_summaries = relationship_summaries + await self._decision_processor.agenerate_memory_summaries([speaker_action])
+
+      posible_action = await self._decision_processor.adetermine_possible_action(observation, memory_summaries)
 
     self._logger.agent_info(f'Generating response...')
 
-    prompt = textwrap.dedent("""
-    Current Date: {}
-    {} State: {}
-    Current Location: {}
-
-    Observation:
-    {}
-
-    Summary of {} and their relationship with {}:
-    {}
-
-    Possible action to take:
-    {}
-    
-    What should {} say? Remember to use only the information provided to you. Respond in English.
-
-    Below is the conversation history up to this point:
-    {}
-    
-    Format:
-    Response: <FILL IN>
-    """).format(
-      datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-      f"{self._character_data.name}'s" if not self._character_data.name.endswith(
+    prompt = prompts.RESPONSE.format(
+      date=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+      possessive=f"{self._character_data.name}'s" if not self._character_data.name.endswith(
         's') else f"{self._character_data.name}'",
-      self._character_data.status,
-      self._character_data.position,
-      observation,
-      self._character_data.name,
-      speaker,
-      '\n\n'.join([summary for summary in memory_summaries]),
-      posible_action,
-      self._character_data.name,
-      self._conversation_history
+      status=self._character_data.status,
+      location=self._character_data.position,
+      observation=observation,
+      name=self._character_data.name,
+      speaker=speaker,
+      summaries='\n\n'.join([summary for summary in memory_summaries]),
+      action=posible_action,
+      conversation=conversation
     )
 
-    self._logger.agent_info(f'Generated prompt: {prompt}')
+    self._logger.agent_info(f'Generated prompt ({prompt.tokens} tokens, by segment {prompt.segments}): {prompt}')
 
-    response, tokens = chat_completion(prompt, self._character_data.bio, '16k')
-    response = response[response.find(':') + 1:].strip()
-    response = response.replace("\"", "")
+    return prompt, observation
 
-    self._logger.agent_info(f'Generated response: {response} \nTokens: {tokens}')
+  def _split_response(self, response: str, is_complete: bool) -> tuple[list[str], str]:
+    """
+    Splits a response into the sentences shown one by one in the game.
 
-    self._conversation_history += f'{self._character_data.name}: {response}\n'
+    Parameters
+    ----------
+    response : str
+      The response, or the part of it generated so far.
 
-    response_chunks = [m.strip() if m.endswith('?') or m.endswith('!') else m.strip() +
-                               '.' for m in response.split('.') if m.strip() != '']
+    is_complete : bool
+      Whether the response is complete, otherwise the text after the last period is not a sentence yet.
 
-    @threaded
-    def _determine_pose(chunk):
-      return self._mood_analyzer.determine_pose(chunk)
+    Returns
+    -------
+    tuple(list[str], str)
+      The sentences and the unfinished rest of the response.
+    """
+    pieces = response.replace("\"", "").split('.')
+    rest = '' if is_complete else pieces.pop()
 
-    full_response = [[_determine_pose(chunk), chunk] for chunk in response_chunks]
+    return [m.strip() if m.endswith('?') or m.endswith('!') else m.strip() + '.' for m in pieces if m.strip() != ''], rest
 
-    if tokens > 3500:
-      self._conversation_history = ''
-      self._generative_memory.generate_reflections()
-      self._status_thread.start()
+  def _finish_turn(self, message: str, response: str, observation: str, session: ChatSession) -> None:
+    """
+    Adds the response to the conversation, folds the turns that left its window into its summary in the background,
+    counts the tokens of the turn towards the maintenance triggers and queues the recording of the observation.
+    """
+    tokens = session.conversation.add(self._character_data.name, response)
 
-    self._agent_memory.record_memory(observation)
+    self._maintenance.add_tokens(estimate_tokens([{'content': message}], 0) + tokens)
 
-    self._logger.agent_info(f'Finished generating response in {time.time() - initial_time} seconds')
+    fold = session.conversation.start_fold()
+    if fold is not None:
+      # The fold outlives the turn, so it is not bound to the retry budget of the turn.
+      with retry_budget():
+        get_executor().submit(self._fold_conversation, session, *fold)
 
-    return full_response
+    self._memory_jobs.submit('record_memory', description=observation)
+
+  def _fold_conversation(self, session: ChatSession, summary: str, lines: list[str]) -> None:
+    """ Summarizes the turns that left the conversation window together with the summary of the earlier turns. """
+    prompt = prompts.CONVERSATION_SUMMARY.format(summary=summary or '(The conversation just started.)',
+                                                conversation='\n'.join(lines), name=self._character_data.name)
+
+    try:
+      new_summary, _ = chat_completion(prompt, priority='background')
+    except Exception as error:
+      self._logger.agent_error(f'Error summarizing the conversation: {error!r}')
+      new_summary = None
+
+    session.conversation.finish_fold(new_summary)
+
+    self._logger.agent_info(f'Folded {len(lines)} turns into the conversation summary, {session.conversation.tokens} tokens')
+
+  def _record_observation(self, payload: dict) -> None:
+    """ Memory job that records the observation of a turn. """
+    self._agent_memory.record_memory(payload['description'])
+    self._maintenance.notify()
+
+  @property
+  def pending_memory_jobs(self) -> int:
+    """ The number of memory jobs waiting or running in the background. """
+    return self._memory_jobs.depth
+
+  def join_background_work(self, timeout: float | None = None) -> bool:
+    """ Waits until the memory jobs and the maintenance tasks have run, returns False if the timeout expires first. """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+
+    if not self._memory_jobs.join(timeout):
+      return False
+
+    return self._maintenance.join(deadline - time.monotonic() if deadline is not None else None)
+
+  async def astream_chat(self, speaker: str, message: str, session: ChatSession | None = None) -> AsyncIterator[list[str]]:
+    """
+    Streaming version of `achat`, yields every sentence of the response with its pose as soon as the sentence is
+    generated.
+
+    Parameters
+    ----------
+    speaker : str
+      The name of the speaker engaging with the character.
+
+    message : str
+      The message or statement made by the speaker.
+
+    session : ChatSession or None, optional
+      The session holding the conversation history, by default the session of the character.
+
+    Yields
+    ------
+    list[str]
+      The pose and the sentence.
+    """
+    queue: asyncio.Queue[list[str] | None] = asyncio.Queue()
+
+    async def respond() -> None:
+      try:
+        await self._stream_respond(speaker, message, session or self._default_session, queue.put_nowait)
+      finally:
+        queue.put_nowait(None)
+
+    with retry_budget(self.TURN_DEADLINE, self.TURN_MAX_ATTEMPTS):
+      producer = asyncio.ensure_future(respond())
+
+    try:
+      while (sentence := await queue.get()) is not None:
+        yield sentence
+
+      await producer
+    finally:
+      if not producer.done():
+        producer.cancel()
+
+  async def _stream_respond(self, speaker: str, message: str, session: ChatSession,
+                            emit: Callable[[list[str]], None]) -> None:
+    """ Runs the decision pipeline of a streamed chat turn, see `astream_chat`. """
+    initial_time = time.time()
+
+    prompt, observation = await self._aprepare_response(speaker, message, session)
+
+    bio = self._character_data.bio
+
+    stream = astream_chat_completion(prompt, bio, fitting_version(prompt, bio))
+
+    generated = ''
+    response_start = None
+    pending: collections.deque[tuple[str, asyncio.Future]] = collections.deque()
+    started_sentences = 0
+
+    def start_poses(is_complete: bool) -> None:
+      nonlocal started_sentences
+      sentences, _ = self._split_response(generated[response_start:], is_complete)
+
+      for sentence in sentences[started_sentences:]:
+        pending.append((sentence, asyncio.ensure_future(self._mood_analyzer.adetermine_pose(sentence))))
+
+      started_sentences = len(sentences)
+
+    def emit_ready() -> None:
+      while pending and pending[0][1].done():
+        sentence, pose = pending.popleft()
+        emit([pose.result(), sentence])
+
+        if started_sentences - len(pending) == 1:
+          self._logger.agent_info(f'First sentence ready in {time.time() - initial_time} seconds')
+
+    async for content in stream:
+      generated += content
+
+      if response_start is None:
+        if ':' in generated[:RESPONSE_PREFIX_LENGTH]:
+          response_start = generated.find(':') + 1
+        elif len(generated) > RESPONSE_PREFIX_LENGTH:
+          response_start = 0
+        else:
+          continue
+
+      start_poses(False)
+      emit_ready()
+
+    if response_start is None:
+      response_start = generated.find(':') + 1
+
+    start_poses(True)
+
+    while pending:
+      await pending[0][1]
+      emit_ready()
+
+    response = generated[response_start:].strip().replace("\"", "")
+
+    self._logger.agent_info(f'Generated response: {response} \nTokens: {stream.tokens}')
+
+    self._finish_turn(message, response, observation, session)
+
+    self._logger.agent_info(f'Finished streaming response in {time.time() - initial_time} seconds')
@@ -1,3 +1,6 @@
+import threading
+
+
 class CharacterDetails:
   """ Represents the details of a character including name, bio, traits, abilities, and position. """
 
@@ -22,6 +25,7 @@ class CharacterDetails:
     position : str
         The current position of the character.
     """
+    self._lock = threading.Lock()
     self._name = name
     self._bio = bio
     self._status = None
@@ -40,7 +44,8 @@ class CharacterDetails:
 
   @bio.setter
   def bio(self, new_bio: str) -> None:
-    self._bio = new_bio
+    with self._lock:
+      self._bio = new_bio
 
   @property
   def status(self) -> str:
@@ -48,7 +53,8 @@ class CharacterDetails:
 
   @status.setter
   def status(self, new_status: str) -> None:
-    self._status = new_status
+    with self._lock:
+      self._status = new_status
 
   @property
   def position(self) -> str:
@@ -58,6 +64,30 @@ class CharacterDetails:
   def position(self, new_position: str) -> None:
     self._position = new_position
 
+  def update(self, bio: str | None = None, status: str | None = None) -> None:
+    """
+    Swaps in a new bio and/or status in one step, so a reader never sees a partial update.
+
+    Parameters
+    ----------
+    bio : str or None, optional
+        The new biography, by default the current one is kept.
+
+    status : str or None, optional
+        The new status, by default the current one is kept.
+    """
+    with self._lock:
+      if bio is not None:
+        self._bio = bio
+
+      if status is not None:
+        self._status = status
+
+  def profile(self) -> tuple[str, str]:
+    """ Returns the bio and the status of the character at the same point in time. """
+    with self._lock:
+      return self._bio, self._status
+
   @property
   def traits(self) -> str:
     return self._traits
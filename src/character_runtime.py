@@ -0,0 +1,97 @@
+from .character import Character
+from .errors import UnknownCharacter
+from .memory_storage.mongo_store import DEFAULT_CLIENT_OPTIONS
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from concurrent.futures import ThreadPoolExecutor
+from typing import Literal as literal
+
+import os
+import threading
+
+
+class CharacterRuntime:
+  """
+  Hosts many characters in one process. The characters share the OpenAI client (and with it the rate limiter and the
+  connection pool of the API), the executor of background work, and, in the "mongodb" storage mode, one MongoDB
+  connection pool.
+  """
+
+  def __init__(self, definitions: dict[str, dict], storage_mode: literal["mongodb", "json", "log", "sqlite"] = 'log',
+               **storage_options) -> None:
+    """
+    Initializes the CharacterRuntime, the characters are created on first use or by `load_all`.
+
+    Parameters
+    ----------
+    definitions : dict[str, dict]
+        The definition of every character by name, with the 'bio', 'abilities', 'memories' and 'traits' of the
+        character and optionally its 'initial_location' and 'initial_status', like the dicts of data.py.
+
+    storage_mode : literal["mongodb", "json", "log", "sqlite"], optional
+        The storage mode of every character, by default 'log'.
+
+    **storage_options:
+        Options of the storage mode, see `AgentMemoryManager`. In the "mongodb" mode, the connection-pool settings
+        apply to the client shared by every character.
+    """
+    self._definitions = definitions
+    self._storage_mode = storage_mode
+    self._storage_options = storage_options
+
+    if storage_mode == 'mongodb' and 'client' not in storage_options:
+      load_dotenv()
+
+      client_options = {key: value for key, value in storage_options.items() if key not in ('flush_interval', 'max_batch_size')}
+      self._storage_options = {key: value for key, value in storage_options.items() if key not in client_options}
+      self._storage_options['client'] = MongoClient(os.getenv('MONGO_URI'), **{**DEFAULT_CLIENT_OPTIONS, **client_options})
+
+    self._characters: dict[str, Character] = {}
+    self._locks = {name: threading.Lock() for name in definitions}
+
+  @property
+  def names(self) -> list[str]:
+    """ The names of the characters that can be served. """
+    return list(self._definitions)
+
+  @property
+  def loaded(self) -> list[str]:
+    """ The names of the characters already created. """
+    return list(self._characters)
+
+  def get(self, name: str) -> Character:
+    """
+    Returns a character, created on first use.
+
+    Parameters
+    ----------
+    name : str
+        The name of the character.
+
+    Returns
+    -------
+    Character
+        The character.
+
+    Raises
+    ------
+    UnknownCharacter
+        If no character is defined with that name.
+    """
+    if name not in self._definitions:
+      raise UnknownCharacter(name, self.names)
+
+    with self._locks[name]:
+      if name not in self._characters:
+        self._characters[name] = Character(name, **self._definitions[name], storage_mode=self._storage_mode,
+                                           **self._storage_options)
+
+      return self._characters[name]
+
+  def load_all(self) -> list[Character]:
+    """
+    Creates every character concurrently, returns them in the order of the definitions. The characters are created
+    on short-lived threads, their initialization waits on the shared executor and must not occupy its workers.
+    """
+    with ThreadPoolExecutor(max_workers=max(len(self._definitions), 1), thread_name_prefix='character-loader') as loader:
+      return list(loader.map(self.get, self.names))
@@ -0,0 +1,93 @@
+from .conversation_buffer import ConversationBuffer
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import time
+import asyncio
+
+
+class ChatSession:
+  """ Conversation state of one player with a character, the long-term memory is shared by every session. """
+
+  def __init__(self, session_id: str) -> None:
+    """
+    Initializes the ChatSession.
+
+    Parameters
+    ----------
+    session_id : str
+        The identifier of the session.
+    """
+    self.session_id = session_id
+    self.conversation = ConversationBuffer()
+    self.lock = asyncio.Lock()
+    self.last_active = time.monotonic()
+
+
+class ChatSessions:
+  """
+  Registry of the chat sessions of an event loop. A turn holds the lock of its session, so the turns of a session
+  run one after another, and a semaphore bounds the turns running at the same time across sessions.
+  """
+
+  def __init__(self, max_concurrent_turns: int = 8, idle_timeout: float = 3600.) -> None:
+    """
+    Initializes the ChatSessions.
+
+    Parameters
+    ----------
+    max_concurrent_turns : int, optional
+        The maximum number of turns running at the same time, by default 8.
+
+    idle_timeout : float, optional
+        The number of seconds after which an idle session is forgotten, by default 3600.
+    """
+    self.max_concurrent_turns = max_concurrent_turns
+    self.idle_timeout = idle_timeout
+
+    self._sessions: dict[str, ChatSession] = {}
+    self._semaphore = asyncio.Semaphore(max_concurrent_turns)
+
+  def __len__(self) -> int:
+    return len(self._sessions)
+
+  def _evict_idle(self) -> None:
+    """ Forgets the sessions idle for longer than the idle timeout and not in a turn. """
+    now = time.monotonic()
+
+    for session_id, session in list(self._sessions.items()):
+      if now - session.last_active > self.idle_timeout and not session.lock.locked():
+        del self._sessions[session_id]
+
+  def get(self, session_id: str) -> ChatSession:
+    """ Returns the session with the given identifier, created if needed. """
+    self._evict_idle()
+
+    session = self._sessions.get(session_id)
+    if session is None:
+      session = self._sessions[session_id] = ChatSession(session_id)
+
+    session.last_active = time.monotonic()
+    return session
+
+  def end(self, session_id: str) -> bool:
+    """ Forgets a session, returns whether it existed. """
+    return self._sessions.pop(session_id, None) is not None
+
+  @asynccontextmanager
+  async def turn(self, session_id: str) -> AsyncIterator[ChatSession]:
+    """
+    Waits for the session to be free and for a turn slot, and yields the session.
+
+    Parameters
+    ----------
+    session_id : str
+        The identifier of the session.
+    """
+    session = self.get(session_id)
+
+    async with session.lock:
+      async with self._semaphore:
+        yield session
+
+    session.last_active = time.monotonic()
@@ -0,0 +1,138 @@
+from .openai_helpers.rate_limiter import estimate_tokens
+
+import os
+import threading
+
+
+class ConversationTurn:
+  """ A line of a conversation and its estimated number of tokens. """
+
+  def __init__(self, speaker: str, text: str) -> None:
+    self.speaker = speaker
+    self.text = text
+    self.tokens = estimate_tokens([{'content': str(self)}], 0)
+
+  def __str__(self) -> str:
+    return f'{self.speaker}: {self.text}'
+
+
+class ConversationBuffer:
+  """
+  History of a conversation with a bounded size. The most recent turns are kept verbatim in a window of
+  `window_tokens`, the turns that leave the window are folded into a rolling summary by the owner of the buffer
+  (see `start_fold`), and are kept verbatim until the summary that covers them is ready.
+  """
+
+  WINDOW_TOKENS = int(os.getenv('CONVERSATION_WINDOW_TOKENS', 1000))
+
+  def __init__(self, window_tokens: int | None = None) -> None:
+    """
+    Initializes the ConversationBuffer.
+
+    Parameters
+    ----------
+    window_tokens : int or None, optional
+        The tokens of the turns kept verbatim, by default WINDOW_TOKENS.
+    """
+    self.window_tokens = window_tokens or self.WINDOW_TOKENS
+
+    self._lock = threading.Lock()
+    self._window: list[ConversationTurn] = []
+    self._window_tokens = 0
+    self._evicted: list[ConversationTurn] = []
+    self._folding: list[ConversationTurn] = []
+    self._summary = ''
+    self._total_tokens = 0
+
+  @property
+  def summary(self) -> str:
+    """ The summary of the turns folded so far. """
+    return self._summary
+
+  @property
+  def total_tokens(self) -> int:
+    """ The tokens of every turn added to the conversation. """
+    return self._total_tokens
+
+  @property
+  def tokens(self) -> int:
+    """ The tokens of the rendered conversation. """
+    with self._lock:
+      return (estimate_tokens([{'content': self._summary}], 0) if self._summary else 0) + self._window_tokens + sum(
+        turn.tokens for turn in self._folding + self._evicted)
+
+  def add(self, speaker: str, text: str) -> int:
+    """
+    Adds a turn at the end of the conversation, the oldest turns leave the window once it is full.
+
+    Parameters
+    ----------
+    speaker : str
+        The name of the speaker.
+
+    text : str
+        What the speaker said.
+
+    Returns
+    -------
+    int
+        The tokens of the turn.
+    """
+    turn = ConversationTurn(speaker, text.strip())
+
+    with self._lock:
+      self._window.append(turn)
+      self._window_tokens += turn.tokens
+      self._total_tokens += turn.tokens
+
+      while self._window_tokens > self.window_tokens and len(self._window) > 1:
+        evicted = self._window.pop(0)
+        self._window_tokens -= evicted.tokens
+        self._evicted.append(evicted)
+
+    return turn.tokens
+
+  def render(self) -> str:
+    """ Returns the conversation as it goes in a prompt, the summary of the earlier turns followed by the recent ones. """
+    with self._lock:
+      lines = [str(turn) for turn in self._folding + self._evicted + self._window]
+      summary = self._summary
+
+    if summary:
+      lines.insert(0, f'(Summary of the earlier conversation: {summary})')
+
+    return ''.join([f'{line}\n' for line in lines])
+
+  def start_fold(self) -> tuple[str, list[str]] | None:
+    """
+    Takes the turns that left the window to fold them into the summary, unless a fold is already running.
+
+    Returns
+    -------
+    tuple(str, list[str]) or None
+        The current summary and the turns to fold into it, or None if there is nothing to fold.
+    """
+    with self._lock:
+      if self._folding or not self._evicted:
+        return None
+
+      self._folding, self._evicted = self._evicted, []
+
+      return self._summary, [str(turn) for turn in self._folding]
+
+  def finish_fold(self, summary: str | None) -> None:
+    """
+    Replaces the summary with the one that covers the turns of `start_fold`.
+
+    Parameters
+    ----------
+    summary : str or None
+        The new summary, or None if the fold failed and the turns must be folded again later.
+    """
+    with self._lock:
+      if summary is None:
+        self._evicted = self._folding + self._evicted
+      else:
+        self._summary = summary.strip()
+
+      self._folding = []
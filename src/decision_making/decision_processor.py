@@ -1,11 +1,13 @@
-import textwrap
+import json
+import asyncio
 import datetime
 
+from .. import prompts
 from ..agent_memory.agent_memory import AgentMemory
 from ..character_data import CharacterDetails
 from ..custom_logger import CustomLogger
-from ..openai_helpers.chat_completion import chat_completion
-from .thread_decorator import threaded
+from ..openai_helpers.chat_completion import achat_completion
+from ..openai_helpers.async_client import run_sync
 
 
 class DecisionProcessor:
@@ -31,6 +33,10 @@ class DecisionProcessor:
     self._logger = logger
 
   def determine_speaker_action(self, speaker: str, speaker_message: str) -> str:
+    """ Synchronous version of `adetermine_speaker_action`. """
+    return run_sync(self.adetermine_speaker_action(speaker, speaker_message))
+
+  async def adetermine_speaker_action(self, speaker: str, speaker_message: str) -> str:
     """
     Determines the high-level action taken by a speaker in a conversation.
 
@@ -49,21 +55,9 @@ class DecisionProcessor:
     """
     self._logger.agent_info(f'Determining speaker action for {speaker}...')
 
-    prompt = textwrap.dedent("""
-    Conversation between {} and {}:
-    {}
-
-    Using only the information above,
-    What high-level action is {} taking? Describe the action in a sentence.
-    Use a maximum of 20 words and MANDATORY use the format below.
-
-    The result must be in 3rd person clarifying who the person is.
+    prompt = prompts.SPEAKER_ACTION.format(speaker=speaker, name=self._character_data.name, message=speaker_message)
 
-    Format:
-    Action: <FILL IN>
-    """).format(speaker, self._character_data.name, f'{speaker}: {speaker_message}', speaker)
-
-    speaker_action, _ = chat_completion(prompt)
+    speaker_action, _ = await achat_completion(prompt, cache_if=lambda response: ':' in response)
 
     speaker_action = speaker_action.split(':')[1].strip()
 
@@ -72,6 +66,10 @@ class DecisionProcessor:
     return speaker_action
 
   def generate_observation(self, speaker: str, conversation: str) -> str:
+    """ Synchronous version of `agenerate_observation`. """
+    return run_sync(self.agenerate_observation(speaker, conversation))
+
+  async def agenerate_observation(self, speaker: str, conversation: str) -> str:
     """
     Generates a high-level observation about the conversation.
 
@@ -90,22 +88,10 @@ class DecisionProcessor:
     """
     self._logger.agent_info('Generating observation...')
 
-    prompt = textwrap.dedent("""
-    Conversation between {} and {}:
-    {}
+    prompt = prompts.OBSERVATION.format(speaker=speaker, name=self._character_data.name, conversation=conversation,
+                                       location=self._character_data.position)
 
-    Location: {}
-
-    Using only the information above,
-    What high-level observation can be generated about the conversation (do not infer anything)? Describe the observation in a sentence and do not omit important information.
-
-    Use a maximum of 40 words and MANDATORY use the format below.
-
-    Format:
-    Observation: <FILL IN>
-    """).format(speaker, self._character_data.name, conversation, self._character_data.position)
-
-    observation, _ = chat_completion(prompt)
+    observation, _ = await achat_completion(prompt)
 
     observation = observation.split(':')[1].strip()
 
@@ -114,8 +100,12 @@ class DecisionProcessor:
     return observation
 
   def generate_memory_summaries(self, questions: list[str]) -> list[str]:
+    """ Synchronous version of `agenerate_memory_summaries`. """
+    return run_sync(self.agenerate_memory_summaries(questions))
+
+  async def agenerate_memory_summaries(self, questions: list[str]) -> list[str]:
     """
-    Generates summaries of memories related to given questions.
+    Generates summaries of memories related to given questions, concurrently.
 
     Parameters
     ----------
@@ -129,36 +119,23 @@ class DecisionProcessor:
     """
     self._logger.agent_info('Generating memory summaries...')
 
-    prompt = textwrap.dedent("""
-    Information (Records):
-    {}
-
-    Using only the information above.
-    Make an exact summary that is coherent, concise, and complete. Only put the summary, no titles or things like that.
-    MANDATORY, follow the following format.:
-
-    Format:
-    Summary: <FILL IN>
-    """)
-
-    summaries = []
-
-    @threaded
-    def wrap(question: str) -> None:
-      memories_retrieved = self._agent_memory.retrieve(question)
+    async def summarize(question: str) -> str:
+      memories_retrieved = await self._agent_memory.aretrieve(question)
       memories_descriptions = '\n'.join([f'{i + 1}. {memory.access()}' for i, memory in enumerate(memories_retrieved)])
-      summary, _ = chat_completion(prompt.format(memories_descriptions))
+      summary, _ = await achat_completion(prompts.MEMORY_SUMMARY.format(memories=memories_descriptions))
       normalized_summary = summary.split(':')[1].strip()
 
       self._logger.agent_info(f'Generated memory summary: {normalized_summary}')
 
-      summaries.append(normalized_summary)
-
-    _ = [wrap(question) for question in questions]
+      return normalized_summary
 
-    return summaries
+    return list(await asyncio.gather(*[summarize(question) for question in questions]))
 
   def determine_possible_action(self, observation: str, memory_summaries: list[str]) -> str:
+    """ Synchronous version of `adetermine_possible_action`. """
+    return run_sync(self.adetermine_possible_action(observation, memory_summaries))
+
+  async def adetermine_possible_action(self, observation: str, memory_summaries: list[str]) -> str:
     """
     Determines a possible action the agent can take based on the observation and memory summaries.
 
@@ -177,42 +154,79 @@ class DecisionProcessor:
     """
     self._logger.agent_info('Generating possible agent action...')
 
-    prompt = textwrap.dedent("""
-    Description of {}:
-    {}
-    Current date: {}
-    State of {}: {}
-    Location: {}
-
-    Observation:
-    {}
-
-    Relevant context summary of {}'s memory:
-    {}
-
-    Should {} react to the observation? And if so, how should they react to the observation?
-    Use a maximum of 10 words and MANDATORY use the format below.
-    Do not use information that was not given to you.
-
-    Format:
-    Action: <FILL IN>
-    """).format(
-      self._character_data.name,
-      self._character_data.bio,
-      datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-      self._character_data.name,
-      self._character_data.status,
-      self._character_data.position,
-      observation,
-      self._character_data.name,
-      '\n\n'.join([f'{summary}' for summary in memory_summaries]),
-      self._character_data.name
+    bio, status = self._character_data.profile()
+
+    prompt = prompts.POSSIBLE_ACTION.format(
+      name=self._character_data.name,
+      bio=bio,
+      date=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+      status=status,
+      location=self._character_data.position,
+      observation=observation,
+      summaries='\n\n'.join([f'{summary}' for summary in memory_summaries])
     )
 
-    possible_action, _ = chat_completion(prompt, self._character_data.bio)
+    possible_action, _ = await achat_completion(prompt, bio)
 
     possible_action = self._prev_possible_action = possible_action.split(':')[1].strip()
 
     self._logger.agent_info(f'Generated possible agent action: {possible_action}')
 
     return possible_action
+
+  def analyze_turn(self, speaker: str, conversation: str) -> dict[str, str] | None:
+    """ Synchronous version of `aanalyze_turn`. """
+    return run_sync(self.aanalyze_turn(speaker, conversation))
+
+  async def aanalyze_turn(self, speaker: str, conversation: str) -> dict[str, str] | None:
+    """
+    Determines the action of the speaker, the observation about the conversation and the intended reaction of the
+    agent with a single structured request, instead of `adetermine_speaker_action`, `agenerate_observation` and
+    `adetermine_possible_action`. The reaction is decided without the memory summaries.
+
+    Parameters
+    ----------
+    speaker : str
+        The name of the speaker.
+
+    conversation : str
+        The content of the conversation, ending with the message of the speaker.
+
+    Returns
+    -------
+    dict[str, str] or None
+        The 'action', 'observation' and 'reaction' of the turn, or None if the response is not valid.
+    """
+    self._logger.agent_info('Analyzing turn...')
+
+    bio, status = self._character_data.profile()
+
+    prompt = prompts.TURN_ANALYSIS.format(
+      name=self._character_data.name,
+      bio=bio,
+      date=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+      status=status,
+      location=self._character_data.position,
+      speaker=speaker,
+      conversation=conversation
+    )
+
+    response, _ = await achat_completion(prompt, bio)
+
+    try:
+      analysis = json.loads(response[response.index('{'): response.rindex('}') + 1])
+    except ValueError:
+      self._logger.agent_warning(f'Turn analysis is not valid JSON: {response!r}')
+      return None
+
+    if not isinstance(analysis, dict) or not all(
+        isinstance(analysis.get(key), str) and analysis[key].strip() for key in ('action', 'observation', 'reaction')):
+      self._logger.agent_warning(f'Turn analysis is missing fields: {response!r}')
+      return None
+
+    analysis = {key: analysis[key].strip() for key in ('action', 'observation', 'reaction')}
+    self._prev_possible_action = analysis['reaction']
+
+    self._logger.agent_info(f'Analyzed turn: {analysis}')
+
+    return analysis
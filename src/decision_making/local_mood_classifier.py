@@ -0,0 +1,278 @@
+import re
+import json
+import zlib
+import threading
+import numpy as np
+
+N_FEATURES = 2 ** 14
+MIN_EXAMPLES = 50
+MAX_EXAMPLES = 5000
+MIN_CONFIDENT = 20
+
+# The texts are featurized this many at a time, so a dense feature matrix never grows with the decision log.
+CHUNK_SIZE = 256
+
+
+class LocalMoodClassifier:
+  """
+  Nearest-centroid classifier of moods and arm positions over hashed lexical features, trained from logged LLM
+  decisions. It runs on CPU without network calls, and tells its confidence so uncertain sentences can be escalated.
+  """
+
+  def __init__(self, n_features: int = N_FEATURES, sharpness: float = 20., min_examples: int = MIN_EXAMPLES,
+               max_examples: int = MAX_EXAMPLES) -> None:
+    """
+    Initializes the LocalMoodClassifier.
+
+    Parameters
+    ----------
+    n_features : int, optional
+        The number of hashed features, by default N_FEATURES.
+
+    sharpness : float, optional
+        The scale of the similarities before the softmax that gives the confidence, by default 20.
+
+    min_examples : int, optional
+        The number of examples needed before the classifier answers, by default MIN_EXAMPLES.
+
+    max_examples : int, optional
+        The number of most recent examples the classifier is trained on, by default MAX_EXAMPLES.
+    """
+    self._n_features = n_features
+    self._sharpness = sharpness
+    self._min_examples = min_examples
+    self._max_examples = max_examples
+    self._lock = threading.Lock()
+
+    self._moods: list[str] = []
+    self._mood_centroids: np.ndarray | None = None
+    self._arms: list[str] = []
+    self._arm_centroids: np.ndarray | None = None
+    self.size = 0
+
+  @property
+  def is_trained(self) -> bool:
+    return self._mood_centroids is not None
+
+  def _tokens(self, text: str) -> list[str]:
+    """ Word unigrams and bigrams, character trigrams and punctuation marks of the text. """
+    text = text.lower()
+    words = re.findall(r"[a-z']+", text)
+
+    tokens = [f'w:{word}' for word in words]
+    tokens += [f'b:{first} {second}' for first, second in zip(words, words[1:])]
+    tokens += [f'c:{word[i:i + 3]}' for word in words for i in range(max(len(word) - 2, 1))]
+    tokens += [f'p:{mark}' for mark in re.findall(r'[!?]|\.\.\.|~|<3|:\)|:\(', text)]
+
+    return tokens
+
+  def featurize(self, texts: list[str]) -> np.ndarray:
+    """
+    Maps texts to L2-normalized vectors of hashed features.
+
+    Parameters
+    ----------
+    texts : list[str]
+        The texts to featurize.
+
+    Returns
+    -------
+    np.ndarray
+        A float32 matrix with one row per text.
+    """
+    features = np.zeros((len(texts), self._n_features), dtype=np.float32)
+
+    for row, text in enumerate(texts):
+      for token in self._tokens(text):
+        features[row, zlib.crc32(token.encode()) % self._n_features] += 1.
+
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    return features / np.maximum(norms, 1e-12)
+
+  def _centroids(self, texts: list[str], labelings: list[list[str]]) -> list[tuple[list[str], np.ndarray]]:
+    """
+    Returns the classes and their normalized mean feature vectors, for every labeling of the texts. The texts are
+    featurized once, a chunk at a time, and every chunk is added to the centroids of every labeling.
+    """
+    models = []
+    for labels in labelings:
+      classes = sorted(set(labels))
+      class_rows = {label: row for row, label in enumerate(classes)}
+      models.append((classes, np.array([class_rows[label] for label in labels]),
+                     np.zeros((len(classes), self._n_features), dtype=np.float32)))
+
+    for start in range(0, len(texts), CHUNK_SIZE):
+      features = self.featurize(texts[start:start + CHUNK_SIZE])
+
+      for _, label_rows, centroids in models:
+        np.add.at(centroids, label_rows[start:start + CHUNK_SIZE], features)
+
+    for _, _, centroids in models:
+      centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+    return [(classes, centroids) for classes, _, centroids in models]
+
+  def fit(self, texts: list[str], poses: list[str]) -> None:
+    """
+    Trains the classifier on the most recent examples, see `max_examples`.
+
+    Parameters
+    ----------
+    texts : list[str]
+        The sentences of the examples.
+
+    poses : list[str]
+        The pose of every sentence, as '<MOOD> <ARM POSITION>'.
+    """
+    if len(texts) < self._min_examples:
+      return
+
+    texts, poses = texts[-self._max_examples:], poses[-self._max_examples:]
+    moods, arms = zip(*[pose.split(' ', 1) for pose in poses])
+
+    mood_model, arm_model = self._centroids(texts, [list(moods), list(arms)])
+
+    with self._lock:
+      self._moods, self._mood_centroids = mood_model
+      self._arms, self._arm_centroids = arm_model
+      self.size = len(texts)
+
+  def fit_log(self, log_file: str) -> int:
+    """ Trains the classifier from a JSONL file of {"text", "pose"} decisions, returns the number of examples. """
+    texts, poses = load_decisions(log_file)
+    self.fit(texts, poses)
+    return len(texts)
+
+  def _classify(self, features: np.ndarray, classes: list[str], centroids: np.ndarray) -> tuple[list[str], np.ndarray]:
+    similarities = features @ centroids.T * self._sharpness
+    probabilities = np.exp(similarities - similarities.max(axis=1, keepdims=True))
+    probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+    best = probabilities.argmax(axis=1)
+    return [classes[i] for i in best], probabilities[np.arange(len(best)), best]
+
+  def predict(self, texts: list[str]) -> list[tuple[str, float]]:
+    """
+    Classifies sentences.
+
+    Parameters
+    ----------
+    texts : list[str]
+        The sentences to classify.
+
+    Returns
+    -------
+    list[tuple[str, float]]
+        The pose of every sentence as '<MOOD> <ARM POSITION>', with the confidence of the least confident of both.
+
+    Raises
+    ------
+    RuntimeError
+        If the classifier has not been trained.
+    """
+    with self._lock:
+      if not self.is_trained:
+        raise RuntimeError('The local mood classifier has not been trained.')
+
+      moods, mood_centroids, arms, arm_centroids = self._moods, self._mood_centroids, self._arms, self._arm_centroids
+
+    predictions = []
+    for start in range(0, len(texts), CHUNK_SIZE):
+      features = self.featurize(texts[start:start + CHUNK_SIZE])
+      chosen_moods, mood_confidences = self._classify(features, moods, mood_centroids)
+      chosen_arms, arm_confidences = self._classify(features, arms, arm_centroids)
+
+      predictions += [
+        (f'{mood} {arm}', float(confidence))
+        for mood, arm, confidence in zip(chosen_moods, chosen_arms, np.minimum(mood_confidences, arm_confidences))
+      ]
+
+    return predictions
+
+
+def load_decisions(log_file: str) -> tuple[list[str], list[str]]:
+  """ Reads the sentences and poses of a JSONL decision log, skipping malformed lines. """
+  texts, poses = [], []
+
+  try:
+    with open(log_file, 'r', encoding='utf-8') as file:
+      for line in file:
+        try:
+          decision = json.loads(line)
+          text, pose = decision['text'], decision['pose']
+        except (ValueError, KeyError, TypeError):
+          continue
+
+        if len(pose.split(' ')) == 2:
+          texts.append(text)
+          poses.append(pose)
+  except FileNotFoundError:
+    pass
+
+  return texts, poses
+
+
+def split_decisions(count: int, test_fraction: float = .2, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+  """ Shuffles the indexes of `count` decisions and splits them into the held-out test indexes and the train indexes. """
+  order = np.random.default_rng(seed).permutation(count)
+  test_size = max(int(count * test_fraction), 1)
+  return order[:test_size], order[test_size:]
+
+
+def held_out_agreement(texts: list[str], poses: list[str], confidence_threshold: float, test_fraction: float = .2,
+                       seed: int = 0, min_confident: int = MIN_CONFIDENT, max_examples: int = MAX_EXAMPLES,
+                       **options) -> float | None:
+  """
+  Measures how often the classifier agrees with the LLM on the held-out decisions it is confident about, the ones
+  the hybrid mode keeps local. Only the most recent decisions are split, like `LocalMoodClassifier.fit` only trains
+  on the most recent ones.
+
+  Parameters
+  ----------
+  texts : list[str]
+      The sentences of the decisions.
+
+  poses : list[str]
+      The pose the LLM chose for every sentence.
+
+  confidence_threshold : float
+      The confidence from which a sentence is kept local.
+
+  test_fraction : float, optional
+      The fraction of the decisions held out of the training, by default .2.
+
+  seed : int, optional
+      The seed of the split, by default 0.
+
+  min_confident : int, optional
+      The number of confident held-out sentences needed to measure the agreement, by default MIN_CONFIDENT.
+
+  max_examples : int, optional
+      The number of most recent decisions that are split, by default MAX_EXAMPLES.
+
+  **options:
+      Options of the classifier, like 'sharpness' and 'min_examples'.
+
+  Returns
+  -------
+  float or None
+      The agreement, None if there are not enough decisions to train the classifier or fewer than `min_confident`
+      held-out sentences are confident enough.
+  """
+  texts, poses = texts[-max_examples:], poses[-max_examples:]
+
+  if len(texts) < 2:
+    return None
+
+  test, train = split_decisions(len(texts), test_fraction, seed)
+
+  classifier = LocalMoodClassifier(max_examples=max_examples, **options)
+  classifier.fit([texts[i] for i in train], [poses[i] for i in train])
+
+  if not classifier.is_trained:
+    return None
+
+  predictions = classifier.predict([texts[i] for i in test])
+  hits = [pose == poses[i] for i, (pose, confidence) in zip(test, predictions) if confidence >= confidence_threshold]
+
+  return sum(hits) / len(hits) if len(hits) >= max(min_confident, 1) else None
@@ -1,14 +1,28 @@
-from ..openai_helpers.chat_completion import chat_completion
+from .. import prompts
+from ..openai_helpers.chat_completion import achat_completion
+from ..openai_helpers.async_client import run_sync
 from ..character_data import CharacterDetails
 from ..custom_logger import CustomLogger
+from ..errors import InvalidClassifierMode
+from .local_mood_classifier import LocalMoodClassifier, held_out_agreement, load_decisions
+from .thread_decorator import threaded
+from typing import Literal as literal
 
-import textwrap
+import re
+import json
+import asyncio
+import threading
+
+ClassifierModes = ['llm', 'local', 'hybrid']
+DEFAULT_POSE = 'neut ldown'
 
 
 class MoodAnalyzer:
   """ Analyzes the mood and pose based on given messages. """
 
-  def __init__(self, character_data: CharacterDetails, logger: CustomLogger) -> None:
+  def __init__(self, character_data: CharacterDetails, logger: CustomLogger,
+               classifier_mode: literal["llm", "local", "hybrid"] = 'hybrid', confidence_threshold: float = .6,
+               decision_log_file: str | None = None, retrain_interval: int = 100, min_agreement: float = .9) -> None:
     """
     Initializes the MoodAnalyzer.
 
@@ -19,10 +33,44 @@ class MoodAnalyzer:
 
     logger : CustomLogger
         An instance of CustomLogger for logging information.
+
+    classifier_mode : literal["llm", "local", "hybrid"], optional
+        Who determines the poses: the LLM, the local classifier without network calls, or the local classifier
+        escalating to the LLM when it is not confident enough, by default 'hybrid'. The hybrid mode only uses the local
+        classifier once it agrees with the LLM on held-out logged decisions, see `min_agreement`.
+
+    confidence_threshold : float, optional
+        The confidence under which the hybrid mode escalates a sentence to the LLM, by default .6.
+
+    decision_log_file : str or None, optional
+        The JSONL file where the LLM decisions are logged to train the local classifier,
+        by default '<character name>_mood_decisions.jsonl'.
+
+    retrain_interval : int, optional
+        The number of new logged decisions after which the local classifier is trained again, by default 100.
+
+    min_agreement : float, optional
+        The agreement with the LLM, on the held-out logged decisions the local classifier is confident about, from
+        which the hybrid mode uses the local classifier, by default .9.
     """
+    if classifier_mode not in ClassifierModes:
+      raise InvalidClassifierMode(classifier_mode)
+
     self._character_data = character_data
     self._logger = logger
 
+    self.classifier_mode = classifier_mode
+    self.confidence_threshold = confidence_threshold
+    self.min_agreement = min_agreement
+    self._decision_log_file = decision_log_file or f'{character_data.name}_mood_decisions.jsonl'
+    self._decision_log_lock = threading.Lock()
+    self._retrain_interval = retrain_interval
+    self._new_decisions = 0
+    self._training = False
+    self._is_trusted = False
+
+    self._classifier = LocalMoodClassifier()
+
     self.available_moods = {
       'neut': 'neutral',
       'angr': 'angry',
@@ -56,9 +104,95 @@ class MoodAnalyzer:
     self._mood_list = '\n'.join([f'{key}: {value}' for key, value in self.available_moods.items()])
     self._pose_list = '\n'.join([f'{key}: {value}' for key, value in self.arm_positions.items()])
 
+    if self.classifier_mode != 'llm':
+      self._training = True
+      self._train_classifier()
+
+  @threaded
+  def _train_classifier(self) -> None:
+    """
+    Trains the local classifier from the decision log. In the hybrid mode, its agreement with the LLM is measured
+    first on held-out decisions, like `benchmarks.mood_classifier_eval` does.
+    """
+    try:
+      texts, poses = load_decisions(self._decision_log_file)
+
+      if self.classifier_mode == 'hybrid':
+        agreement = held_out_agreement(texts, poses, self.confidence_threshold)
+        self._is_trusted = agreement is not None and agreement >= self.min_agreement
+
+        if agreement is not None:
+          self._logger.agent_info(f'The local mood classifier agrees with the LLM on {agreement:.1%} of the held-out '
+                                  f'decisions, {"using" if self._is_trusted else "not using"} it')
+
+      self._classifier.fit(texts, poses)
+      self._logger.agent_info(f'Trained the local mood classifier with {len(texts)} decisions' if self._classifier.is_trained
+                              else f'Not enough logged decisions to train the local mood classifier ({len(texts)})')
+    finally:
+      self._training = False
+
+  @threaded
+  def _log_decisions(self, decisions: list[tuple[str, str]]) -> None:
+    """
+    Appends (sentence, pose) decisions of the LLM to the decision log in the background, off the event loop, retraining
+    the local classifier every so often.
+    """
+    if not decisions:
+      return
+
+    with self._decision_log_lock:
+      with open(self._decision_log_file, 'a', encoding='utf-8') as file:
+        file.writelines([json.dumps({'text': text, 'pose': pose}) + '\n' for text, pose in decisions])
+
+      self._new_decisions += len(decisions)
+      should_train = self.classifier_mode != 'llm' and not self._training and self._new_decisions >= self._retrain_interval
+
+      if should_train:
+        self._new_decisions = 0
+        self._training = True
+
+    if should_train:
+      self._train_classifier()
+
+  def _classify_locally(self, chunks: list[str]) -> list[str | None]:
+    """ Poses of the local classifier, None where the LLM has to decide. """
+    if self.classifier_mode == 'hybrid' and not self._is_trusted:
+      return [None for _ in chunks]
+
+    if self.classifier_mode == 'llm' or not self._classifier.is_trained:
+      return [DEFAULT_POSE if self.classifier_mode == 'local' else None for _ in chunks]
+
+    predictions = self._classifier.predict(chunks)
+
+    if self.classifier_mode == 'local':
+      return [pose for pose, _ in predictions]
+
+    return [pose if confidence >= self.confidence_threshold else None for pose, confidence in predictions]
+
   def determine_pose(self, message: str) -> str:
+    """ Synchronous version of `adetermine_pose`. """
+    return run_sync(self.adetermine_pose(message))
+
+  async def adetermine_pose(self, message: str) -> str:
+    """
+    Determines the pose of the character based on the given message, with the local classifier or the LLM
+    depending on the classifier mode.
+
+    Parameters
+    ----------
+    message : str
+        The message based on which the pose is to be determined.
+
+    Returns
+    -------
+    str
+        The determined pose of the character.
+    """
+    return (await self.adetermine_poses([message]))[0]
+
+  async def _allm_determine_pose(self, message: str) -> str:
     """
-    Determines the pose of the character based on the given message.
+    Determines the pose of the character based on the given message, asking the LLM.
 
     Parameters
     ----------
@@ -72,41 +206,136 @@ class MoodAnalyzer:
     """
     self._logger.agent_info('Determining pose...')
 
-    prompt = textwrap.dedent("""
-    My message:
-    {}
+    prompt = prompts.POSE.format(moods=self._mood_list, poses=self._pose_list, message=message)
 
-    Given the message above, what is the correct mood? Use the following list to choose:
+    response, _ = await achat_completion(prompt, cache_if=lambda response: self._parse_pose(response) is not None)
+    pose = self._parse_pose(response)
 
-    List of moods:
-    {}
+    if pose is None:
+      self._logger.agent_warning(f'Could not parse the pose in {response!r}, using {DEFAULT_POSE}')
+      return DEFAULT_POSE
 
-    Given the message above, what is the correct pose? Use the following list to choose:
+    self._log_decisions([(message, pose)])
 
-    List of poses:
-    {}
-    
-    Example:
-    neut: neutral # use neut as value, do the same for the rest of the values 
+    self._logger.agent_info(f'Determined pose: {pose}')
 
-    Format:
+    return pose
 
-    FullState: <MOOD> /*/ <POSE>
-    """).format(
-      message,
-      self._mood_list,
-      self._pose_list
-    )
+  def determine_poses(self, chunks: list[str]) -> list[str]:
+    """ Synchronous version of `adetermine_poses`. """
+    return run_sync(self.adetermine_poses(chunks))
 
-    response, _ = chat_completion(prompt)
-    chosen_state = response.split(":")[1].strip()
+  def _parse_pose(self, response: str) -> str | None:
+    """ Parses the state of a single pose request, None if it does not name a known mood and pose. """
+    state = response.split(':', 1)[-1].split('/*/')
 
-    chosen_mood = chosen_state.split("/*/")[0].strip()
-    chosen_pose = chosen_state.split("/*/")[1].strip()
+    if len(state) != 2:
+      return None
 
-    chosen_mood = chosen_mood if self.available_moods.get(chosen_mood) else 'neut'
-    chosen_pose = chosen_pose if self.arm_positions.get(chosen_pose) else 'ldown'
+    chosen_mood, chosen_pose = state[0].strip('[]<> \n'), state[1].strip('[]<> \n')
 
-    self._logger.agent_info(f'Determined pose: {chosen_pose}')
+    if chosen_mood not in self.available_moods or chosen_pose not in self.arm_positions:
+      return None
 
     return f'{chosen_mood} {chosen_pose}'
+
+  def _parse_poses(self, response: str, count: int) -> list[str | None]:
+    """
+    Parses the numbered states of a batched pose request.
+
+    Parameters
+    ----------
+    response : str
+        The response of the model, with one '<NUMBER>: <MOOD> /*/ <POSE>' line per sentence.
+
+    count : int
+        The number of sentences in the request.
+
+    Returns
+    -------
+    list[str or None]
+        The pose of every sentence, None where the line is missing or names an unknown mood or pose.
+    """
+    poses = [None] * count
+
+    for line in response.strip().split('\n'):
+      match = re.match(r'^\s*(\d+)\s*[:.)-]\s*(.+?)\s*/\*/\s*(.+?)\s*$', line)
+
+      if match is None:
+        continue
+
+      index = int(match.group(1)) - 1
+      chosen_mood, chosen_pose = match.group(2).strip('[]<> '), match.group(3).strip('[]<> ')
+
+      if 0 <= index < count and chosen_mood in self.available_moods and chosen_pose in self.arm_positions:
+        poses[index] = f'{chosen_mood} {chosen_pose}'
+
+    return poses
+
+  async def adetermine_poses(self, chunks: list[str]) -> list[str]:
+    """
+    Determines the pose of every chunk of a message. Depending on the classifier mode, the chunks are classified
+    locally, with a single LLM request, or locally with the uncertain chunks escalated to a single LLM request.
+
+    Parameters
+    ----------
+    chunks : list[str]
+        The chunks of the message, usually its sentences.
+
+    Returns
+    -------
+    list[str]
+        The determined pose of every chunk, in the same order as the chunks.
+    """
+    poses = self._classify_locally(chunks)
+    escalated = [i for i, pose in enumerate(poses) if pose is None]
+
+    if len(escalated) < len(chunks):
+      self._logger.agent_info(f'Determined {len(chunks) - len(escalated)} of {len(chunks)} poses locally')
+
+    if escalated:
+      for i, pose in zip(escalated, await self._allm_determine_poses([chunks[i] for i in escalated])):
+        poses[i] = pose
+
+    return poses
+
+  async def _allm_determine_poses(self, chunks: list[str]) -> list[str]:
+    """
+    Determines the pose of every chunk of a message with a single LLM request. The chunks whose pose
+    cannot be parsed from the response are determined one by one with `_allm_determine_pose`.
+
+    Parameters
+    ----------
+    chunks : list[str]
+        The chunks of the message, usually its sentences.
+
+    Returns
+    -------
+    list[str]
+        The determined pose of every chunk, in the same order as the chunks.
+    """
+    if len(chunks) <= 1:
+      return [await self._allm_determine_pose(chunk) for chunk in chunks]
+
+    self._logger.agent_info(f'Determining poses of {len(chunks)} sentences...')
+
+    prompt = prompts.POSES.format(
+      moods=self._mood_list,
+      poses=self._pose_list,
+      sentences='\n'.join([f'{i + 1}. {chunk}' for i, chunk in enumerate(chunks)])
+    )
+
+    response, _ = await achat_completion(prompt)
+    poses = self._parse_poses(response, len(chunks))
+    self._log_decisions([(chunk, pose) for chunk, pose in zip(chunks, poses) if pose is not None])
+
+    missing = [i for i, pose in enumerate(poses) if pose is None]
+    if missing:
+      self._logger.agent_info(f'Could not parse the poses of {len(missing)} sentences, determining them one by one')
+
+      for i, pose in zip(missing, await asyncio.gather(*[self._allm_determine_pose(chunks[i]) for i in missing])):
+        poses[i] = pose
+
+    self._logger.agent_info(f'Determined poses: {", ".join(poses)}')
+
+    return poses
@@ -1,12 +1,74 @@
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import wraps
+from typing import Any, Callable, Iterable
+
+import os
+import contextvars
+
+MAX_WORKERS = int(os.getenv('AGENT_MAX_WORKERS', 16))
+
+
+class ContextExecutor(ThreadPoolExecutor):
+  """
+  A ThreadPoolExecutor that runs every call in a copy of the context of the caller, like asyncio does with its tasks,
+  so the context variables of the caller, like the retry budget of a chat turn, apply to the calls.
+  """
+
+  def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+    return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+_executor = ContextExecutor(max_workers=MAX_WORKERS, thread_name_prefix='agent-worker')
+
+
+def get_executor() -> ContextExecutor:
+  """ Returns the shared, bounded executor used by every threaded call. """
+  return _executor
 
 
 def threaded(f):
-  """ Creates a thread for the given function. """
+  """ Runs the given function in the shared executor and returns a future with its result. """
   @wraps(f)
-  def wrapped(*args, **kwargs):
-    with ThreadPoolExecutor(max_workers=1) as executor:
-      future = executor.submit(f, *args, **kwargs)
-      return future.result()
+  def wrapped(*args, **kwargs) -> Future:
+    return _executor.submit(f, *args, **kwargs)
   return wrapped
+
+
+def fan_out(f: Callable, arguments: Iterable[Any]) -> list[Future]:
+  """
+  Submits one call of the given function per argument to the shared executor.
+
+  Parameters
+  ----------
+  f : Callable
+      The function to run, it receives a single argument.
+
+  arguments : Iterable[Any]
+      The arguments to run the function with.
+
+  Returns
+  -------
+  list[Future]
+      The futures of every call, in the same order as the arguments.
+  """
+  return [_executor.submit(f, argument) for argument in arguments]
+
+
+def gather(futures: Iterable[Future], timeout: float | None = None) -> list[Any]:
+  """
+  Waits for the given futures and returns their results.
+
+  Parameters
+  ----------
+  futures : Iterable[Future]
+      The futures to wait for.
+
+  timeout : float or None, optional
+      The maximum number of seconds to wait for each future, by default None.
+
+  Returns
+  -------
+  list[Any]
+      The results of the futures, in the same order as the futures.
+  """
+  return [future.result(timeout) for future in futures]
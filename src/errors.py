@@ -2,3 +2,50 @@ class InvalidVersion(Exception):
   def __init__(self, version) -> None:
     self.message = f"{version} is not a valid version. Valid versions are: ['4k', '16k']"
     super().__init__(self.message)
+
+
+class InvalidIndexMode(Exception):
+  def __init__(self, index_mode) -> None:
+    self.message = f"{index_mode} is not a valid index mode. Valid index modes are: ['exact', 'ivf']"
+    super().__init__(self.message)
+
+
+class OpenAIRequestError(Exception):
+  def __init__(self, status: int, body: str, retry_after: str | None = None) -> None:
+    self.status = status
+    self.body = body
+    self.retry_after = retry_after
+    self.message = f"OpenAI request failed with status {status}: {body}"
+    super().__init__(self.message)
+
+
+class CircuitOpenError(Exception):
+  def __init__(self, retry_in: float) -> None:
+    self.retry_in = retry_in
+    self.message = f"The OpenAI circuit breaker is open, requests are rejected for the next {retry_in:.1f} seconds"
+    super().__init__(self.message)
+
+
+class RetryBudgetExceeded(Exception):
+  def __init__(self, reason: str) -> None:
+    self.reason = reason
+    self.message = f"The retry budget of the chat turn was exceeded ({reason})"
+    super().__init__(self.message)
+
+
+class InvalidClassifierMode(Exception):
+  def __init__(self, classifier_mode) -> None:
+    self.message = f"{classifier_mode} is not a valid classifier mode. Valid classifier modes are: ['llm', 'local', 'hybrid']"
+    super().__init__(self.message)
+
+
+class InvalidPipelineMode(Exception):
+  def __init__(self, pipeline_mode) -> None:
+    self.message = f"{pipeline_mode} is not a valid pipeline mode. Valid pipeline modes are: ['multi-call', 'turn-analysis']"
+    super().__init__(self.message)
+
+
+class UnknownCharacter(Exception):
+  def __init__(self, name, names) -> None:
+    self.message = f"{name} is not a known character. Known characters are: {names}"
+    super().__init__(self.message)
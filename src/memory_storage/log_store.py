@@ -0,0 +1,383 @@
+import os
+import json
+import datetime
+import threading
+import numpy as np
+
+DATETIME_KEYS = ('created_at', 'accessed_at')
+
+
+class MemoryLogStore:
+  """
+  Append-only memory store. Records are appended to a log of JSON lines, embeddings to a binary sidecar of float32
+  rows that is memory-mapped for reading, and a hash index of ids and descriptions is kept in memory.
+  """
+
+  def __init__(self, directory: str, compaction_ratio: float = 1.) -> None:
+    """
+    Initializes the MemoryLogStore, replaying the log of the current generation.
+
+    Parameters
+    ----------
+    directory : str
+        The directory holding the store files.
+
+    compaction_ratio : float, optional
+        The store is compacted when the superseded records exceed this ratio of live records, by default 1.
+    """
+    self._directory = directory
+    self._compaction_ratio = compaction_ratio
+    self._lock = threading.RLock()
+
+    self._memories: dict[str, dict] = {}
+    self._by_description: dict[str, str] = {}
+    self._values: dict[str, object] = {}
+    self._superseded = 0
+
+    self._dimensions: int | None = None
+    self._embedding_rows = 0
+    self._embeddings: np.memmap | None = None
+
+    os.makedirs(directory, exist_ok=True)
+
+    self._generation = self._read_generation()
+    self._remove_stale_generations()
+    self._load()
+
+  @property
+  def is_empty(self) -> bool:
+    return not self._memories and not self._values
+
+  def _path(self, name: str, generation: int | None = None) -> str:
+    generation = self._generation if generation is None else generation
+    return os.path.join(self._directory, f'{name}.{generation}')
+
+  def _read_generation(self) -> int:
+    """ Reads the generation of the files in use, the generation changes on every compaction. """
+    current_path = os.path.join(self._directory, 'CURRENT')
+
+    if not os.path.exists(current_path):
+      return 0
+
+    with open(current_path, 'r') as file:
+      return int(file.read().strip() or 0)
+
+  def _write_generation(self, generation: int) -> None:
+    """ Atomically points the store to the files of the given generation. """
+    current_path = os.path.join(self._directory, 'CURRENT')
+    temporary_path = f'{current_path}.tmp'
+
+    with open(temporary_path, 'w') as file:
+      file.write(str(generation))
+      file.flush()
+      os.fsync(file.fileno())
+
+    os.replace(temporary_path, current_path)
+
+  def _remove_stale_generations(self) -> None:
+    """ Removes the files left behind by finished or interrupted compactions. """
+    current = {f'records.{self._generation}', f'embeddings.{self._generation}', f'meta.{self._generation}', 'CURRENT'}
+
+    for name in os.listdir(self._directory):
+      if name not in current:
+        os.remove(os.path.join(self._directory, name))
+
+  def _serialize(self, record: dict) -> str:
+    return json.dumps(record, default=lambda value: value.isoformat() if isinstance(value, datetime.datetime) else str(value))
+
+  def _deserialize(self, line: str) -> dict:
+    record = json.loads(line)
+    memory = record.get('memory')
+
+    if memory:
+      for key in DATETIME_KEYS:
+        if isinstance(memory.get(key), str):
+          memory[key] = datetime.datetime.fromisoformat(memory[key])
+
+    return record
+
+  def _load(self) -> None:
+    """ Replays the log, a trailing partial record left by a crash is discarded. """
+    meta_path = self._path('meta')
+
+    if os.path.exists(meta_path):
+      with open(meta_path, 'r') as file:
+        self._dimensions = json.load(file)['dimensions']
+
+    embeddings_path = self._path('embeddings')
+
+    if self._dimensions is not None and os.path.exists(embeddings_path):
+      row_size = self._dimensions * 4
+      size = os.path.getsize(embeddings_path)
+
+      if size % row_size:
+        with open(embeddings_path, 'r+b') as file:
+          file.truncate(size - size % row_size)
+
+      self._embedding_rows = size // row_size
+
+    records_path = self._path('records')
+
+    if not os.path.exists(records_path):
+      open(records_path, 'a').close()
+
+    valid_size = 0
+
+    with open(records_path, 'rb') as file:
+      for raw_line in file:
+        if not raw_line.endswith(b'\n'):
+          break
+
+        try:
+          record = self._deserialize(raw_line.decode('utf-8'))
+        except ValueError:
+          break
+
+        self._apply(record)
+        valid_size += len(raw_line)
+
+    if valid_size != os.path.getsize(records_path):
+      with open(records_path, 'r+b') as file:
+        file.truncate(valid_size)
+
+  def _apply(self, record: dict) -> None:
+    """ Applies a log record to the in-memory state. """
+    operation = record['op']
+
+    if operation == 'memory':
+      memory = record['memory']
+
+      if memory.get('embedding_row') is not None and memory['embedding_row'] >= self._embedding_rows:
+        memory['embedding_row'] = None
+
+      if memory['_id'] in self._memories:
+        self._superseded += 1
+
+      self._memories[memory['_id']] = memory
+      self._by_description.setdefault(memory['description'], memory['_id'])
+
+    elif operation == 'embedding':
+      memory = self._memories.get(record['_id'])
+
+      if memory is not None and record['embedding_row'] < self._embedding_rows:
+        memory['embedding_row'] = record['embedding_row']
+        self._superseded += 1
+
+    elif operation == 'value':
+      if record['key'] in self._values:
+        self._superseded += 1
+
+      self._values[record['key']] = record['value']
+
+  def _embedding_map(self) -> np.memmap | None:
+    """ Returns the memory-mapped embeddings, mapping the sidecar again when it has grown. """
+    if self._embedding_rows == 0:
+      return None
+
+    if self._embeddings is None or len(self._embeddings) != self._embedding_rows:
+      self._embeddings = np.memmap(self._path('embeddings'), dtype=np.float32, mode='r',
+                                   shape=(self._embedding_rows, self._dimensions))
+
+    return self._embeddings
+
+  def _append_embeddings(self, embeddings: list) -> list[int]:
+    """
+    Appends embeddings to the sidecar file.
+
+    Parameters
+    ----------
+    embeddings : list
+        The embeddings to append.
+
+    Returns
+    -------
+    list[int]
+        The rows of the appended embeddings.
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+
+    if self._dimensions is None:
+      self._dimensions = vectors.shape[1]
+
+      with open(self._path('meta'), 'w') as file:
+        json.dump({'dimensions': self._dimensions}, file)
+
+    with open(self._path('embeddings'), 'ab') as file:
+      file.write(vectors.tobytes())
+      file.flush()
+      os.fsync(file.fileno())
+
+    start = self._embedding_rows
+    self._embedding_rows += len(vectors)
+
+    return list(range(start, self._embedding_rows))
+
+  def _append_records(self, records: list[dict]) -> None:
+    """ Appends records to the log and applies them. """
+    with open(self._path('records'), 'a', encoding='utf-8') as file:
+      file.write(''.join(f'{self._serialize(record)}\n' for record in records))
+      file.flush()
+      os.fsync(file.fileno())
+
+    for record in records:
+      self._apply(record)
+
+    if self._superseded > max(len(self._memories) + len(self._values), 64) * self._compaction_ratio:
+      self.compact()
+
+  def _to_dict(self, memory: dict) -> dict:
+    """ Returns the memory as stored by the other storage modes, with its embedding. """
+    memory = dict(memory)
+    row = memory.pop('embedding_row', None)
+    embeddings = self._embedding_map()
+
+    memory['embedding'] = np.array(embeddings[row]) if row is not None and embeddings is not None else None
+
+    return memory
+
+  def store_memories(self, memories: list[dict]) -> None:
+    """
+    Appends memories to the store.
+
+    Parameters
+    ----------
+    memories : list of dict
+        The memories to store.
+    """
+    if not memories:
+      return
+
+    with self._lock:
+      with_embedding = [memory for memory in memories if memory.get('embedding') is not None]
+      rows = dict(zip([memory['_id'] for memory in with_embedding],
+                      self._append_embeddings([memory['embedding'] for memory in with_embedding]) if with_embedding else []))
+
+      records = []
+      for memory in memories:
+        memory = {key: value for key, value in memory.items() if key != 'embedding'}
+        memory['embedding_row'] = rows.get(memory['_id'])
+        records.append({'op': 'memory', 'memory': memory})
+
+      self._append_records(records)
+
+  def update_embeddings(self, embeddings: dict[str, list[float]]) -> None:
+    """
+    Stores the embeddings of already stored memories.
+
+    Parameters
+    ----------
+    embeddings : dict[str, list[float]]
+      The embeddings to store, keyed by memory id.
+    """
+    with self._lock:
+      embeddings = {memory_id: embedding for memory_id, embedding in embeddings.items() if memory_id in self._memories}
+
+      if not embeddings:
+        return
+
+      rows = self._append_embeddings(list(embeddings.values()))
+      self._append_records([{'op': 'embedding', '_id': memory_id, 'embedding_row': row} for memory_id, row in zip(embeddings, rows)])
+
+  def retrieve_memory(self, description: str) -> dict | None:
+    """ Retrieves a memory by description with a hash lookup. """
+    with self._lock:
+      memory_id = self._by_description.get(description)
+      return self._to_dict(self._memories[memory_id]) if memory_id is not None else None
+
+  def retrieve_all_memories(self) -> list[dict]:
+    """ Retrieves every stored memory, in insertion order. """
+    with self._lock:
+      return [self._to_dict(memory) for memory in self._memories.values()]
+
+  def get_value(self, key: str) -> object | None:
+    """ Retrieves a stored value, like the status of the agent. """
+    with self._lock:
+      return self._values.get(key)
+
+  def set_value(self, key: str, value: object) -> None:
+    """ Appends a new value for the given key. """
+    with self._lock:
+      self._append_records([{'op': 'value', 'key': key, 'value': value}])
+
+  def compact(self) -> None:
+    """
+    Rewrites the live records and embeddings into a new generation of files and switches to it.
+    The switch is a single atomic rename, a crash at any point leaves either the old or the new generation in use.
+    """
+    with self._lock:
+      generation = self._generation + 1
+      embeddings = self._embedding_map()
+
+      memories = []
+      vectors = []
+
+      for memory in self._memories.values():
+        memory = dict(memory)
+        row = memory.get('embedding_row')
+
+        if row is not None and embeddings is not None:
+          memory['embedding_row'] = len(vectors)
+          vectors.append(embeddings[row])
+
+        memories.append(memory)
+
+      if self._dimensions is not None:
+        with open(self._path('meta', generation), 'w') as file:
+          json.dump({'dimensions': self._dimensions}, file)
+          file.flush()
+          os.fsync(file.fileno())
+
+      with open(self._path('embeddings', generation), 'wb') as file:
+        if vectors:
+          file.write(np.asarray(vectors, dtype=np.float32).tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+
+      records = [{'op': 'memory', 'memory': memory} for memory in memories]
+      records += [{'op': 'value', 'key': key, 'value': value} for key, value in self._values.items()]
+
+      with open(self._path('records', generation), 'w', encoding='utf-8') as file:
+        file.write(''.join(f'{self._serialize(record)}\n' for record in records))
+        file.flush()
+        os.fsync(file.fileno())
+
+      self._write_generation(generation)
+
+      self._generation = generation
+      self._embeddings = None
+      self._memories = {memory['_id']: memory for memory in memories}
+      self._embedding_rows = len(vectors)
+      self._superseded = 0
+
+      self._remove_stale_generations()
+
+  def migrate_from_json(self, data_file: str, datetime_parser) -> bool:
+    """
+    Imports the memories and status of a JSON data file, only when the store is empty.
+
+    Parameters
+    ----------
+    data_file : str
+        The path of the JSON data file.
+
+    datetime_parser : Callable
+        The object hook used to parse the dates of the JSON data file.
+
+    Returns
+    -------
+    bool
+        True if the data file was imported.
+    """
+    with self._lock:
+      if not self.is_empty or not os.path.exists(data_file):
+        return False
+
+      with open(data_file, 'r') as file:
+        data = json.load(file, object_hook=datetime_parser)
+
+      self.store_memories(data.get('memories', []))
+
+      if data.get('status'):
+        self.set_value('status', data['status'])
+
+      return True
@@ -0,0 +1,200 @@
+from ..custom_logger import CustomLogger
+from pymongo import MongoClient, UpdateOne, ASCENDING
+from pymongo.errors import BulkWriteError
+from typing import Iterator
+
+import atexit
+import threading
+
+DUPLICATE_KEY_ERROR = 11000
+
+DEFAULT_CLIENT_OPTIONS = {
+  'maxPoolSize': 20,
+  'minPoolSize': 0,
+  'maxIdleTimeMS': 60000,
+  'connectTimeoutMS': 5000,
+  'serverSelectionTimeoutMS': 10000
+}
+
+
+class MemoryMongoStore:
+  """ Memory store backed by MongoDB, with indexed lookups and buffered bulk inserts. """
+
+  def __init__(self, agent_name: str, uri: str | None, flush_interval: float = 1., max_batch_size: int = 100,
+               client: MongoClient | None = None, logger: CustomLogger | None = None, **client_options) -> None:
+    """
+    Initializes the MemoryMongoStore, creating the indexes if needed.
+
+    Parameters
+    ----------
+    agent_name : str
+        The name of the agent, used to name the database and collections.
+
+    uri : str or None
+        The MongoDB connection URI.
+
+    flush_interval : float, optional
+        The maximum number of seconds a memory waits in the insert buffer, by default 1.
+
+    max_batch_size : int, optional
+        The insert buffer is flushed as soon as it holds this many memories, by default 100.
+
+    client : MongoClient or None, optional
+        An existing client to use instead of creating one, by default None.
+
+    logger : CustomLogger or None, optional
+        The logger of the failed periodic flushes, by default None (not logged).
+
+    **client_options:
+        Connection-pool settings passed to MongoClient, like 'maxPoolSize' or 'maxIdleTimeMS'.
+    """
+    self._client = client if client is not None else MongoClient(uri, **{**DEFAULT_CLIENT_OPTIONS, **client_options})
+    self._database = self._client[agent_name]
+    self._memory_col = self._database[f'{agent_name}_memories']
+    self._config_col = self._database[f'{agent_name}_config']
+    self._agent_name = agent_name
+    self._logger = logger
+
+    self._memory_col.create_index([('description', ASCENDING)])
+    self._memory_col.create_index([('created_at', ASCENDING)])
+
+    self._max_batch_size = max_batch_size
+    self._buffer: list[dict] = []
+    self._buffer_lock = threading.Lock()
+    self._flush_lock = threading.Lock()
+
+    self._stop_flushing = threading.Event()
+    self._flush_thread = threading.Thread(target=self._flush_periodically, args=(flush_interval,), daemon=True,
+                                          name=f'{agent_name} Mongo Flush Thread')
+    self._flush_thread.start()
+
+    atexit.register(self.close)
+
+  def _flush_periodically(self, flush_interval: float) -> None:
+    """ Flushes the insert buffer every flush interval until the store is closed. """
+    while not self._stop_flushing.wait(flush_interval):
+      try:
+        self.flush()
+      except Exception as error:
+        if self._logger is not None:
+          self._logger.memory_error(f'Flush of the buffered memories failed, retrying in {flush_interval:g} s: {error!r}')
+
+  def flush(self) -> None:
+    """
+    Inserts the buffered memories with a single insert_many. The memories that could not be inserted go back to the
+    buffer for the next flush, except the ones already stored.
+    """
+    with self._flush_lock:
+      with self._buffer_lock:
+        batch, self._buffer = self._buffer, []
+
+      if not batch:
+        return
+
+      try:
+        self._memory_col.insert_many(batch, ordered=False)
+      except BulkWriteError as error:
+        failed = {
+          write_error['index'] for write_error in error.details.get('writeErrors', [])
+          if write_error.get('code') != DUPLICATE_KEY_ERROR
+        }
+        self._restore([memory for index, memory in enumerate(batch) if index in failed])
+
+        if failed or error.details.get('writeConcernErrors'):
+          raise
+      except Exception:
+        self._restore(batch)
+        raise
+
+  def _restore(self, memories: list[dict]) -> None:
+    """ Puts memories whose insert failed back at the front of the buffer. """
+    with self._buffer_lock:
+      self._buffer[:0] = memories
+
+  def close(self) -> None:
+    """ Stops the periodic flush and inserts the buffered memories. """
+    self._stop_flushing.set()
+    self.flush()
+
+  def _to_document(self, memory: dict) -> dict:
+    """ Returns a copy of the memory that BSON can encode, the embedding as a list of floats. """
+    memory = dict(memory)
+
+    if memory.get('embedding') is not None:
+      memory['embedding'] = [float(value) for value in memory['embedding']]
+
+    return memory
+
+  def store_memories(self, memories: list[dict], buffered: bool = True) -> None:
+    """
+    Stores memories, buffered until the next flush or written right away.
+
+    Parameters
+    ----------
+    memories : list of dict
+        The memories to store.
+
+    buffered : bool, optional
+        Whether to add the memories to the insert buffer, by default True.
+    """
+    memories = [self._to_document(memory) for memory in memories]
+
+    if not buffered:
+      self.flush()
+      self._memory_col.insert_many(memories, ordered=False)
+      return
+
+    with self._buffer_lock:
+      self._buffer.extend(memories)
+      is_full = len(self._buffer) >= self._max_batch_size
+
+    if is_full:
+      self.flush()
+
+  def update_embeddings(self, embeddings: dict[str, list[float]]) -> None:
+    """ Stores the embeddings of already stored memories with a single bulk_write. """
+    self.flush()
+    self._memory_col.bulk_write([
+      UpdateOne({'_id': memory_id}, {'$set': {'embedding': [float(value) for value in embedding]}})
+      for memory_id, embedding in embeddings.items()
+    ], ordered=False)
+
+  def retrieve_memory(self, description: str) -> dict | None:
+    """ Retrieves a memory by description, looking at the insert buffer first. """
+    with self._buffer_lock:
+      for memory in self._buffer:
+        if memory['description'] == description:
+          return memory
+
+    return self._memory_col.find_one({'description': description})
+
+  def retrieve_all_memories(self, include_embeddings: bool = True) -> list[dict]:
+    """ Retrieves every stored memory, oldest first, optionally without the embeddings. """
+    self.flush()
+    projection = None if include_embeddings else {'embedding': 0}
+    return list(self._memory_col.find({}, projection).sort('created_at', ASCENDING))
+
+  def iter_embeddings(self, batch_size: int = 1000) -> Iterator[list[tuple[str, list[float]]]]:
+    """ Streams the stored embeddings in batches of (id, embedding) pairs with a projected cursor. """
+    self.flush()
+    cursor = self._memory_col.find({'embedding': {'$ne': None}}, {'embedding': 1}).batch_size(batch_size)
+
+    batch = []
+    for document in cursor:
+      batch.append((document['_id'], document['embedding']))
+
+      if len(batch) >= batch_size:
+        yield batch
+        batch = []
+
+    if batch:
+      yield batch
+
+  def get_value(self, key: str) -> object | None:
+    """ Retrieves a value stored in the agent configuration, like the status of the agent. """
+    agent_data = self._config_col.find_one({'agent_name': self._agent_name}, {key: 1})
+    return agent_data.get(key) if agent_data else None
+
+  def set_value(self, key: str, value: object) -> None:
+    """ Stores a value in the agent configuration. """
+    self._config_col.update_one({'agent_name': self._agent_name}, {'$set': {key: value}}, upsert=True)
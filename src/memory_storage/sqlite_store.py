@@ -0,0 +1,144 @@
+import json
+import sqlite3
+import datetime
+import threading
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS memories (
+  id TEXT PRIMARY KEY,
+  kind TEXT NOT NULL,
+  description TEXT NOT NULL,
+  importance REAL NOT NULL,
+  retrieval_value REAL NOT NULL DEFAULT 0,
+  associated_memories TEXT NOT NULL DEFAULT '[]',
+  created_at TEXT NOT NULL,
+  accessed_at TEXT NOT NULL,
+  embedding BLOB
+);
+CREATE INDEX IF NOT EXISTS memories_description ON memories (description);
+CREATE INDEX IF NOT EXISTS memories_kind ON memories (kind);
+CREATE INDEX IF NOT EXISTS memories_created_at ON memories (created_at);
+CREATE TABLE IF NOT EXISTS agent_values (
+  key TEXT PRIMARY KEY,
+  value TEXT NOT NULL
+);
+"""
+
+COLUMNS = 'id, kind, description, importance, retrieval_value, associated_memories, created_at, accessed_at, embedding'
+
+
+class MemorySQLiteStore:
+  """ Memory store backed by a SQLite database in WAL mode, with one connection per thread. """
+
+  def __init__(self, database_file: str) -> None:
+    """
+    Initializes the MemorySQLiteStore, creating the tables and indexes if needed.
+
+    Parameters
+    ----------
+    database_file : str
+        The path of the SQLite database.
+    """
+    self._database_file = database_file
+    self._local = threading.local()
+    self._write_lock = threading.Lock()
+
+    connection = self._connection()
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(SCHEMA)
+
+  def _connection(self) -> sqlite3.Connection:
+    """ Returns the connection of the current thread, readers never block each other in WAL mode. """
+    connection = getattr(self._local, 'connection', None)
+
+    if connection is None:
+      connection = sqlite3.connect(self._database_file, timeout=30)
+      connection.execute('PRAGMA synchronous=NORMAL')
+      self._local.connection = connection
+
+    return connection
+
+  def _to_row(self, memory: dict) -> tuple:
+    embedding = memory.get('embedding')
+
+    return (
+      memory['_id'],
+      memory['kind'],
+      memory['description'],
+      memory['importance'],
+      memory.get('retrieval_value', 0),
+      json.dumps(memory.get('associated_memories', [])),
+      memory['created_at'].isoformat(),
+      memory['accessed_at'].isoformat(),
+      np.asarray(embedding, dtype=np.float32).tobytes() if embedding is not None else None
+    )
+
+  def _to_dict(self, row: tuple) -> dict:
+    return {
+      '_id': row[0],
+      'kind': row[1],
+      'description': row[2],
+      'importance': row[3],
+      'retrieval_value': row[4],
+      'associated_memories': json.loads(row[5]),
+      'created_at': datetime.datetime.fromisoformat(row[6]),
+      'accessed_at': datetime.datetime.fromisoformat(row[7]),
+      'embedding': np.frombuffer(row[8], dtype=np.float32) if row[8] is not None else None
+    }
+
+  def store_memories(self, memories: list[dict]) -> None:
+    """
+    Stores memories in a single transaction.
+
+    Parameters
+    ----------
+    memories : list of dict
+        The memories to store.
+    """
+    if not memories:
+      return
+
+    connection = self._connection()
+
+    with self._write_lock, connection:
+      connection.executemany(f'INSERT OR REPLACE INTO memories ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             [self._to_row(memory) for memory in memories])
+
+  def update_embeddings(self, embeddings: dict[str, list[float]]) -> None:
+    """
+    Stores the embeddings of already stored memories in a single transaction.
+
+    Parameters
+    ----------
+    embeddings : dict[str, list[float]]
+      The embeddings to store, keyed by memory id.
+    """
+    connection = self._connection()
+
+    with self._write_lock, connection:
+      connection.executemany('UPDATE memories SET embedding = ? WHERE id = ?', [
+        (np.asarray(embedding, dtype=np.float32).tobytes(), memory_id) for memory_id, embedding in embeddings.items()
+      ])
+
+  def retrieve_memory(self, description: str) -> dict | None:
+    """ Retrieves a memory by description with an indexed lookup. """
+    row = self._connection().execute(f'SELECT {COLUMNS} FROM memories WHERE description = ? LIMIT 1', (description,)).fetchone()
+    return self._to_dict(row) if row is not None else None
+
+  def retrieve_all_memories(self) -> list[dict]:
+    """ Retrieves every stored memory, oldest first. """
+    rows = self._connection().execute(f'SELECT {COLUMNS} FROM memories ORDER BY created_at').fetchall()
+    return [self._to_dict(row) for row in rows]
+
+  def get_value(self, key: str) -> object | None:
+    """ Retrieves a stored value, like the status of the agent. """
+    row = self._connection().execute('SELECT value FROM agent_values WHERE key = ?', (key,)).fetchone()
+    return json.loads(row[0]) if row is not None else None
+
+  def set_value(self, key: str, value: object) -> None:
+    """ Stores a value for the given key. """
+    connection = self._connection()
+
+    with self._write_lock, connection:
+      connection.execute('INSERT OR REPLACE INTO agent_values (key, value) VALUES (?, ?)', (key, json.dumps(value)))
@@ -0,0 +1,512 @@
+from ..errors import OpenAIRequestError, RetryBudgetExceeded
+from .retry import RetryPolicy, CircuitBreaker, RetryStats, current_budget
+from .rate_limiter import RateLimiter, estimate_tokens
+from typing import Any, AsyncIterator, Callable, Coroutine, Literal as literal
+
+import os
+import json
+import math
+import atexit
+import asyncio
+import threading
+import aiohttp
+
+DEFAULT_BASE_URL = 'https://api.openai.com/v1'
+
+
+class AsyncOpenAIClient:
+  """
+  Asyncio client for the OpenAI API. Every request runs on a dedicated event loop thread that owns one pooled HTTP
+  session, so the client can be awaited from any event loop and used synchronously through `run`.
+  """
+
+  def __init__(self, api_key: str | None = None, base_url: str | None = None, timeout: float = 60.,
+               max_concurrency: int = 16, max_connections: int = 32, retry_policy: RetryPolicy | None = None,
+               circuit_breaker: CircuitBreaker | None = None, stats: RetryStats | None = None,
+               rate_limiter: RateLimiter | None = None) -> None:
+    """
+    Initializes the AsyncOpenAIClient and starts its event loop thread.
+
+    Parameters
+    ----------
+    api_key : str or None, optional
+        The API key, by default the OPENAI_API_KEY environment variable.
+
+    base_url : str or None, optional
+        The base URL of an OpenAI-compatible API, by default the OPENAI_API_BASE environment variable or the OpenAI API.
+
+    timeout : float, optional
+        The default number of seconds a request may take, by default 60.
+
+    max_concurrency : int, optional
+        The maximum number of requests in flight, by default 16.
+
+    max_connections : int, optional
+        The maximum number of pooled connections, by default 32.
+
+    retry_policy : RetryPolicy or None, optional
+        The backoff of failed requests, by default a RetryPolicy with its default settings.
+
+    circuit_breaker : CircuitBreaker or None, optional
+        The circuit breaker shared by every request, by default a CircuitBreaker with its default settings.
+
+    stats : RetryStats or None, optional
+        The counters of requests, retries and circuit breaker events, by default new counters.
+
+    rate_limiter : RateLimiter or None, optional
+        The requests and tokens per minute limiter of chat completions, by default None (no limit).
+    """
+    self._api_key = api_key
+    self.base_url = (base_url or os.getenv('OPENAI_API_BASE') or DEFAULT_BASE_URL).rstrip('/')
+    self.timeout = timeout
+    self._max_concurrency = max_concurrency
+    self._max_connections = max_connections
+
+    self.stats = stats or RetryStats()
+    self.retry_policy = retry_policy or RetryPolicy()
+    self.circuit_breaker = circuit_breaker or CircuitBreaker(stats=self.stats)
+    self.rate_limiter = rate_limiter
+
+    self._session: aiohttp.ClientSession | None = None
+    self._semaphore: asyncio.Semaphore | None = None
+
+    self._loop = asyncio.new_event_loop()
+    self._thread = threading.Thread(target=self._loop.run_forever, daemon=True, name='OpenAI Client Thread')
+    self._thread.start()
+
+    atexit.register(self._shutdown)
+
+  def _shutdown(self) -> None:
+    """ Closes the pooled session when the process exits. """
+    if self._session is not None and not self._session.closed and self._loop.is_running():
+      asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result(timeout=5)
+
+  @property
+  def api_key(self) -> str | None:
+    return self._api_key or os.getenv('OPENAI_API_KEY')
+
+  def run(self, coroutine: Coroutine) -> Any:
+    """
+    Runs a coroutine on the client event loop and blocks until it finishes.
+
+    Parameters
+    ----------
+    coroutine : Coroutine
+        The coroutine to run.
+
+    Returns
+    -------
+    Any
+        The result of the coroutine.
+    """
+    if threading.current_thread() is self._thread:
+      coroutine.close()
+      raise RuntimeError('AsyncOpenAIClient.run cannot be called from the client event loop, await the coroutine instead.')
+
+    return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+  async def submit(self, coroutine: Coroutine) -> Any:
+    """ Awaits a coroutine on the client event loop, from whatever event loop the caller runs on. """
+    if asyncio.get_running_loop() is self._loop:
+      return await coroutine
+
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self._loop))
+
+  def _get_session(self) -> aiohttp.ClientSession:
+    """ Returns the pooled session, created on first use inside the client event loop. """
+    if self._session is None or self._session.closed:
+      connector = aiohttp.TCPConnector(limit=self._max_connections, keepalive_timeout=60)
+      self._session = aiohttp.ClientSession(connector=connector)
+      self._semaphore = asyncio.Semaphore(self._max_concurrency)
+
+    return self._session
+
+  async def _post_once(self, path: str, payload: dict, timeout: float, on_event: Callable[[dict], None] | None = None) -> dict:
+    """
+    Sends a single POST request to the API. When `on_event` is given, the response is read as server-sent events,
+    every event is passed to it as it arrives, and the last event is returned.
+    """
+    session = self._get_session()
+    headers = {'Authorization': f'Bearer {self.api_key}'}
+
+    async with self._semaphore:
+      async with session.post(f'{self.base_url}{path}', json=payload, headers=headers,
+                              timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+        if response.status >= 400:
+          raise OpenAIRequestError(response.status, await response.text(), response.headers.get('Retry-After'))
+
+        if on_event is None:
+          return await response.json()
+
+        last_event = {}
+        async for line in response.content:
+          line = line.decode('utf-8').strip()
+
+          if not line.startswith('data:'):
+            continue
+
+          data = line[len('data:'):].strip()
+          if data == '[DONE]':
+            break
+
+          last_event = json.loads(data)
+          on_event(last_event)
+
+        return last_event
+
+  def _is_upstream_failure(self, error: Exception) -> bool:
+    """ Whether the error tells that the upstream is unhealthy, as opposed to a bad or rate-limited request. """
+    if isinstance(error, OpenAIRequestError):
+      return error.status >= 500 or error.status == 408
+
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError))
+
+  def _is_context_length_error(self, error: Exception) -> bool:
+    """ Whether the API rejected the request because the messages and the completion do not fit the context. """
+    return isinstance(error, OpenAIRequestError) and error.status == 400 and 'context_length_exceeded' in error.body
+
+  async def _post(self, path: str, payload: dict, timeout: float | None, tokens: int = 0,
+                  priority: literal["interactive", "background"] | None = None,
+                  on_event: Callable[[dict], None] | None = None) -> dict:
+    """
+    Sends a POST request to the API, retrying failed attempts with the retry policy,
+    within the retry budget of the running chat turn and while the circuit breaker is closed.
+
+    Parameters
+    ----------
+    path : str
+        The path of the endpoint, like '/chat/completions'.
+
+    payload : dict
+        The JSON body of the request.
+
+    timeout : float or None
+        The number of seconds the request may take, by default the client timeout.
+
+    tokens : int, optional
+        The estimated tokens of the request, taken from the rate limiter on every attempt, by default 0.
+
+    priority : literal["interactive", "background"] or None, optional
+        The priority of the request in the rate limiter, by default None (not rate limited).
+
+    on_event : Callable[[dict], None] or None, optional
+        Reads the response as server-sent events passed to this callback, by default None. A stream that already
+        delivered events is not retried.
+
+    Returns
+    -------
+    dict
+        The JSON body of the response.
+
+    Raises
+    ------
+    OpenAIRequestError
+        If the API answers with an error status that is not retried, or on the last attempt.
+
+    CircuitOpenError
+        If the circuit breaker is open.
+
+    RetryBudgetExceeded
+        If the retry budget of the chat turn runs out.
+    """
+    budget = current_budget()
+    attempt = 0
+    streamed = False
+
+    def on_stream_event(event: dict) -> None:
+      nonlocal streamed
+      streamed = True
+      on_event(event)
+
+    while True:
+      attempt += 1
+
+      if budget is not None:
+        try:
+          budget.take_attempt()
+        except Exception:
+          self.stats.increment('budget_exceeded')
+          raise
+
+      if self.rate_limiter is not None and priority is not None:
+        await self._acquire_rate_limit(tokens, priority, budget)
+
+      self.circuit_breaker.before_request()
+
+      request_timeout = timeout or self.timeout
+      if budget is not None and budget.remaining is not None:
+        request_timeout = max(min(request_timeout, budget.remaining), .001)
+
+      self.stats.increment('requests')
+
+      try:
+        result = await self._post_once(path, payload, request_timeout, on_stream_event if on_event else None)
+      except Exception as error:
+        if self._is_upstream_failure(error):
+          self.circuit_breaker.record_failure()
+        else:
+          self.circuit_breaker.release()
+
+        if isinstance(error, OpenAIRequestError) and error.status == 429:
+          self.stats.increment('rate_limited')
+        elif isinstance(error, asyncio.TimeoutError):
+          self.stats.increment('timeouts')
+
+        if streamed or not self.retry_policy.is_retryable(error) or attempt >= self.retry_policy.max_attempts:
+          self.stats.increment('failures')
+          raise
+
+        delay = self.retry_policy.delay(attempt, error)
+
+        if budget is not None and budget.remaining is not None and delay >= budget.remaining:
+          self.stats.increment('budget_exceeded')
+          raise RetryBudgetExceeded('deadline') from error
+
+        self.stats.increment('retries')
+        await asyncio.sleep(delay)
+        continue
+      except BaseException:
+        # A cancelled request tells nothing about the upstream, but must not hold the trial of the circuit breaker.
+        self.circuit_breaker.release()
+        raise
+
+      self.circuit_breaker.record_success()
+      self.stats.increment('successes')
+
+      return result
+
+  async def _acquire_rate_limit(self, tokens: int, priority: literal["interactive", "background"], budget) -> None:
+    """ Waits for the rate limiter, no longer than the retry budget of the chat turn allows. """
+    if budget is None or budget.remaining is None:
+      await self.rate_limiter.acquire(tokens, priority)
+      return
+
+    try:
+      await asyncio.wait_for(self.rate_limiter.acquire(tokens, priority), max(budget.remaining, 0.))
+    except asyncio.TimeoutError:
+      self.stats.increment('budget_exceeded')
+      raise RetryBudgetExceeded('deadline') from None
+
+  async def _chat_completion(self, messages: list[dict], model: str, timeout: float | None,
+                             priority: literal["interactive", "background"]) -> tuple[str, int]:
+    tokens = estimate_tokens(messages)
+    data = await self._post('/chat/completions', {'model': model, 'messages': messages}, timeout, tokens, priority)
+
+    used_tokens = data['usage']['total_tokens']
+    self.stats.increment('tokens', used_tokens)
+    if self.rate_limiter is not None:
+      self.rate_limiter.reconcile(self.rate_limiter.taken_tokens(tokens), used_tokens)
+
+    return (data['choices'][0]['message']['content'], used_tokens)
+
+  async def _stream_chat_completion(self, messages: list[dict], model: str, timeout: float | None,
+                                    priority: literal["interactive", "background"],
+                                    on_content: Callable[[str], None]) -> int:
+    tokens = estimate_tokens(messages)
+    contents = []
+
+    def on_event(event: dict) -> None:
+      for choice in event.get('choices') or []:
+        content = choice.get('delta', {}).get('content')
+
+        if content:
+          contents.append(content)
+          on_content(content)
+
+    payload = {'model': model, 'messages': messages, 'stream': True, 'stream_options': {'include_usage': True}}
+    last_event = await self._post('/chat/completions', payload, timeout, tokens, priority, on_event)
+
+    usage = last_event.get('usage')
+    used_tokens = usage['total_tokens'] if usage else estimate_tokens(messages, math.ceil(len(''.join(contents)) / 4))
+    self.stats.increment('tokens', used_tokens)
+
+    if self.rate_limiter is not None:
+      self.rate_limiter.reconcile(self.rate_limiter.taken_tokens(tokens), used_tokens)
+
+    return used_tokens
+
+  async def _embeddings(self, texts: list[str], model: str, timeout: float | None) -> list[list[float]]:
+    data = await self._post('/embeddings', {'model': model, 'input': texts}, timeout)
+    return [item['embedding'] for item in sorted(data['data'], key=lambda item: item['index'])]
+
+  async def chat_completion(self, messages: list[dict], model: str, timeout: float | None = None,
+                            priority: literal["interactive", "background"] = 'interactive',
+                            fallback_model: str | None = None) -> tuple[str, int]:
+    """
+    Requests a chat completion.
+
+    Parameters
+    ----------
+    messages : list of dict
+        The messages of the conversation.
+
+    model : str
+        The model to use.
+
+    timeout : float or None, optional
+        The number of seconds the request may take, by default the client timeout.
+
+    priority : literal["interactive", "background"], optional
+        Whether a user is waiting for the completion, background requests yield to interactive ones in the rate
+        limiter, by default 'interactive'.
+
+    fallback_model : str or None, optional
+        The model the request is sent to again when the API reports that it exceeds the context of `model`,
+        by default None (not sent again).
+
+    Returns
+    -------
+    tuple(str, int)
+        The message of the completion and the total tokens used.
+    """
+    try:
+      return await self.submit(self._chat_completion(messages, model, timeout, priority))
+    except OpenAIRequestError as error:
+      if fallback_model is None or not self._is_context_length_error(error):
+        raise
+
+    self.stats.increment('context_fallbacks')
+    return await self.submit(self._chat_completion(messages, fallback_model, timeout, priority))
+
+  def stream_chat_completion(self, messages: list[dict], model: str, timeout: float | None = None,
+                             priority: literal["interactive", "background"] = 'interactive',
+                             fallback_model: str | None = None) -> 'ChatCompletionStream':
+    """
+    Requests a chat completion streamed as it is generated.
+
+    Parameters
+    ----------
+    messages : list of dict
+        The messages of the conversation.
+
+    model : str
+        The model to use.
+
+    timeout : float or None, optional
+        The number of seconds the whole stream may take, by default the client timeout.
+
+    priority : literal["interactive", "background"], optional
+        Whether a user is waiting for the completion, by default 'interactive'.
+
+    fallback_model : str or None, optional
+        The model the request is sent to again when the API reports that it exceeds the context of `model`,
+        by default None (not sent again). The API rejects such a request before streaming anything.
+
+    Returns
+    -------
+    ChatCompletionStream
+        An async iterator over the pieces of the message, which tells the total tokens used once exhausted.
+    """
+    async def start(on_content: Callable[[str], None]) -> int:
+      try:
+        return await self._stream_chat_completion(messages, model, timeout, priority, on_content)
+      except OpenAIRequestError as error:
+        if fallback_model is None or not self._is_context_length_error(error):
+          raise
+
+      self.stats.increment('context_fallbacks')
+      return await self._stream_chat_completion(messages, fallback_model, timeout, priority, on_content)
+
+    return ChatCompletionStream(self, start)
+
+  async def embeddings(self, texts: list[str], model: str, timeout: float | None = None) -> list[list[float]]:
+    """
+    Requests the embeddings of many texts in a single request.
+
+    Parameters
+    ----------
+    texts : list[str]
+        The texts to embed.
+
+    model : str
+        The embedding model to use.
+
+    timeout : float or None, optional
+        The number of seconds the request may take, by default the client timeout.
+
+    Returns
+    -------
+    list[list[float]]
+        The embeddings of the texts, in the same order as the texts.
+    """
+    return await self.submit(self._embeddings(texts, model, timeout))
+
+  async def close(self) -> None:
+    """ Closes the pooled session. """
+    if self._session is not None:
+      await self.submit(self._session.close())
+
+
+class ChatCompletionStream:
+  """
+  Async iterator over the pieces of a streamed chat completion. The request starts on the first iteration,
+  runs on the client event loop, and is cancelled if the iteration is abandoned.
+  """
+
+  def __init__(self, client: AsyncOpenAIClient, start: Callable[[Callable[[str], None]], Coroutine]) -> None:
+    self._client = client
+    self._start = start
+    self.tokens: int | None = None
+
+  async def __aiter__(self) -> AsyncIterator[str]:
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[str | None] = asyncio.Queue()
+
+    def emit(content: str | None) -> None:
+      loop.call_soon_threadsafe(queue.put_nowait, content)
+
+    async def run() -> int:
+      try:
+        return await self._start(emit)
+      finally:
+        emit(None)
+
+    request = asyncio.ensure_future(self._client.submit(run()))
+
+    try:
+      while (content := await queue.get()) is not None:
+        yield content
+
+      self.tokens = await request
+    finally:
+      if not request.done():
+        request.cancel()
+
+
+_client: AsyncOpenAIClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> AsyncOpenAIClient:
+  """ Returns the client shared by every LLM and embedding call of the process. """
+  global _client
+
+  with _client_lock:
+    if _client is None:
+      stats = RetryStats()
+      _client = AsyncOpenAIClient(
+        timeout=float(os.getenv('OPENAI_TIMEOUT', 60)),
+        max_concurrency=int(os.getenv('OPENAI_MAX_CONCURRENCY', 16)),
+        retry_policy=RetryPolicy(
+          max_attempts=int(os.getenv('OPENAI_MAX_ATTEMPTS', 6)),
+          base_delay=float(os.getenv('OPENAI_RETRY_BASE_DELAY', .5)),
+          max_delay=float(os.getenv('OPENAI_RETRY_MAX_DELAY', 20))
+        ),
+        circuit_breaker=CircuitBreaker(
+          failure_threshold=int(os.getenv('OPENAI_CIRCUIT_FAILURES', 5)),
+          reset_timeout=float(os.getenv('OPENAI_CIRCUIT_RESET', 30)),
+          stats=stats
+        ),
+        stats=stats,
+        rate_limiter=RateLimiter(
+          requests_per_minute=int(os.getenv('OPENAI_REQUESTS_PER_MINUTE', 3500)),
+          tokens_per_minute=int(os.getenv('OPENAI_TOKENS_PER_MINUTE', 90000))
+        )
+      )
+
+    return _client
+
+
+def run_sync(coroutine: Coroutine) -> Any:
+  """ Runs a coroutine on the shared client event loop and blocks until it finishes. """
+  return get_client().run(coroutine)
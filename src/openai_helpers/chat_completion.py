@@ -1,36 +1,94 @@
-from openai.error import ServiceUnavailableError
 from ..errors import InvalidVersion
-import openai
-from typing import Literal as literal
+from .async_client import get_client, run_sync, ChatCompletionStream
+from .rate_limiter import estimate_tokens, COMPLETION_TOKENS
+from .completion_cache import get_completion_cache
+from typing import Callable, Literal as literal
+
+import asyncio
 
 Versions = ['4k', '16k']
+Models = {'4k': 'gpt-3.5-turbo', '16k': 'gpt-3.5-turbo-16k'}
+ContextSizes = {'4k': 4096, '16k': 16384}
 
+# The estimate of the tokens of a prompt is approximate, so the chosen context keeps this fraction of them free.
+CONTEXT_MARGIN = .15
 
-def chat_completion(prompt: str,
-                    ai_role: str = 'You are a helpful assistant.',
-                    version: literal["4k", "16k"] = '4k') -> tuple[str]:
-  response = None
 
+def fitting_version(prompt: str, ai_role: str = 'You are a helpful assistant.',
+                    completion_tokens: int = COMPLETION_TOKENS) -> literal["4k", "16k"]:
+  """
+  Returns the cheapest version whose context fits the prompt and the completion with a margin of CONTEXT_MARGIN,
+  the largest if none does.
+  """
+  tokens = estimate_tokens([{'content': ai_role}, {'content': prompt}], completion_tokens) * (1 + CONTEXT_MARGIN)
+
+  return next((version for version in Versions if tokens <= ContextSizes[version]), Versions[-1])
+
+
+def _fallback_model(version: literal["4k", "16k"]) -> str | None:
+  """ The model of the next larger version, used when a request exceeds the context of its version. """
+  larger = Versions[Versions.index(version) + 1:]
+  return Models[larger[0]] if larger else None
+
+
+async def achat_completion(prompt: str,
+                           ai_role: str = 'You are a helpful assistant.',
+                           version: literal["4k", "16k"] = '4k',
+                           timeout: float | None = None,
+                           priority: literal["interactive", "background"] = 'interactive',
+                           cache_if: Callable[[str], bool] | None = None) -> tuple[str, int]:
+  """
+  Requests a chat completion, returns the completion and the tokens used. A request that exceeds the context of
+  its version is sent again to the next larger version. Deterministic sub-tasks can pass `cache_if`, which tells
+  whether the caller can parse a completion, to reuse the completion of the same prompt from the completion cache,
+  if enabled. Only the completions it accepts are cached, and a cached completion uses no tokens.
+  """
+  if version not in Versions:
+    raise InvalidVersion(version)
+
+  completion_cache = get_completion_cache() if cache_if is not None else None
+
+  if completion_cache is not None:
+    cached = await asyncio.to_thread(completion_cache.get, Models[version], ai_role, prompt)
+
+    if cached is not None and cache_if(cached):
+      return cached, 0
+
+  messages = [
+    {'role': 'system', 'content': ai_role},
+    {'role': 'user', 'content': prompt},
+  ]
+
+  response, tokens = await get_client().chat_completion(messages, Models[version], timeout, priority,
+                                                        _fallback_model(version))
+
+  if completion_cache is not None and cache_if(response):
+    await asyncio.to_thread(completion_cache.put, Models[version], ai_role, prompt, response)
+
+  return response, tokens
+
+
+def astream_chat_completion(prompt: str,
+                            ai_role: str = 'You are a helpful assistant.',
+                            version: literal["4k", "16k"] = '4k',
+                            timeout: float | None = None,
+                            priority: literal["interactive", "background"] = 'interactive') -> ChatCompletionStream:
+  """ Streaming version of `achat_completion`, iterate the returned stream with `async for`. """
   if version not in Versions:
     raise InvalidVersion(version)
 
-  while response == None:
-    try:
-      response = openai.ChatCompletion.create(
-        model='gpt-3.5-turbo' if version == '4k' else 'gpt-3.5-turbo-16k',
-        messages=[
-          {'role': 'system', 'content': ai_role},
-          {'role': 'user', 'content': prompt},
-        ]
-      )
-    except ServiceUnavailableError as e:
-      message = e._message
-      if message != 'The server is overloaded or not ready yet.':
-        raise e
-
-      continue
-
-  message = response.choices[0].message.content
-  tokens = response['usage']['total_tokens']
-
-  return (message, tokens)
+  messages = [
+    {'role': 'system', 'content': ai_role},
+    {'role': 'user', 'content': prompt},
+  ]
+
+  return get_client().stream_chat_completion(messages, Models[version], timeout, priority, _fallback_model(version))
+
+
+def chat_completion(prompt: str,
+                    ai_role: str = 'You are a helpful assistant.',
+                    version: literal["4k", "16k"] = '4k',
+                    timeout: float | None = None,
+                    priority: literal["interactive", "background"] = 'interactive',
+                    cache_if: Callable[[str], bool] | None = None) -> tuple[str, int]:
+  return run_sync(achat_completion(prompt, ai_role, version, timeout, priority, cache_if))
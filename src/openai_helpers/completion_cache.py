@@ -0,0 +1,194 @@
+from collections import OrderedDict
+
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+  key TEXT PRIMARY KEY,
+  response TEXT NOT NULL,
+  created_at REAL NOT NULL
+);
+"""
+
+
+def normalize_prompt(prompt: str) -> str:
+  """ Collapses the whitespace and the case of a prompt, prompts that only differ in them share their completion. """
+  return ' '.join(prompt.split()).casefold()
+
+
+class CompletionCache:
+  """
+  Cache of the completions of deterministic sub-tasks, like choosing the pose of a sentence, keyed by a hash of the
+  model, the system role and the normalized prompt. Completions expire after a time to live, a bounded in-memory LRU
+  tier sits in front of an optional SQLite tier that keeps them across restarts.
+  """
+
+  def __init__(self, max_entries: int = 5000, ttl: float = 86400., database_file: str | None = 'completion_cache.db') -> None:
+    """
+    Initializes the CompletionCache.
+
+    Parameters
+    ----------
+    max_entries : int, optional
+        The maximum number of completions kept in memory, by default 5000.
+
+    ttl : float, optional
+        The number of seconds a completion is reused, by default 86400.
+
+    database_file : str or None, optional
+        The SQLite database of the disk tier, by default 'completion_cache.db'. None keeps the cache in memory only.
+    """
+    self._max_entries = max_entries
+    self._ttl = ttl
+    self._database_file = database_file
+    self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+    self._lock = threading.Lock()
+    self._local = threading.local()
+
+    self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'expirations': 0, 'evictions': 0}
+
+    if database_file is not None:
+      connection = self._connection()
+      connection.execute('PRAGMA journal_mode=WAL')
+      connection.executescript(SCHEMA)
+
+      with connection:
+        connection.execute('DELETE FROM completions WHERE created_at < ?', (time.time() - ttl,))
+
+  def _connection(self) -> sqlite3.Connection:
+    """ Returns the disk tier connection of the current thread. """
+    connection = getattr(self._local, 'connection', None)
+
+    if connection is None:
+      connection = sqlite3.connect(self._database_file, timeout=30)
+      connection.execute('PRAGMA synchronous=NORMAL')
+      self._local.connection = connection
+
+    return connection
+
+  def key(self, model: str, ai_role: str, prompt: str) -> str:
+    """ The hash of the model, the system role and the normalized prompt. """
+    return hashlib.sha256(f'{model}\0{ai_role}\0{normalize_prompt(prompt)}'.encode('utf-8')).hexdigest()
+
+  def _remember(self, key: str, response: str, created_at: float) -> None:
+    """ Adds a completion to the memory tier, evicting the least recently used ones. Must be called holding the lock. """
+    self._entries[key] = (response, created_at)
+    self._entries.move_to_end(key)
+
+    while len(self._entries) > self._max_entries:
+      self._entries.popitem(last=False)
+      self._stats['evictions'] += 1
+
+  def get(self, model: str, ai_role: str, prompt: str) -> str | None:
+    """
+    Looks up the completion of a prompt, in memory first and then on disk.
+
+    Parameters
+    ----------
+    model : str
+        The chat model.
+
+    ai_role : str
+        The system role of the request.
+
+    prompt : str
+        The prompt.
+
+    Returns
+    -------
+    str or None
+        The completion, None if it is not cached or expired.
+    """
+    key = self.key(model, ai_role, prompt)
+    now = time.time()
+
+    with self._lock:
+      entry = self._entries.get(key)
+
+      if entry is not None and now - entry[1] > self._ttl:
+        del self._entries[key]
+        self._stats['expirations'] += 1
+        entry = None
+
+      if entry is not None:
+        self._entries.move_to_end(key)
+        self._stats['memory_hits'] += 1
+        return entry[0]
+
+    if self._database_file is not None:
+      row = self._connection().execute('SELECT response, created_at FROM completions WHERE key = ? AND created_at >= ?',
+                                       (key, now - self._ttl)).fetchone()
+
+      if row is not None:
+        with self._lock:
+          self._remember(key, *row)
+          self._stats['disk_hits'] += 1
+
+        return row[0]
+
+    with self._lock:
+      self._stats['misses'] += 1
+
+    return None
+
+  def put(self, model: str, ai_role: str, prompt: str, response: str) -> None:
+    """
+    Caches the completion of a prompt.
+
+    Parameters
+    ----------
+    model : str
+        The chat model.
+
+    ai_role : str
+        The system role of the request.
+
+    prompt : str
+        The prompt.
+
+    response : str
+        The completion.
+    """
+    key = self.key(model, ai_role, prompt)
+    created_at = time.time()
+
+    with self._lock:
+      self._remember(key, response, created_at)
+
+    if self._database_file is not None:
+      connection = self._connection()
+
+      with connection:
+        connection.execute('INSERT OR REPLACE INTO completions (key, response, created_at) VALUES (?, ?, ?)',
+                           (key, response, created_at))
+
+  def stats(self) -> dict[str, int]:
+    """ Returns the hit, miss, expiration and eviction counters and the number of completions in memory. """
+    with self._lock:
+      return {**self._stats, 'size': len(self._entries)}
+
+
+_cache: CompletionCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_completion_cache() -> CompletionCache | None:
+  """ Returns the completion cache shared by every character of the process, None unless COMPLETION_CACHE is set. """
+  global _cache
+
+  if os.getenv('COMPLETION_CACHE', '0').lower() not in ('1', 'true', 'yes'):
+    return None
+
+  with _cache_lock:
+    if _cache is None:
+      _cache = CompletionCache(
+        max_entries=int(os.getenv('COMPLETION_CACHE_SIZE', 5000)),
+        ttl=float(os.getenv('COMPLETION_CACHE_TTL', 86400)),
+        database_file=os.getenv('COMPLETION_CACHE_FILE', 'completion_cache.db') or None
+      )
+
+    return _cache
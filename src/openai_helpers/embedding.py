@@ -0,0 +1,84 @@
+from .async_client import get_client, run_sync
+from .embedding_cache import get_embedding_cache
+from .embedding_batcher import EmbeddingBatcher
+
+import os
+import asyncio
+import threading
+import numpy as np
+
+EMBEDDING_ENGINE = 'text-embedding-ada-002'
+MAX_BATCH_SIZE = 100
+
+_batcher: EmbeddingBatcher | None = None
+_batcher_lock = threading.Lock()
+
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+  """ Returns the embedding batcher shared by every character of the process. """
+  global _batcher
+
+  with _batcher_lock:
+    if _batcher is None:
+      _batcher = EmbeddingBatcher(get_client(), EMBEDDING_ENGINE, window=float(os.getenv('EMBEDDING_BATCH_WINDOW', .01)),
+                                  max_batch_size=MAX_BATCH_SIZE)
+
+    return _batcher
+
+
+async def aembed_many(texts: list[str]) -> list[list[float]]:
+  """
+  Computes the embeddings of many texts, looking them up in the embedding cache first. The missing ones are requested
+  once each through the embedding batcher, together with the texts embedded at the same time by other callers.
+
+  Parameters
+  ----------
+  texts : list[str]
+      The texts to embed.
+
+  Returns
+  -------
+  list[list[float]]
+      The embeddings of the texts, in the same order as the texts.
+  """
+  texts = [text.replace('\n', ' ') for text in texts]
+  cache = get_embedding_cache()
+  embeddings = await asyncio.to_thread(cache.get_many, EMBEDDING_ENGINE, texts)
+
+  missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+  computed = {}
+
+  if missing:
+    missing_embeddings = np.asarray(await get_embedding_batcher().embed_many(missing), dtype=np.float32).tolist()
+
+    await asyncio.to_thread(cache.put_many, EMBEDDING_ENGINE, missing, missing_embeddings)
+    computed.update(zip(missing, missing_embeddings))
+
+  return [embedding if embedding is not None else computed[text] for text, embedding in zip(texts, embeddings)]
+
+
+async def aembed(text: str) -> list[float]:
+  """
+  Computes the embedding of the given text.
+
+  Parameters
+  ----------
+  text : str
+      The text to embed.
+
+  Returns
+  -------
+  list[float]
+      The embedding of the text.
+  """
+  return (await aembed_many([text]))[0]
+
+
+def embed(text: str) -> list[float]:
+  """ Computes the embedding of the given text, blocking until it is ready. """
+  return run_sync(aembed(text))
+
+
+def embed_many(texts: list[str]) -> list[list[float]]:
+  """ Computes the embeddings of many texts, blocking until they are ready. """
+  return run_sync(aembed_many(texts))
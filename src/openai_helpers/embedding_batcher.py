@@ -0,0 +1,107 @@
+from .async_client import AsyncOpenAIClient
+from .retry import retry_budget
+
+import asyncio
+
+
+class EmbeddingBatcher:
+  """
+  Coalesces the embedding requests made at about the same time. The texts wait on the client event loop for a short
+  window, or until a batch is full, and are embedded with a single request whose vectors are fanned back out.
+  """
+
+  def __init__(self, client: AsyncOpenAIClient, model: str, window: float = .01, max_batch_size: int = 100) -> None:
+    """
+    Initializes the EmbeddingBatcher.
+
+    Parameters
+    ----------
+    client : AsyncOpenAIClient
+        The client that sends the requests, the batches are accumulated on its event loop.
+
+    model : str
+        The embedding model.
+
+    window : float, optional
+        The number of seconds the first text of a batch waits for others, by default .01.
+
+    max_batch_size : int, optional
+        The number of texts that sends a batch right away, by default 100.
+    """
+    self._client = client
+    self._model = model
+    self.window = window
+    self.max_batch_size = max_batch_size
+
+    self._pending: dict[str, asyncio.Future] = {}
+    self._timer: asyncio.TimerHandle | None = None
+    self._batches: set[asyncio.Task] = set()
+
+  async def embed_many(self, texts: list[str]) -> list[list[float]]:
+    """
+    Computes the embeddings of many texts as part of the next batches, can be awaited from any event loop.
+
+    Parameters
+    ----------
+    texts : list[str]
+        The texts to embed.
+
+    Returns
+    -------
+    list[list[float]]
+        The embeddings of the texts, in the same order as the texts.
+    """
+    if not texts:
+      return []
+
+    return await self._client.submit(self._enqueue(texts))
+
+  async def _enqueue(self, texts: list[str]) -> list[list[float]]:
+    """ Adds the texts to the pending batch and waits for their embeddings. Runs on the client event loop. """
+    loop = asyncio.get_running_loop()
+    futures = []
+
+    for text in texts:
+      future = self._pending.get(text)
+
+      if future is None:
+        future = self._pending[text] = loop.create_future()
+
+      futures.append(future)
+
+    if len(self._pending) >= self.max_batch_size:
+      self._flush()
+    elif self._timer is None:
+      self._timer = loop.call_later(self.window, self._flush)
+
+    return list(await asyncio.gather(*[asyncio.shield(future) for future in futures]))
+
+  def _flush(self) -> None:
+    """ Sends the pending texts in batches of at most max_batch_size texts. """
+    if self._timer is not None:
+      self._timer.cancel()
+      self._timer = None
+
+    pending, self._pending = list(self._pending.items()), {}
+
+    for i in range(0, len(pending), self.max_batch_size):
+      # A batch serves many callers, so it is not bound to the retry budget of whichever turn flushed it.
+      with retry_budget():
+        batch = asyncio.ensure_future(self._send(dict(pending[i: i + self.max_batch_size])))
+
+      self._batches.add(batch)
+      batch.add_done_callback(self._batches.discard)
+
+  async def _send(self, batch: dict[str, asyncio.Future]) -> None:
+    """ Embeds a batch with a single request and resolves the future of every text. """
+    try:
+      embeddings = await self._client.embeddings(list(batch), self._model)
+    except Exception as error:
+      for future in batch.values():
+        if not future.done():
+          future.set_exception(error)
+      return
+
+    for future, embedding in zip(batch.values(), embeddings):
+      if not future.done():
+        future.set_result(embedding)
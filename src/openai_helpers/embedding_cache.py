@@ -0,0 +1,176 @@
+from collections import OrderedDict
+
+import os
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+  key TEXT PRIMARY KEY,
+  embedding BLOB NOT NULL
+);
+"""
+
+
+class EmbeddingCache:
+  """
+  Content-addressed cache of embeddings, keyed by a hash of the model and the text. A bounded in-memory LRU tier
+  sits in front of an optional SQLite tier that keeps every embedding across restarts.
+  """
+
+  def __init__(self, max_entries: int = 10000, database_file: str | None = 'embedding_cache.db') -> None:
+    """
+    Initializes the EmbeddingCache.
+
+    Parameters
+    ----------
+    max_entries : int, optional
+        The maximum number of embeddings kept in memory, by default 10000.
+
+    database_file : str or None, optional
+        The SQLite database of the disk tier, by default 'embedding_cache.db'. None keeps the cache in memory only.
+    """
+    self._max_entries = max_entries
+    self._database_file = database_file
+    self._entries: OrderedDict[str, np.ndarray] = OrderedDict()
+    self._lock = threading.Lock()
+    self._local = threading.local()
+
+    self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+
+    if database_file is not None:
+      connection = self._connection()
+      connection.execute('PRAGMA journal_mode=WAL')
+      connection.executescript(SCHEMA)
+
+  def _connection(self) -> sqlite3.Connection:
+    """ Returns the disk tier connection of the current thread. """
+    connection = getattr(self._local, 'connection', None)
+
+    if connection is None:
+      connection = sqlite3.connect(self._database_file, timeout=30)
+      connection.execute('PRAGMA synchronous=NORMAL')
+      self._local.connection = connection
+
+    return connection
+
+  def key(self, model: str, text: str) -> str:
+    """ The hash of the model and the text. """
+    return hashlib.sha256(f'{model}\0{text}'.encode('utf-8')).hexdigest()
+
+  def _remember(self, key: str, embedding: np.ndarray) -> None:
+    """ Adds an embedding to the memory tier, evicting the least recently used ones. Must be called holding the lock. """
+    self._entries[key] = embedding
+    self._entries.move_to_end(key)
+
+    while len(self._entries) > self._max_entries:
+      self._entries.popitem(last=False)
+      self._stats['evictions'] += 1
+
+  def get_many(self, model: str, texts: list[str]) -> list[list[float] | None]:
+    """
+    Looks up the embeddings of many texts, in memory first and then on disk.
+
+    Parameters
+    ----------
+    model : str
+        The embedding model.
+
+    texts : list[str]
+        The texts.
+
+    Returns
+    -------
+    list[list[float] or None]
+        The embedding of every text, None where it is not cached.
+    """
+    keys = [self.key(model, text) for text in texts]
+    embeddings: list[np.ndarray | None] = [None] * len(texts)
+    missing = []
+
+    with self._lock:
+      for i, key in enumerate(keys):
+        embedding = self._entries.get(key)
+
+        if embedding is None:
+          missing.append(i)
+          continue
+
+        self._entries.move_to_end(key)
+        embeddings[i] = embedding
+        self._stats['memory_hits'] += 1
+
+    if missing and self._database_file is not None:
+      missing_keys = list({keys[i] for i in missing})
+      stored = {}
+
+      for start in range(0, len(missing_keys), 500):
+        batch = missing_keys[start: start + 500]
+        rows = self._connection().execute(
+          f'SELECT key, embedding FROM embeddings WHERE key IN ({", ".join("?" * len(batch))})', batch).fetchall()
+        stored.update({key: np.frombuffer(embedding, dtype=np.float32) for key, embedding in rows})
+
+      with self._lock:
+        for i in missing:
+          if keys[i] in stored:
+            embeddings[i] = stored[keys[i]]
+            self._remember(keys[i], embeddings[i])
+            self._stats['disk_hits'] += 1
+
+    with self._lock:
+      self._stats['misses'] += sum(embedding is None for embedding in embeddings)
+
+    return [embedding.tolist() if embedding is not None else None for embedding in embeddings]
+
+  def put_many(self, model: str, texts: list[str], embeddings: list[list[float]]) -> None:
+    """
+    Caches the embeddings of many texts.
+
+    Parameters
+    ----------
+    model : str
+        The embedding model.
+
+    texts : list[str]
+        The texts.
+
+    embeddings : list[list[float]]
+        The embedding of every text.
+    """
+    entries = {self.key(model, text): np.asarray(embedding, dtype=np.float32) for text, embedding in zip(texts, embeddings)}
+
+    with self._lock:
+      for key, embedding in entries.items():
+        self._remember(key, embedding)
+
+    if self._database_file is not None:
+      connection = self._connection()
+
+      with connection:
+        connection.executemany('INSERT OR REPLACE INTO embeddings (key, embedding) VALUES (?, ?)',
+                               [(key, embedding.tobytes()) for key, embedding in entries.items()])
+
+  def stats(self) -> dict[str, int]:
+    """ Returns the hit, miss and eviction counters and the number of embeddings in memory. """
+    with self._lock:
+      return {**self._stats, 'size': len(self._entries)}
+
+
+_cache: EmbeddingCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+  """ Returns the embedding cache shared by every character of the process. """
+  global _cache
+
+  with _cache_lock:
+    if _cache is None:
+      _cache = EmbeddingCache(
+        max_entries=int(os.getenv('EMBEDDING_CACHE_SIZE', 10000)),
+        database_file=os.getenv('EMBEDDING_CACHE_FILE', 'embedding_cache.db') or None
+      )
+
+    return _cache
@@ -0,0 +1,156 @@
+from typing import Literal as literal
+
+import math
+import time
+import asyncio
+
+Priorities = ['interactive', 'background']
+
+CHARS_PER_TOKEN = 4
+TOKENS_PER_MESSAGE = 4
+COMPLETION_TOKENS = 256
+
+
+def count_tokens(text: str) -> int:
+  """ Estimates the tokens of a text. """
+  return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def estimate_tokens(messages: list[dict], completion_tokens: int = COMPLETION_TOKENS) -> int:
+  """
+  Estimates the tokens a chat completion will use, before the API tells the real usage.
+
+  Parameters
+  ----------
+  messages : list of dict
+      The messages of the conversation.
+
+  completion_tokens : int, optional
+      The expected length of the completion, by default COMPLETION_TOKENS.
+
+  Returns
+  -------
+  int
+      The estimated number of prompt and completion tokens.
+  """
+  prompt_tokens = sum(count_tokens(message['content']) + TOKENS_PER_MESSAGE for message in messages)
+  return prompt_tokens + completion_tokens
+
+
+class TokenBucket:
+  """ A bucket refilled continuously up to its capacity, its level may go negative to pay back underestimates. """
+
+  def __init__(self, capacity: float, refill_per_second: float) -> None:
+    self.capacity = capacity
+    self.refill_per_second = refill_per_second
+    self._level = capacity
+    self._updated_at = time.monotonic()
+
+  @property
+  def level(self) -> float:
+    now = time.monotonic()
+    self._level = min(self.capacity, self._level + (now - self._updated_at) * self.refill_per_second)
+    self._updated_at = now
+    return self._level
+
+  def wait_time(self, amount: float, reserve: float = 0.) -> float:
+    """ The number of seconds before `amount` can be taken while leaving `reserve` in the bucket. """
+    missing = amount + reserve - self.level
+    return max(missing / self.refill_per_second, 0.)
+
+  def take(self, amount: float) -> None:
+    self._level = self.level - amount
+
+
+class RateLimiter:
+  """
+  Client-side limiter of the requests per minute and tokens per minute of the account. Interactive requests are
+  served before waiting background requests, and background requests cannot use the share of the buckets reserved
+  for interactive ones, so background bursts do not starve the chat responses.
+
+  The limiter is meant to be used from a single event loop, the one of the OpenAI client.
+  """
+
+  def __init__(self, requests_per_minute: int = 3500, tokens_per_minute: int = 90000, interactive_reserve: float = .2) -> None:
+    """
+    Initializes the RateLimiter.
+
+    Parameters
+    ----------
+    requests_per_minute : int, optional
+        The requests per minute limit of the account, by default 3500.
+
+    tokens_per_minute : int, optional
+        The tokens per minute limit of the account, by default 90000.
+
+    interactive_reserve : float, optional
+        The fraction of both buckets only interactive requests may use, by default .2.
+    """
+    self._requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+    self._tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+    self._interactive_reserve = interactive_reserve
+    self._interactive_waiting = 0
+
+  def taken_tokens(self, tokens: int) -> int:
+    """ The tokens `acquire` takes for a request of the estimated size, capped so a huge request can still fit. """
+    return min(tokens, int(self._tokens.capacity * (1 - self._interactive_reserve)))
+
+  async def acquire(self, tokens: int, priority: literal["interactive", "background"] = 'interactive') -> int:
+    """
+    Waits until a request of the given size fits in the buckets, and takes it from them.
+
+    Parameters
+    ----------
+    tokens : int
+        The estimated tokens of the request.
+
+    priority : literal["interactive", "background"], optional
+        The priority of the request, by default 'interactive'.
+
+    Returns
+    -------
+    int
+        The tokens taken, to reconcile with the real usage.
+    """
+    tokens = self.taken_tokens(tokens)
+    is_interactive = priority == 'interactive'
+
+    if is_interactive:
+      self._interactive_waiting += 1
+
+    try:
+      while True:
+        if not is_interactive and self._interactive_waiting:
+          wait_time = .05
+        else:
+          reserve = 0. if is_interactive else self._interactive_reserve
+          wait_time = max(self._requests.wait_time(1, self._requests.capacity * reserve),
+                          self._tokens.wait_time(tokens, self._tokens.capacity * reserve))
+
+          if wait_time <= 0:
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            return tokens
+
+        await asyncio.sleep(wait_time)
+    finally:
+      if is_interactive:
+        self._interactive_waiting -= 1
+
+  def reconcile(self, taken_tokens: int, used_tokens: int) -> None:
+    """
+    Corrects the token bucket with the real usage of a request once the API reports it.
+
+    Parameters
+    ----------
+    taken_tokens : int
+        The tokens `acquire` took for the request, see `taken_tokens`.
+
+    used_tokens : int
+        The tokens the request used.
+    """
+    self._tokens.take(used_tokens - taken_tokens)
+
+  @property
+  def available_tokens(self) -> float:
+    return self._tokens.level
@@ -0,0 +1,266 @@
+from ..errors import OpenAIRequestError, CircuitOpenError, RetryBudgetExceeded
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+import time
+import random
+import asyncio
+import datetime
+import threading
+import contextvars
+import aiohttp
+
+RETRYABLE_STATUSES = (408, 409, 429, 500, 502, 503, 504)
+
+
+class RetryStats:
+  """ Thread-safe counters of the requests, tokens, retries and circuit breaker events. """
+
+  def __init__(self) -> None:
+    self._lock = threading.Lock()
+    self._counters = {
+      'requests': 0,
+      'successes': 0,
+      'tokens': 0,
+      'retries': 0,
+      'failures': 0,
+      'rate_limited': 0,
+      'timeouts': 0,
+      'budget_exceeded': 0,
+      'circuit_opened': 0,
+      'circuit_rejected': 0,
+      'context_fallbacks': 0
+    }
+
+  def increment(self, counter: str, amount: int = 1) -> None:
+    with self._lock:
+      self._counters[counter] = self._counters.get(counter, 0) + amount
+
+  def snapshot(self) -> dict[str, int]:
+    """ Returns a copy of the counters. """
+    with self._lock:
+      return dict(self._counters)
+
+
+class RetryPolicy:
+  """ Exponential backoff with full jitter, honouring the Retry-After header of the API. """
+
+  def __init__(self, max_attempts: int = 6, base_delay: float = .5, max_delay: float = 20.,
+               retryable_statuses: tuple[int] = RETRYABLE_STATUSES) -> None:
+    """
+    Initializes the RetryPolicy.
+
+    Parameters
+    ----------
+    max_attempts : int, optional
+        The maximum number of attempts per request, by default 6.
+
+    base_delay : float, optional
+        The delay cap of the first retry in seconds, doubled on every retry, by default .5.
+
+    max_delay : float, optional
+        The maximum delay between attempts in seconds, by default 20.
+
+    retryable_statuses : tuple[int], optional
+        The HTTP statuses that are retried, by default RETRYABLE_STATUSES.
+    """
+    self.max_attempts = max_attempts
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.retryable_statuses = retryable_statuses
+
+  def is_retryable(self, error: Exception) -> bool:
+    """ Whether a request that failed with the given error may be retried. """
+    if isinstance(error, OpenAIRequestError):
+      return error.status in self.retryable_statuses
+
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError))
+
+  def _parse_retry_after(self, retry_after: str | None) -> float | None:
+    """ Parses a Retry-After header given in seconds or as an HTTP date. """
+    if not retry_after:
+      return None
+
+    try:
+      return max(float(retry_after), 0.)
+    except ValueError:
+      pass
+
+    try:
+      retry_at = parsedate_to_datetime(retry_after)
+      return max((retry_at - datetime.datetime.now(retry_at.tzinfo)).total_seconds(), 0.)
+    except (TypeError, ValueError):
+      return None
+
+  def delay(self, attempt: int, error: Exception) -> float:
+    """
+    Computes the delay before the next attempt.
+
+    Parameters
+    ----------
+    attempt : int
+        The number of attempts made so far, starting at 1.
+
+    error : Exception
+        The error of the last attempt.
+
+    Returns
+    -------
+    float
+        The number of seconds to wait.
+    """
+    retry_after = self._parse_retry_after(getattr(error, 'retry_after', None))
+
+    if retry_after is not None:
+      return min(retry_after, self.max_delay)
+
+    return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+  """
+  Fails fast while the upstream is unhealthy. The circuit opens after consecutive failures,
+  and once the reset timeout has elapsed a single trial request is let through to close it again.
+  """
+
+  CLOSED = 'closed'
+  OPEN = 'open'
+  HALF_OPEN = 'half_open'
+
+  def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30., stats: RetryStats | None = None) -> None:
+    """
+    Initializes the CircuitBreaker.
+
+    Parameters
+    ----------
+    failure_threshold : int, optional
+        The number of consecutive failures that opens the circuit, by default 5.
+
+    reset_timeout : float, optional
+        The number of seconds the circuit stays open before a trial request, by default 30.
+
+    stats : RetryStats or None, optional
+        The counters where circuit events are recorded, by default None.
+    """
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+    self._stats = stats or RetryStats()
+
+    self._lock = threading.Lock()
+    self._state = self.CLOSED
+    self._failures = 0
+    self._opened_at = 0.
+    self._trial_in_flight = False
+
+  @property
+  def state(self) -> str:
+    return self._state
+
+  def before_request(self) -> None:
+    """
+    Checks whether a request may be sent.
+
+    Raises
+    ------
+    CircuitOpenError
+        If the circuit is open, or half open with a trial request already in flight.
+    """
+    with self._lock:
+      if self._state == self.CLOSED:
+        return
+
+      remaining = self._opened_at + self.reset_timeout - time.monotonic()
+
+      if self._state == self.OPEN and remaining <= 0:
+        self._state = self.HALF_OPEN
+
+      if self._state == self.HALF_OPEN and not self._trial_in_flight:
+        self._trial_in_flight = True
+        return
+
+    self._stats.increment('circuit_rejected')
+    raise CircuitOpenError(max(remaining, 0.))
+
+  def record_success(self) -> None:
+    with self._lock:
+      self._state = self.CLOSED
+      self._failures = 0
+      self._trial_in_flight = False
+
+  def record_failure(self) -> None:
+    with self._lock:
+      self._failures += 1
+      self._trial_in_flight = False
+
+      if self._state == self.HALF_OPEN or (self._state == self.CLOSED and self._failures >= self.failure_threshold):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._stats.increment('circuit_opened')
+
+  def release(self) -> None:
+    """ Lets another trial request through when a trial ended without telling whether the upstream is healthy. """
+    with self._lock:
+      self._trial_in_flight = False
+
+
+class RetryBudget:
+  """ A deadline and a number of attempts shared by every request of a chat turn. """
+
+  def __init__(self, seconds: float | None, max_attempts: int | None) -> None:
+    self.deadline = time.monotonic() + seconds if seconds is not None else None
+    self._attempts_left = max_attempts
+    self._lock = threading.Lock()
+
+  @property
+  def remaining(self) -> float | None:
+    """ The number of seconds left before the deadline, or None without a deadline. """
+    return self.deadline - time.monotonic() if self.deadline is not None else None
+
+  def take_attempt(self) -> None:
+    """
+    Uses one attempt of the budget.
+
+    Raises
+    ------
+    RetryBudgetExceeded
+        If the deadline has passed or no attempts are left.
+    """
+    with self._lock:
+      if self.deadline is not None and time.monotonic() >= self.deadline:
+        raise RetryBudgetExceeded('deadline')
+
+      if self._attempts_left is not None:
+        if self._attempts_left <= 0:
+          raise RetryBudgetExceeded('attempts')
+
+        self._attempts_left -= 1
+
+
+_current_budget: contextvars.ContextVar[RetryBudget | None] = contextvars.ContextVar('retry_budget', default=None)
+
+
+def current_budget() -> RetryBudget | None:
+  """ Returns the retry budget of the running chat turn, if any. """
+  return _current_budget.get()
+
+
+@contextmanager
+def retry_budget(seconds: float | None = None, max_attempts: int | None = None):
+  """
+  Shares a deadline and a number of attempts between every LLM and embedding request made inside the block,
+  including the requests of tasks and threads started from it.
+
+  Parameters
+  ----------
+  seconds : float or None, optional
+      The number of seconds the requests may take in total, by default None (no deadline).
+
+  max_attempts : int or None, optional
+      The number of attempts, retries included, the requests may make in total, by default None (no limit).
+  """
+  token = _current_budget.set(RetryBudget(seconds, max_attempts))
+
+  try:
+    yield
+  finally:
+    _current_budget.reset(token)
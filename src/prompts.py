@@ -0,0 +1,403 @@
+from .openai_helpers.rate_limiter import count_tokens
+from collections import OrderedDict
+
+import string
+import textwrap
+import threading
+
+PREFIX_CACHE_SIZE = 64
+
+
+class Prompt(str):
+  """ The text of a prompt, with the estimated tokens of each of its segments. """
+
+  segments: dict[str, int]
+
+  def __new__(cls, text: str, segments: dict[str, int]) -> 'Prompt':
+    prompt = super().__new__(cls, text)
+    prompt.segments = segments
+    return prompt
+
+  @property
+  def tokens(self) -> int:
+    """ The estimated tokens of the whole prompt. """
+    return sum(self.segments.values())
+
+
+class PromptTemplate:
+  """
+  A prompt template, dedented and parsed once when it is defined. The text up to its first field that is not static
+  (like the name or the bio of the character) is the prefix of the template, it is rendered once per combination of
+  static values and kept, so it is the same for every prompt of a character and upstream prompt caching can reuse
+  it. The rest of the prompt is assembled by concatenation.
+  """
+
+  def __init__(self, name: str, template: str, static: tuple[str, ...] = ()) -> None:
+    """
+    Initializes the PromptTemplate.
+
+    Parameters
+    ----------
+    name : str
+        The name of the template in the registry.
+
+    template : str
+        The text of the template, with named fields like '{name}'.
+
+    static : tuple[str, ...], optional
+        The fields whose values do not change between the prompts of a character, by default none.
+    """
+    self.name = name
+    self.template = textwrap.dedent(template)
+    self.static = static
+
+    parts = []
+    for literal_text, field, format_spec, conversion in string.Formatter().parse(self.template):
+      if format_spec or conversion:
+        raise ValueError(f'Field {field} of the prompt {name} has a format spec or conversion, they are not supported')
+
+      parts.append((literal_text, field))
+
+    split = next((i for i, (_, field) in enumerate(parts) if field is not None and field not in static), len(parts))
+
+    self._prefix_parts = parts[:split]
+    self._body_parts = parts[split:]
+
+    if self._body_parts:
+      self._prefix_parts.append((self._body_parts[0][0], None))
+      self._body_parts[0] = ('', self._body_parts[0][1])
+
+    self.fields = tuple(dict.fromkeys(field for _, field in parts if field is not None))
+    self._prefix_fields = tuple(dict.fromkeys(field for _, field in self._prefix_parts if field is not None))
+    self._body_tokens = count_tokens(''.join(literal_text for literal_text, _ in self._body_parts))
+
+    self._prefixes: OrderedDict[tuple, tuple[str, int]] = OrderedDict()
+    self._lock = threading.Lock()
+
+  def prefix(self, **values) -> tuple[str, int]:
+    """ Returns the rendered prefix for the given static values and its tokens, cached per combination of values. """
+    key = tuple(values[field] for field in self._prefix_fields)
+
+    with self._lock:
+      cached = self._prefixes.get(key)
+
+      if cached is not None:
+        self._prefixes.move_to_end(key)
+        return cached
+
+    text = ''.join(literal_text + (str(values[field]) if field is not None else '') for literal_text, field in self._prefix_parts)
+    cached = (text, count_tokens(text))
+
+    with self._lock:
+      self._prefixes[key] = cached
+
+      while len(self._prefixes) > PREFIX_CACHE_SIZE:
+        self._prefixes.popitem(last=False)
+
+    return cached
+
+  def format(self, **values) -> Prompt:
+    """
+    Assembles a prompt.
+
+    Parameters
+    ----------
+    **values:
+        The value of every field of the template.
+
+    Returns
+    -------
+    Prompt
+        The prompt, with the tokens of its prefix, of the rest of the template text and of every field.
+    """
+    prefix, prefix_tokens = self.prefix(**values)
+
+    pieces = [prefix]
+    segments = {'prefix': prefix_tokens, 'template': self._body_tokens}
+
+    for literal_text, field in self._body_parts:
+      pieces.append(literal_text)
+
+      if field is not None:
+        value = str(values[field])
+        pieces.append(value)
+        segments[field] = segments.get(field, 0) + count_tokens(value)
+
+    return Prompt(''.join(pieces), segments)
+
+
+PROMPTS: dict[str, PromptTemplate] = {}
+
+
+def register(name: str, template: str, static: tuple[str, ...] = ()) -> PromptTemplate:
+  """ Creates a template and adds it to the registry. """
+  if name in PROMPTS:
+    raise ValueError(f'{name} is already a registered prompt')
+
+  PROMPTS[name] = PromptTemplate(name, template, static)
+  return PROMPTS[name]
+
+
+CHARACTER_DESCRIPTION = register('character_description', """
+You are a person named {name}.
+Your abilities are the following:
+{abilities}
+
+Your traits are the following:
+{traits}
+
+Your bio is the following:
+{summaries}
+""", static=('name', 'abilities', 'traits'))
+
+BIO_KEY_FEATURES = register('bio_key_features', """
+How would one describe the key features of {name} given the following statements?
+Use a maximum of 120 words. Include only the summary, do not add a title or the like.
+
+Only use the information provided below:
+{memories}
+""", static=('name',))
+
+BIO_OCCUPATION = register('bio_occupation', """
+How would one describe the daily occupation of {name} given the following statements?
+Use a maximum of 120 words. Include only the summary, do not add a title or the like.
+
+Only use the information provided below:
+{memories}
+""", static=('name',))
+
+BIO_PROGRESS = register('bio_progress', """
+How would one describe the recent progress in {name}'s life given the following statements?
+Use a maximum of 120 words. Include only the summary, do not add a title or the like.
+
+Only use the information provided below:
+{memories}
+""", static=('name',))
+
+STATUS = register('status', """
+What would be the current emotional state of {name} based on the records below?
+Use a maximum of 10 words and follow the format below.
+
+The result should be in the third person, specifying who the person being referred to is.
+
+Format:
+Status: <FILL IN>
+
+Information (Records):
+{memories}
+""", static=('name',))
+
+RESPONSE = register('response', """
+What should {name} say? Remember to use only the information provided to you below. Respond in English and
+MANDATORY use the format below.
+
+Format:
+Response: <FILL IN>
+
+Current Date: {date}
+{possessive} State: {status}
+Current Location: {location}
+
+Observation:
+{observation}
+
+Summary of {name} and their relationship with {speaker}:
+{summaries}
+
+Possible action to take:
+{action}
+
+Below is the conversation history up to this point:
+{conversation}
+""", static=('name', 'possessive'))
+
+CONVERSATION_SUMMARY = register('conversation_summary', """
+Write a new summary of the whole conversation below from the point of view of {name}, keeping the names, facts and
+promises mentioned. Use a maximum of 120 words. Include only the summary, do not add a title or the like.
+
+Summary of the conversation so far:
+{summary}
+
+Continuation of the conversation:
+{conversation}
+""", static=('name',))
+
+SPEAKER_ACTION = register('speaker_action', """
+Using only the conversation below,
+What high-level action is the person talking to {name} taking? Describe the action in a sentence.
+Use a maximum of 20 words and MANDATORY use the format below.
+
+The result must be in 3rd person clarifying who the person is.
+
+Format:
+Action: <FILL IN>
+
+Conversation between {speaker} and {name}:
+{speaker}: {message}
+""", static=('name',))
+
+OBSERVATION = register('observation', """
+Using only the conversation of {name} below,
+What high-level observation can be generated about the conversation (do not infer anything)? Describe the observation in a sentence and do not omit important information.
+
+Use a maximum of 40 words and MANDATORY use the format below.
+
+Format:
+Observation: <FILL IN>
+
+Conversation between {speaker} and {name}:
+{conversation}
+
+Location: {location}
+""", static=('name',))
+
+MEMORY_SUMMARY = register('memory_summary', """
+Using only the records below.
+Make an exact summary that is coherent, concise, and complete. Only put the summary, no titles or things like that.
+MANDATORY, follow the following format.:
+
+Format:
+Summary: <FILL IN>
+
+Information (Records):
+{memories}
+""")
+
+POSSIBLE_ACTION = register('possible_action', """
+Description of {name}:
+{bio}
+Current date: {date}
+State of {name}: {status}
+Location: {location}
+
+Observation:
+{observation}
+
+Relevant context summary of {name}'s memory:
+{summaries}
+
+Should {name} react to the observation? And if so, how should they react to the observation?
+Use a maximum of 10 words and MANDATORY use the format below.
+Do not use information that was not given to you.
+
+Format:
+Action: <FILL IN>
+""", static=('name', 'bio'))
+
+POSE = register('pose', """
+List of moods:
+{moods}
+
+List of poses:
+{poses}
+
+Example:
+neut: neutral # use neut as value, do the same for the rest of the values
+
+My message:
+{message}
+
+Given the message above, what is the correct mood? Use the list of moods above to choose.
+Given the message above, what is the correct pose? Use the list of poses above to choose.
+
+Format:
+
+FullState: <MOOD> /*/ <POSE>
+""", static=('moods', 'poses'))
+
+POSES = register('poses', """
+List of moods:
+{moods}
+
+List of poses:
+{poses}
+
+Example:
+neut: neutral # use neut as value, do the same for the rest of the values
+
+Sentences:
+{sentences}
+
+Given each sentence above, what is the correct mood? Use the list of moods above to choose.
+Given each sentence above, what is the correct pose? Use the list of poses above to choose.
+
+Format (one line per sentence, in the same order):
+1: <MOOD> /*/ <POSE>
+2: <MOOD> /*/ <POSE>
+""", static=('moods', 'poses'))
+
+MEMORY_RATING = register('memory_rating', """
+On a scale from 1 to 10, where 1 is purely mundane (e.g. brushing teeth, making bed, walking the usual route)
+and 10 is impactful (e.g., a breakup, college acceptance), rate the potential significance of the following memory. Only use integers.
+
+Memory:
+{memory}
+
+Format:
+Rating: [<FILL IN>]
+""")
+
+MEMORY_RATINGS = register('memory_ratings', """
+On a scale from 1 to 10, where 1 is purely mundane (e.g. brushing teeth, making bed, walking the usual route)
+and 10 is impactful (e.g., a breakup, college acceptance), rate the potential significance of each of the following memories. Only use integers.
+
+Memories:
+{memories}
+
+Format (one line per memory, in the same order):
+1: Rating: [<FILL IN>]
+2: Rating: [<FILL IN>]
+""")
+
+REFLECTION_QUESTIONS = register('reflection_questions', """
+Taking into account only the records below,
+What are the top 3 high-level questions we can answer about the topics mentioned? (ONLY WRITE THE QUESTIONS, NOT THE ANSWERS)
+
+Format:
+Question 1: <FILL IN>
+Question 2: <FILL IN>
+Question 3: <FILL IN>
+
+Information (Records):
+{memories}
+""")
+
+REFLECTION_INSIGHTS = register('reflection_insights', """
+Using only the statements about {name} provided below,
+What 5 high-level ideas can you deduce from the statements?
+Use a maximum of 20 words per idea (references do not count toward the maximum word count).
+
+It is MANDATORY to follow the following format, there must always be references to the memories that generated the reflection, and these must always be enclosed in brackets, even if it's just a single reference:
+
+Format:
+1. <Insight>. /*/ References: [<FILL IN>]
+2. <Insight>. /*/ References: [<FILL IN>]
+3. <Insight>. /*/ References: [<FILL IN>]
+
+Statements about {name}
+{memories}
+""", static=('name',))
+
+TURN_ANALYSIS = register('turn_analysis', """
+Description of {name}:
+{bio}
+
+Answer the questions below about the conversation of {name} with a JSON object, MANDATORY use the format below and
+do not write anything else.
+
+- "action": What high-level action is the speaker taking? Describe the action in a sentence of a maximum of 20 words,
+  in 3rd person clarifying who the person is.
+- "observation": What high-level observation can be generated about the conversation (do not infer anything)? Describe
+  the observation in a sentence of a maximum of 40 words and do not omit important information.
+- "reaction": Should {name} react to the observation? And if so, how should they react to it? Use a maximum of 10 words.
+
+Current date: {date}
+State of {name}: {status}
+Location: {location}
+
+Conversation between {speaker} and {name}:
+{conversation}
+
+Format:
+{{"action": "<FILL IN>", "observation": "<FILL IN>", "reaction": "<FILL IN>"}}
+""", static=('name', 'bio'))
@@ -0,0 +1,63 @@
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+from src.memory_storage.mongo_store import MemoryMongoStore
+
+
+def memory(memory_id: str) -> dict:
+  return {'_id': memory_id, 'description': f'memory {memory_id}', 'embedding': [1, 0]}
+
+
+@pytest.fixture
+def store():
+  store = MemoryMongoStore('Test', None, flush_interval=3600., max_batch_size=3, client=mongomock.MongoClient())
+  yield store
+  store.close()
+
+
+def test_buffered_inserts_wait_for_the_flush(store):
+  store.store_memories([memory('a'), memory('b')])
+
+  assert store._memory_col.count_documents({}) == 0
+  assert store.retrieve_memory('memory a')['_id'] == 'a'
+
+  store.store_memories([memory('c')])
+
+  assert store._memory_col.count_documents({}) == 3
+  assert store._buffer == []
+
+
+def test_close_flushes_the_buffer(store):
+  store.store_memories([memory('a')])
+  store.close()
+
+  assert store._memory_col.count_documents({}) == 1
+  assert store._memory_col.find_one({'_id': 'a'})['embedding'] == [1., 0.]
+
+
+def test_flush_skips_the_memories_already_stored(store):
+  store.store_memories([memory('a')], buffered=False)
+  store.store_memories([memory('a'), memory('b')])
+  store.flush()
+
+  assert sorted(document['_id'] for document in store._memory_col.find()) == ['a', 'b']
+  assert store._buffer == []
+
+
+def test_failed_flush_keeps_the_memories_in_the_buffer(store, monkeypatch):
+  def insert_many(*args, **kwargs):
+    raise ConnectionError('down')
+
+  store.store_memories([memory('a')])
+  monkeypatch.setattr(store._memory_col, 'insert_many', insert_many)
+
+  with pytest.raises(ConnectionError):
+    store.flush()
+
+  assert [document['_id'] for document in store._buffer] == ['a']
+
+  monkeypatch.undo()
+  store.flush()
+
+  assert store._memory_col.count_documents({}) == 1